@@ -1,7 +1,15 @@
+import os
 import sys
+import json
 import time
+import queue
+import argparse
+import multiprocessing
 import threading
-from datetime import datetime, timedelta
+from types import MappingProxyType
+from collections import namedtuple, deque, OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
 import pytz
 
 from PyQt5.QtWidgets import (
@@ -16,6 +24,62 @@ from PyQt5.QtGui import QFont
 
 import MetaTrader5 as mt5
 
+from protector_core import (
+    pip_step_for, evaluate_breakeven, detect_price_cross, trigger_order_sides,
+    stop_order_levels, trigger_should_activate, CROSS_NONE, CROSS_UP, CROSS_DOWN,
+)
+from tick_cache import TickCacheReader, TICK_CACHE_NAME
+from state_api import StateServer, STATE_API_HOST, STATE_API_PORT
+from event_journal import EventJournal, session_journal_path, JOURNAL_DIR, FSYNC_INTERVAL
+from latency_trace import LatencyTracer, ActionTrace, TRACE_WINDOW
+
+
+# Tham số cài đặt mặc định (chỉ những cái chung cho toàn bộ app, không phải của từng trigger)
+DEFAULT_GLOBAL_PARAMS = {
+    "break_even_pips": 3.0,
+    "break_even_offset": 0.5,
+    "max_loss_per_day": -100.0,
+    "update_interval": 1.0,      # Chu kỳ cập nhật GUI (giây)
+    "tick_interval": 0.25,       # Chu kỳ lấy tick/breakeven/trigger (giây)
+    "history_interval": 30.0,    # Chu kỳ truy vấn lịch sử deal để tính lãi/lỗ ngày (giây)
+    "reconcile_interval": 60.0,  # Chu kỳ đối chiếu sổ 'Giá P' với lệnh chờ trên terminal (giây)
+    "max_triggered_orders": 1000, # Số lệnh tối đa trong sổ 'Giá P' (vượt thì bỏ mục thêm vào lâu nhất)
+    "close_all_at_day_end": False, # Thêm tham số mới
+    "eod_lead_seconds": 0.0,     # Dọn dẹp cuối ngày sớm hơn mốc 00:00 UTC bao nhiêu giây (0: đúng mốc)
+    "eod_stage_seconds": 30.0,   # Bắt đầu chuẩn bị sẵn lô lệnh đóng/hủy bao nhiêu giây trước thời điểm dọn dẹp
+    "tick_cache_name": TICK_CACHE_NAME, # Vùng nhớ của dịch vụ bộ đệm tick (tick_cache.py); "" để luôn hỏi MT5
+    "tick_cache_max_age": 2.0,     # Dịch vụ không cập nhật lâu hơn (giây) thì quay lại hỏi MT5
+    "state_api_host": STATE_API_HOST, # API trạng thái chỉ-đọc (state_api.py) cho dashboard/cảnh báo
+    "state_api_port": STATE_API_PORT, # 0 để tắt; chạy nhiều tài khoản: mặc định cổng này + thứ tự tài khoản
+    "journal_dir": JOURNAL_DIR,       # Thư mục nhật ký sự kiện (event_journal.py); "" để tắt
+    "journal_fsync": FSYNC_INTERVAL,  # Chính sách fsync: always, interval, never
+    "journal_ticks": True,            # Ghi cả sự kiện tick (mỗi tick mới của symbol đang theo dõi)
+    "connection_check_interval": 1.0, # Chu kỳ kiểm tra kết nối terminal/tài khoản (giây)
+    "latency_window": TRACE_WINDOW,   # Số vết gần nhất mỗi loại lệnh dùng cho p50/p95/p99 độ trễ tick->lệnh
+}
+
+# Các trường của request order_send được ghi vào nhật ký sự kiện
+JOURNAL_ORDER_FIELDS = ('symbol', 'position', 'order', 'type', 'volume', 'price', 'sl', 'tp')
+
+# Bộ hẹn giờ dọn dẹp cuối ngày
+EOD_RESTAGE_INTERVAL = 5.0   # Trong cửa sổ chuẩn bị, làm mới lô lệnh đã chuẩn bị mỗi N giây
+EOD_FINAL_STAGE = 1.0        # Lần chuẩn bị cuối cùng N giây trước thời điểm dọn dẹp
+EOD_SPIN_WINDOW = 0.02       # N giây cuối trước thời điểm dọn dẹp ngủ từng đoạn ngắn thay vì chờ sự kiện
+EOD_FALLBACK_GRACE = 2.0     # Bộ hẹn giờ lỡ mốc quá N giây (mất kết nối...) thì tác vụ end_of_day dọn dẹp thay
+
+# Lô request dọn dẹp cuối ngày đã chuẩn bị sẵn: closes là các request đóng lệnh mở (giá điền lúc gửi),
+# cancels là các cặp (symbol, request hủy lệnh chờ), staged_at là thời điểm chuẩn bị (epoch)
+StagedCleanup = namedtuple('StagedCleanup', ['closes', 'cancels', 'staged_at'])
+
+
+def next_end_of_day(now, lead=0.0):
+    """
+    Mốc 00:00 UTC kế tiếp và thời điểm dọn dẹp (mốc - lead), dạng epoch giây. Mốc được chọn sau now + lead,
+    nên ngay sau khi đã dọn dẹp sớm (lead > 0) thời điểm kế tiếp là của ngày hôm sau.
+    """
+    boundary = (int((now + lead) // 86400) + 1) * 86400
+    return boundary, boundary - lead
+
 
 # --- Logger Class ---
 class Logger(QObject):
@@ -30,15 +94,381 @@ class Logger(QObject):
         self.log_signal.emit(message)
 
 
+# --- BrokerGateway Thread ---
+class BrokerGateway(threading.Thread):
+    """
+    Luồng duy nhất được phép gọi thư viện MetaTrader5.
+    Luồng bot và các thao tác trên GUI đều gửi công việc vào hàng đợi của luồng này,
+    nhờ vậy truy cập terminal được tuần tự hóa và luồng giao diện không bao giờ bị chặn.
+    """
+    def __init__(self, logger):
+        super().__init__(daemon=True)
+        self.logger = logger
+        self._jobs = queue.Queue()
+
+    def submit(self, func, *args, **kwargs):
+        """Đưa một công việc vào hàng đợi, trả về Future chứa kết quả."""
+        future = Future()
+        self._jobs.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """Gọi đồng bộ: chờ công việc chạy xong trên luồng gateway và trả về kết quả."""
+        if threading.current_thread() is self:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def stop(self):
+        """Dừng luồng sau khi chạy hết các công việc đã xếp hàng."""
+        self._jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, func, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class GatewaySignals(QObject):
+    """
+    Chuyển kết quả của công việc gateway về luồng GUI.
+    Tham số: (callback, future) - callback sẽ được gọi trên luồng chính với future đã hoàn tất.
+    """
+    job_done_signal = pyqtSignal(object, object)
+
+
+# --- Giám sát kết nối MT5 ---
+class ConnectionSupervisor:
+    """
+    Phát hiện mất kết nối terminal hoặc phiên đăng nhập và kết nối lại với thời gian chờ tăng dần (backoff).
+    Mọi phương thức gọi MT5 chạy trên luồng gateway (từ tác vụ 'connection' của BreakevenProtector).
+    Ghi nhận mỗi lần mất kết nối: lý do, thời gian gián đoạn (từ lúc phát hiện tới khi engine chạy lại),
+    thời gian khôi phục (từ lần thử thành công tới khi engine chạy lại) và số lần thử.
+    """
+    BACKOFF_INITIAL = 1.0   # Giây chờ sau lần thử kết nối lại thất bại đầu tiên
+    BACKOFF_MAX = 60.0      # Giây chờ tối đa giữa hai lần thử
+
+    def __init__(self, credentials=None):
+        # dict(login, password, server, path) hoặc None: kết nối lại terminal mặc định với tài khoản đang mở
+        self.credentials = credentials
+        self.link_up = True
+        self.lost_at = None        # time.monotonic() lúc phát hiện mất kết nối
+        self.lost_reason = None
+        self.attempts = 0          # Số lần thử trong lần mất kết nối hiện tại
+        self.backoff = self.BACKOFF_INITIAL
+        self.next_attempt = 0.0
+        # Thống kê
+        self.outages = 0
+        self.downtime_total = 0.0
+        self.longest_outage = 0.0
+        self.last_outage = None
+
+    def probe(self):
+        """Kiểm tra terminal, kết nối tới server giao dịch và phiên đăng nhập. Trả về None nếu ổn, ngược lại lý do."""
+        terminal = mt5.terminal_info()
+        if terminal is None:
+            return f"mất kết nối tới terminal ({mt5.last_error()})"
+        if not terminal.connected:
+            return "terminal mất kết nối tới server giao dịch"
+        account = mt5.account_info()
+        if account is None:
+            return f"mất phiên đăng nhập ({mt5.last_error()})"
+        if self.credentials and account.login != int(self.credentials['login']):
+            return f"terminal đang đăng nhập tài khoản khác ({account.login})"
+        return None
+
+    def mark_lost(self, reason):
+        self.link_up = False
+        self.lost_at = time.monotonic()
+        self.lost_reason = reason
+        self.attempts = 0
+        self.backoff = self.BACKOFF_INITIAL
+        self.next_attempt = self.lost_at # Thử lại ngay lần đầu
+
+    def reconnect(self):
+        """Một lần thử: khởi tạo lại thư viện, đăng nhập (nếu có thông tin) và kiểm tra lại. Trả về None nếu thành công."""
+        started = time.monotonic()
+        self.attempts += 1
+        credentials = self.credentials or {}
+        mt5.shutdown()
+        init_kwargs = {'path': credentials['path']} if credentials.get('path') else {}
+        if not mt5.initialize(**init_kwargs):
+            error = f"không khởi tạo được MetaTrader5 ({mt5.last_error()})"
+        elif credentials and not mt5.login(int(credentials['login']), password=credentials['password'],
+                                           server=credentials['server']):
+            error = f"đăng nhập thất bại ({mt5.last_error()})"
+        else:
+            error = self.probe()
+        if error:
+            self.next_attempt = started + self.backoff # Tính từ lúc bắt đầu thử, để khớp lưới lịch của tác vụ
+            self.backoff = min(self.backoff * 2, self.BACKOFF_MAX)
+        return error
+
+    def retry_in(self):
+        return max(0.0, self.next_attempt - time.monotonic())
+
+    def mark_recovered(self, attempt_started):
+        """Engine đã chạy lại: cập nhật thống kê và trả về thông tin lần gián đoạn vừa rồi."""
+        now = time.monotonic()
+        outage = {
+            'reason': self.lost_reason,
+            'outage_seconds': round(now - self.lost_at, 3),
+            'recovery_seconds': round(now - attempt_started, 3),
+            'attempts': self.attempts,
+        }
+        self.outages += 1
+        self.downtime_total += outage['outage_seconds']
+        self.longest_outage = max(self.longest_outage, outage['outage_seconds'])
+        self.last_outage = outage
+        self.link_up = True
+        self.lost_at = None
+        return outage
+
+    def status(self) -> dict:
+        return {
+            'link_up': self.link_up,
+            'lost_reason': None if self.link_up else self.lost_reason,
+            'down_seconds': round(time.monotonic() - self.lost_at, 1) if self.lost_at is not None else 0.0,
+            'attempts': self.attempts if not self.link_up else 0,
+            'outages': self.outages,
+            'downtime_total': round(self.downtime_total, 3),
+            'longest_outage': round(self.longest_outage, 3),
+            'last_outage': self.last_outage,
+        }
+
+    def summary(self) -> str:
+        if not self.link_up:
+            return (f"Kết nối: MẤT {time.monotonic() - self.lost_at:.0f}s ({self.lost_reason}), "
+                    f"đã thử {self.attempts} lần, thử lại sau {self.retry_in():.0f}s")
+        if self.last_outage is None:
+            return "Kết nối: ổn định"
+        last = self.last_outage
+        return (f"Kết nối: ổn định | mất {self.outages} lần, tổng {self.downtime_total:.1f}s, lần cuối "
+                f"{last['outage_seconds']:.1f}s (khôi phục {last['recovery_seconds']:.2f}s, {last['attempts']} lần thử)")
+
+
+# --- Định dạng gói tin gọn cho bảng lệnh mở ---
+# Mỗi dòng là một tuple có tên (không có __dict__), so sánh bằng == để phát hiện thay đổi
+PositionRow = namedtuple('PositionRow', [
+    'ticket', 'symbol', 'type', 'volume', 'price_open',
+    'current_price', 'sl', 'tp', 'profit_usd', 'profit_pips'
+])
+
+
+class PositionDelta:
+    """
+    Gói tin delta có đánh số phiên bản gửi từ BreakevenProtector lên GUI.
+    full=True nghĩa là upserts chứa toàn bộ danh sách lệnh (snapshot đầy đủ),
+    ngược lại chỉ chứa các dòng thay đổi (upserts) và các ticket đã đóng (removals).
+    """
+    __slots__ = ('version', 'full', 'upserts', 'removals')
+
+    def __init__(self, version, full, upserts, removals):
+        self.version = version
+        self.full = full
+        self.upserts = upserts    # tuple các PositionRow
+        self.removals = removals  # tuple các ticket
+
+
+# --- Bộ lập lịch đa tần số cho các tác vụ của BreakevenProtector ---
+class PeriodicTask:
+    """
+    Một tác vụ chạy định kỳ với chu kỳ riêng.
+    Lịch chạy bám theo lưới cố định (next_run += interval) nên không bị trôi theo thời gian xử lý;
+    'phase' dùng để lệch pha giữa các tác vụ cùng chu kỳ, tránh chạy dồn vào cùng một thời điểm.
+    """
+    def __init__(self, name, interval, func, phase=0.0):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.phase = phase
+        self.next_run = None
+        # Thống kê độ trễ khởi chạy (so với lịch) và thời gian chạy, đơn vị giây
+        self.runs = 0
+        self.overruns = 0          # Số lần thời gian chạy vượt quá chu kỳ
+        self.skipped_slots = 0     # Số lượt bị bỏ qua do chạy trễ quá một chu kỳ
+        self.lateness_max = 0.0
+        self.lateness_sum = 0.0
+        self.duration_max = 0.0
+        self.recent_lateness = deque(maxlen=256)
+
+    def stats(self):
+        """Trả về dict thống kê độ trễ/overrun của tác vụ."""
+        recent = sorted(self.recent_lateness)
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'overruns': self.overruns,
+            'skipped_slots': self.skipped_slots,
+            'lateness_avg': self.lateness_sum / self.runs if self.runs else 0.0,
+            'lateness_p95': recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+            'lateness_max': self.lateness_max,
+            'duration_max': self.duration_max,
+        }
+
+
+class TaskScheduler:
+    """
+    Lập lịch nhiều PeriodicTask trên một luồng: chạy các tác vụ đến hạn theo thứ tự lịch,
+    ghi nhận độ trễ, phát hiện overrun và ngủ (có thể bị đánh thức bởi stop_event) đến hạn kế tiếp.
+    """
+    def __init__(self, stop_event):
+        self._stop_event = stop_event
+        self.tasks = {}
+
+    def add_task(self, name, interval, func, phase=0.0):
+        self.tasks[name] = PeriodicTask(name, interval, func, phase)
+
+    def set_interval(self, name, interval):
+        """Đổi chu kỳ của tác vụ; lịch mới áp dụng từ lượt chạy kế tiếp."""
+        task = self.tasks[name]
+        if interval > 0 and interval != task.interval:
+            task.interval = interval
+            task.next_run = None
+
+    def reset_schedule(self):
+        """Bắt đầu lại lịch của mọi tác vụ (ví dụ sau khi kết nối lại)."""
+        for task in self.tasks.values():
+            task.next_run = None
+
+    def run_pending(self):
+        """Chạy tất cả tác vụ đã đến hạn, tác vụ trễ nhất chạy trước."""
+        now = time.perf_counter()
+        for task in self.tasks.values():
+            if task.next_run is None:
+                task.next_run = now + task.phase
+        due_tasks = sorted((t for t in self.tasks.values() if t.next_run <= now), key=lambda t: t.next_run)
+        for task in due_tasks:
+            start = time.perf_counter()
+            lateness = start - task.next_run
+            task.func()
+            duration = time.perf_counter() - start
+
+            task.runs += 1
+            task.lateness_sum += lateness
+            task.lateness_max = max(task.lateness_max, lateness)
+            task.recent_lateness.append(lateness)
+            task.duration_max = max(task.duration_max, duration)
+            if duration > task.interval:
+                task.overruns += 1
+
+            # Bám lưới lịch; nếu đã trễ quá một hay nhiều chu kỳ thì bỏ qua các lượt đã lỡ
+            task.next_run += task.interval
+            end = time.perf_counter()
+            if task.next_run <= end:
+                missed = int((end - task.next_run) // task.interval) + 1
+                task.skipped_slots += missed
+                task.next_run += missed * task.interval
+
+    def wait_next(self, max_wait=1.0):
+        """Ngủ đến hạn của tác vụ gần nhất (tối đa max_wait giây). Trả về True nếu stop_event được đặt."""
+        pending = [t.next_run for t in self.tasks.values() if t.next_run is not None]
+        delay = min(pending) - time.perf_counter() if pending else 0.0
+        return self._stop_event.wait(min(max(delay, 0.0), max_wait))
+
+    def stats(self):
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+
+# --- Sổ đăng ký lệnh chờ tạo bởi trigger ---
+class TriggeredOrderRegistry:
+    """
+    Lưu 'Giá P' của các lệnh chờ do trigger đặt, có giới hạn kích thước.
+    - Vượt quá max_size: loại bỏ mục được thêm/cập nhật lâu nhất (đọc không làm mới thứ tự).
+    - reconcile(): đối chiếu với danh sách ticket lệnh chờ còn sống trên terminal,
+      loại bỏ các mục đã khớp/hết hạn/bị broker hủy.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = OrderedDict() # Key: order_ticket, Value: trigger_price_P
+        self.evicted_lru = 0    # Số mục bị loại do vượt giới hạn
+        self.evicted_stale = 0  # Số mục bị loại do không còn trên terminal
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, ticket):
+        return ticket in self._entries
+
+    def add(self, ticket, price_P):
+        """Thêm/cập nhật một lệnh, đưa lên cuối thứ tự (mục mới nhất)."""
+        self._entries[ticket] = price_P
+        self._entries.move_to_end(ticket)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evicted_lru += 1
+
+    def set_max_size(self, max_size):
+        """Đổi giới hạn kích thước; sổ đang vượt giới hạn mới thì loại các mục thêm vào lâu nhất. Trả về số mục đã loại."""
+        self.max_size = max_size
+        evicted = 0
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            evicted += 1
+        self.evicted_lru += evicted
+        return evicted
+
+    def remove(self, ticket):
+        """Xóa một lệnh. Trả về True nếu lệnh có trong sổ."""
+        return self._entries.pop(ticket, None) is not None
+
+    def reconcile(self, live_tickets):
+        """
+        Giữ lại các lệnh còn sống, loại bỏ phần còn lại.
+        Trả về số mục đã loại bỏ.
+        """
+        stale = [ticket for ticket in self._entries if ticket not in live_tickets]
+        for ticket in stale:
+            del self._entries[ticket]
+        self.evicted_stale += len(stale)
+        return len(stale)
+
+    def snapshot(self):
+        """Bản chụp chỉ-đọc để GUI sử dụng."""
+        return MappingProxyType(dict(self._entries))
+
+
+def open_event_journal(params, logger, prefix="session"):
+    """Mở nhật ký sự kiện của phiên theo tham số (journal_dir, journal_fsync); None nếu tắt hoặc không mở được."""
+    if not params.get('journal_dir'):
+        return None
+    journal = EventJournal(session_journal_path(params['journal_dir'], prefix),
+                           params.get('journal_fsync', FSYNC_INTERVAL), logger=logger)
+    if not journal.open():
+        return None
+    journal.record('session_start', pid=os.getpid(), params=dict(params))
+    return journal
+
+
+def close_event_journal(journal):
+    """Ghi sự kiện kết thúc phiên (kèm thống kê của nhật ký) rồi đóng nhật ký."""
+    if journal is not None:
+        journal.record('session_end', journal=journal.stats())
+        journal.close()
+
+
 # --- BreakevenProtectorSignals Class ---
 class BreakevenProtectorSignals(QObject):
     """
     Lớp này chứa các tín hiệu (signals) mà BreakevenProtector thread
     sẽ phát ra để cập nhật thông tin lên GUI của MainWindow.
     """
-    position_update_signal = pyqtSignal(list) # Dùng để cập nhật bảng lệnh mở
+    # Dùng để cập nhật bảng lệnh mở bằng PositionDelta.
+    # Kiểu object: Qt chỉ chuyển tham chiếu qua luồng, không chuyển đổi/copy từng phần tử như list
+    position_update_signal = pyqtSignal(object)
     # Signal mới để cập nhật bảng lệnh kích hoạt đang theo dõi
     trigger_monitor_update_signal = pyqtSignal(list)
+    # Thống kê công việc đã bỏ qua trong mỗi vòng lặp (tick không đổi)
+    cycle_stats_signal = pyqtSignal(dict)
+    # Thống kê độ trễ/overrun của từng tác vụ trong bộ lập lịch
+    scheduler_stats_signal = pyqtSignal(dict)
 
 
 # --- BreakevenProtector Thread ---
@@ -48,9 +478,13 @@ class BreakevenProtector(threading.Thread):
     tính toán P/L, áp dụng bảo vệ Breakeven và giám sát giới hạn lỗ,
     và xử lý lệnh đặc biệt (Order Trigger).
     """
-    def __init__(self, logger, initial_params, constants): ## NEW: Thêm constants
+    def __init__(self, logger, initial_params, constants, gateway, state_server=None, journal=None): ## NEW: Thêm constants
         super().__init__()
         self.logger = logger
+        self.gateway = gateway   # Mọi truy cập MT5 đi qua BrokerGateway
+        self.state_server = state_server # API trạng thái chỉ-đọc (có thể None); publish không bao giờ chặn engine
+        self.journal = journal   # Nhật ký sự kiện có cấu trúc (có thể None); record không bao giờ chặn engine
+        self._stop_event = threading.Event() # Đánh thức vòng lặp ngay khi dừng
         self.running = True      # Cờ điều khiển vòng lặp chính của thread
         self.connected = False   # Cờ trạng thái kết nối MT5
         self.params = initial_params.copy() # Tham số cài đặt bot, bản sao riêng cho thread
@@ -58,6 +492,48 @@ class BreakevenProtector(threading.Thread):
         self.signals = BreakevenProtectorSignals() # Instance của lớp signals
         self.constants = constants ## NEW: Lưu các hằng số
 
+        # Bộ lập lịch: mỗi phân hệ chạy với chu kỳ riêng.
+        # Tác vụ dùng MT5 được chạy trên luồng gateway; tác vụ GUI chỉ phát signal nên chạy tại chỗ.
+        self.scheduler = TaskScheduler(self._stop_event)
+        self.scheduler.add_task('tick', self.params.get('tick_interval', 0.25),
+                                lambda: self.gateway.call(self._tick_task))
+        self.scheduler.add_task('gui', self.params.get('update_interval', 1.0), self._gui_task, phase=0.05)
+        self.scheduler.add_task('end_of_day', 1.0,
+                                lambda: self.gateway.call(self._end_of_day_task), phase=0.1)
+        self.scheduler.add_task('history', self.params.get('history_interval', 30.0),
+                                lambda: self.gateway.call(self._daily_pnl_task), phase=0.15)
+        self.scheduler.add_task('reconcile_orders', self.params.get('reconcile_interval', 60.0),
+                                lambda: self.gateway.call(self._reconcile_triggered_orders_task), phase=0.2)
+        self.scheduler.add_task('connection', self.params.get('connection_check_interval', 1.0),
+                                lambda: self.gateway.call(self._connection_task), phase=0.25)
+
+        # Giám sát kết nối: khi mất terminal/phiên đăng nhập, các tác vụ dùng MT5 tạm dừng (trigger, lệnh
+        # và giá trước đó của trigger giữ nguyên) cho tới khi tác vụ 'connection' kết nối lại được
+        self.connection = ConnectionSupervisor()
+
+        # Kết quả mới nhất của tác vụ tick, được tác vụ GUI gửi đi theo chu kỳ riêng
+        self._latest_position_rows = {}
+        self._latest_trigger_monitor_data = []
+        self._latest_cycle_stats = None
+        self._current_utc_day = None # Biến để theo dõi ngày UTC
+        # Bộ hẹn giờ dọn dẹp cuối ngày: luồng riêng ngủ tới đúng thời điểm dọn dẹp và chuẩn bị sẵn lô lệnh trước đó
+        self._eod_wakeup = threading.Event()  # Đánh thức bộ hẹn giờ khi dừng hoặc đổi tham số
+        self._eod_done_boundary = int(time.time() // 86400) * 86400  # Mốc 00:00 UTC (epoch) đã dọn dẹp gần nhất
+        self._eod_pending_boundary = None     # Mốc vừa qua mà bộ hẹn giờ chưa dọn (tác vụ end_of_day dọn thay)
+        # Đang dọn dẹp cuối ngày: trigger không được đặt lệnh từ lúc bắt đầu dọn tới khi engine xóa xong trigger
+        self._eod_triggers_frozen = False
+        self.eod_status = {}                  # Trạng thái bộ hẹn giờ (lô đã chuẩn bị, lần dọn dẹp gần nhất)
+        self.daily_profit_today = None # Tổng lãi/lỗ đã chốt trong ngày (UTC), cập nhật bởi tác vụ history
+
+        # Tick/thông số symbol từ dịch vụ bộ đệm tick dùng chung nếu đang chạy (không khóa, không gọi terminal)
+        tick_cache_name = self.params.get('tick_cache_name')
+        self.tick_cache = TickCacheReader(tick_cache_name, self.params.get('tick_cache_max_age', 2.0)) \
+            if tick_cache_name else None
+        self.tick_cache_fallbacks = 0 # Số lần phải hỏi MT5 vì bộ đệm không có dữ liệu
+
+        # Độ trễ tick->lệnh (latency_trace.py): vết của mỗi lệnh breakeven/trigger, percentile theo loại lệnh
+        self.latency = LatencyTracer(self.params.get('latency_window', TRACE_WINDOW))
+
         # Set để lưu các symbol đã cảnh báo về stops_level/freeze_level (thiếu)
         self.warned_symbols_for_stops_level = set()
         # Set mới để lưu các symbol đã được thông báo là hỗ trợ (đủ)
@@ -66,9 +542,15 @@ class BreakevenProtector(threading.Thread):
         # Set để lưu các ticket đã gặp lỗi dịch SL và đã được báo cáo
         self.reported_sl_modify_errors = set()
 
-        # Dictionary để lưu thông tin 'Giá P' của các lệnh chờ đã được tạo bởi trigger
-        # Key: order_ticket, Value: trigger_price_P
-        self.triggered_orders_P_price = {}
+        # Sổ lưu thông tin 'Giá P' của các lệnh chờ đã được tạo bởi trigger
+        # Key: order_ticket, Value: trigger_price_P (có giới hạn kích thước, đối chiếu định kỳ với terminal)
+        self.triggered_orders_P_price = TriggeredOrderRegistry(self.params.get('max_triggered_orders', 1000))
+        # Bản chụp chỉ-đọc của sổ trên, được thay thế nguyên khối mỗi khi thay đổi để GUI đọc an toàn
+        self.triggered_orders_snapshot = MappingProxyType({})
+
+        # Hàng đợi lệnh từ GUI: mọi thay đổi trạng thái engine được xếp hàng
+        # và chỉ được áp dụng bởi engine ở đầu mỗi vòng lặp (không cần khóa trong vòng lặp nóng)
+        self._commands = queue.SimpleQueue()
 
         # --- NEW: Quản lý nhiều lệnh kích hoạt ---
         # Danh sách các dict, mỗi dict đại diện cho một lệnh kích hoạt
@@ -79,21 +561,111 @@ class BreakevenProtector(threading.Thread):
         # Biến đếm để tạo unique ID cho mỗi trigger
         self._next_trigger_id = 1
 
+        # --- Watermark tick theo symbol: bỏ qua công việc khi tick không đổi ---
+        # Key: symbol, Value: (time_msc, bid, ask) của tick đã xử lý ở vòng trước
+        self.tick_watermarks = {}
+        # Dòng dữ liệu đã tính ở vòng trước, dùng lại cho symbol có tick không đổi
+        self._last_position_rows = {}    # Key: ticket, Value: PositionRow đã tính
+        self._last_position_state = {}   # Key: ticket, Value: (sl, tp, volume)
+        self._last_trigger_rows = {}     # Key: trigger_id, Value: dict dữ liệu gửi GUI
+        # Chữ ký tham số breakeven của vòng trước; thay đổi thì phải tính lại toàn bộ
+        self._last_params_signature = None
+        # Bộ đếm tích lũy công việc đã bỏ qua nhờ watermark
+        self.skip_counters = {
+            'cycles': 0,
+            'positions': 0, 'positions_skipped': 0,
+            'triggers': 0, 'triggers_skipped': 0,
+        }
+
+        # --- Delta cho bảng lệnh mở ---
+        self._sent_position_rows = {}          # Key: ticket, Value: PositionRow GUI đang hiển thị
+        self._position_payload_version = 0    # Số phiên bản tăng dần của mỗi gói delta
+        self._full_snapshot_requested = True  # Gói đầu tiên luôn là snapshot đầy đủ
+
 
     def stop(self):
         """Dừng luồng một cách an toàn."""
         self.running = False
+        self._stop_event.set()
+        self._eod_wakeup.set()
 
+    # --- Giao diện lệnh cho GUI: chỉ xếp hàng, engine sẽ áp dụng ở đầu vòng lặp ---
     def set_breakeven_on(self, status):
         """Thiết lập trạng thái bật/tắt của Breakeven Protector."""
-        self.breakeven_on = status
+        self._commands.put((self._apply_breakeven_on, (status,)))
+
+    def request_full_snapshot(self):
+        """Yêu cầu vòng lặp kế tiếp gửi snapshot đầy đủ của bảng lệnh mở (khi kết nối/reset GUI)."""
+        self._commands.put((self._apply_full_snapshot_request, ()))
 
     def update_global_params(self, new_params):
         """Cập nhật các tham số cấu hình chung (ví dụ: update_interval) từ GUI."""
+        self._commands.put((self._apply_global_params, (dict(new_params),)))
+
+    def add_trigger(self, trigger_config):
+        """Thêm một lệnh kích hoạt mới vào danh sách."""
+        self._commands.put((self._apply_add_trigger, (dict(trigger_config),)))
+
+    def remove_trigger(self, trigger_id):
+        """Xóa một lệnh kích hoạt khỏi danh sách theo ID."""
+        self._commands.put((self._apply_remove_trigger, (trigger_id,)))
+
+    def clear_all_triggers(self):
+        """Xóa tất cả các lệnh kích hoạt khỏi danh sách."""
+        self._commands.put((self._apply_clear_all_triggers, ()))
+
+    def set_connection_credentials(self, credentials):
+        """Thông tin đăng nhập (login, password, server, path) dùng khi tự động kết nối lại."""
+        self._commands.put((self._apply_connection_credentials, (dict(credentials),)))
+
+    def forget_triggered_order(self, ticket):
+        """Bỏ thông tin 'Giá P' của một lệnh chờ (ví dụ khi người dùng hủy lệnh trên GUI)."""
+        self._commands.put((self._apply_forget_triggered_order, (ticket,)))
+
+    def _drain_commands(self):
+        """Áp dụng tất cả các lệnh đang chờ trong hàng đợi (chỉ gọi từ luồng engine)."""
+        while True:
+            try:
+                handler, args = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            handler(*args)
+
+    def _publish_triggered_orders(self):
+        """Thay bản chụp chỉ-đọc của triggered_orders_P_price bằng một bản mới."""
+        self.triggered_orders_snapshot = self.triggered_orders_P_price.snapshot()
+
+    # --- Các handler áp dụng lệnh (chạy trên luồng engine) ---
+    def _apply_breakeven_on(self, status):
+        self.breakeven_on = status
+
+    def _apply_full_snapshot_request(self):
+        self._full_snapshot_requested = True
+
+    def _apply_forget_triggered_order(self, ticket):
+        if self.triggered_orders_P_price.remove(ticket):
+            self._publish_triggered_orders()
+
+    def _apply_connection_credentials(self, credentials):
+        self.connection.credentials = credentials
+
+    def _apply_global_params(self, new_params):
+        if new_params.get('tick_interval', self.params.get('tick_interval')) != self.params.get('tick_interval'):
+            self.latency.reset() # Percentile độ trễ chỉ phản ánh chu kỳ lấy tick mới
         self.params.update(new_params)
+        self.scheduler.set_interval('tick', self.params.get('tick_interval', 0.25))
+        self.scheduler.set_interval('gui', self.params.get('update_interval', 1.0))
+        self.scheduler.set_interval('history', self.params.get('history_interval', 30.0))
+        self.scheduler.set_interval('reconcile_orders', self.params.get('reconcile_interval', 60.0))
+        self.scheduler.set_interval('connection', self.params.get('connection_check_interval', 1.0))
+        self._eod_wakeup.set() # Bộ hẹn giờ cuối ngày tính lại thời điểm theo tham số mới
+        max_triggered_orders = int(self.params.get('max_triggered_orders', 1000))
+        if max_triggered_orders > 0 and max_triggered_orders != self.triggered_orders_P_price.max_size:
+            if self.triggered_orders_P_price.set_max_size(max_triggered_orders):
+                self._publish_triggered_orders()
 
     # --- NEW: Các phương thức để quản lý lệnh kích hoạt ---
-    def add_trigger(self, trigger_config):
+    def _apply_add_trigger(self, trigger_config):
         """Thêm một lệnh kích hoạt mới vào danh sách."""
         # Gán một ID duy nhất cho trigger này
         trigger_config['id'] = self._next_trigger_id
@@ -114,527 +686,942 @@ class BreakevenProtector(threading.Thread):
 
         self.active_triggers.append(trigger_config)
         self.logger.log(f"Đã thêm lệnh kích hoạt mới: ID {trigger_config['id']} cho {trigger_config['symbol']} @ {trigger_config['price_P']}")
+        self._record('trigger_add', trigger_id=trigger_config['id'], symbol=trigger_config['symbol'],
+                     price_P=trigger_config['price_P'], order_type=trigger_config.get('order_type', 'Double Stop'))
         # Nếu đã có cùng ID trong activated_trigger_ids, xóa nó đi để cho phép kích hoạt lại
         if trigger_config['id'] in self.activated_trigger_ids:
             self.activated_trigger_ids.remove(trigger_config['id'])
             self.logger.log(f"Reset trạng thái kích hoạt cho trigger ID {trigger_config['id']}.")
 
-    def remove_trigger(self, trigger_id):
+    def _apply_remove_trigger(self, trigger_id):
         """Xóa một lệnh kích hoạt khỏi danh sách theo ID."""
         original_len = len(self.active_triggers)
         self.active_triggers = [t for t in self.active_triggers if t['id'] != trigger_id]
         if len(self.active_triggers) < original_len:
             self.logger.log(f"Đã xóa lệnh kích hoạt ID: {trigger_id}.")
+            self._record('trigger_remove', trigger_id=trigger_id)
             # Xóa khỏi set đã kích hoạt nếu có
             if trigger_id in self.activated_trigger_ids:
                 self.activated_trigger_ids.remove(trigger_id)
         else:
             self.logger.log(f"Không tìm thấy lệnh kích hoạt ID: {trigger_id} để xóa.")
 
-    def clear_all_triggers(self):
+    def _apply_clear_all_triggers(self):
         """Xóa tất cả các lệnh kích hoạt khỏi danh sách."""
         num_cleared = len(self.active_triggers)
         self.active_triggers.clear()
         self.activated_trigger_ids.clear() # Đảm bảo reset trạng thái kích hoạt
         self._next_trigger_id = 1 # Reset ID counter
         self.logger.log(f"Đã xóa tất cả {num_cleared} lệnh kích hoạt.")
+        self._record('trigger_clear', cleared=num_cleared)
+
+    def _apply_end_of_day_trigger_clear(self):
+        """Xóa trigger sau dọn dẹp cuối ngày rồi cho phép trigger (mới) hoạt động lại."""
+        self._apply_clear_all_triggers()
+        self._eod_triggers_frozen = False
+
+    def _record(self, kind, **fields):
+        """Ghi một sự kiện vào nhật ký (nếu có); chỉ xếp hàng, luồng ghi nền mới chạm tới đĩa."""
+        if self.journal is not None:
+            self.journal.record(kind, **fields)
+
+    def _send_order(self, action, request, trace=None, **context):
+        """
+        mt5.order_send kèm ghi nhật ký: các trường chính của request, retcode, ticket kết quả và độ trễ
+        của lời gọi (ms). context: các trường bổ sung (ví dụ trigger_id, SL cũ).
+        trace: (tick time_msc, time.time() và perf_counter lúc đọc tick, perf_counter lúc ra quyết định) để ghi
+        vết độ trễ tick->lệnh; các đoạn độ trễ được thêm vào thống kê và vào sự kiện nhật ký.
+        """
+        started = time.perf_counter()
+        result = mt5.order_send(request)
+        finished = time.perf_counter()
+        latency_ms = (finished - started) * 1000
+        segments = None
+        if trace is not None:
+            segments = self.latency.add(ActionTrace(action, request.get('symbol', context.get('symbol')), *trace,
+                                                    started, finished, result.retcode if result else None))
+        if self.journal is not None:
+            ok = result is not None and result.retcode == mt5.TRADE_RETCODE_DONE
+            fields = {key: request[key] for key in JOURNAL_ORDER_FIELDS if key in request}
+            fields.update(context)
+            fields.update(action=action, ok=ok, retcode=result.retcode if result else None,
+                          result_order=result.order if result else None, latency_ms=round(latency_ms, 3))
+            if not ok:
+                fields['error'] = mt5.last_error()
+            if segments is not None:
+                fields.update(segments, tick_time_msc=trace[0],
+                              poll_interval_ms=round(self.scheduler.tasks['tick'].interval * 1000))
+            self.journal.record('order', **fields)
+        return result
+
+    def _update_tick_watermark(self, symbol, tick):
+        """
+        So sánh tick mới với watermark (time_msc, bid, ask) của symbol.
+        Trả về True nếu tick đã thay đổi (và cập nhật watermark), False nếu giống hệt vòng trước.
+        """
+        watermark = (getattr(tick, 'time_msc', 0), tick.bid, tick.ask)
+        if self.tick_watermarks.get(symbol) == watermark:
+            return False
+        self.tick_watermarks[symbol] = watermark
+        return True
+
+    def _read_market_data(self, sym):
+        """Thông số và tick của symbol: từ bộ đệm tick dùng chung nếu có, ngược lại hỏi terminal."""
+        if self.tick_cache is not None:
+            s_info = self.tick_cache.symbol_info(sym)
+            s_tick = self.tick_cache.tick(sym) if s_info is not None else None
+            if s_tick is not None:
+                return s_info, s_tick
+            self.tick_cache_fallbacks += 1
+        return mt5.symbol_info(sym), mt5.symbol_info_tick(sym)
+
+    def _emit_position_delta(self, position_rows):
+        """
+        So sánh các dòng vừa tính với những gì GUI đang hiển thị và chỉ gửi phần thay đổi.
+        Gửi snapshot đầy đủ khi được yêu cầu (kết nối/reset). Không có thay đổi thì không phát signal.
+        """
+        if self._full_snapshot_requested:
+            self._full_snapshot_requested = False
+            full = True
+            upserts = tuple(position_rows.values())
+            removals = ()
+        else:
+            full = False
+            sent_rows = self._sent_position_rows
+            upserts = tuple(row for ticket, row in position_rows.items() if sent_rows.get(ticket) != row)
+            removals = tuple(ticket for ticket in sent_rows if ticket not in position_rows)
+            if not upserts and not removals:
+                return
 
-    def _perform_end_of_day_cleanup(self):
-        """Đóng tất cả lệnh mở, hủy lệnh chờ và xóa trigger khi sang ngày mới UTC."""
-        self.logger.log("--- BẮT ĐẦU DỌN DẸP CUỐI NGÀY (UTC) ---")
-
-        # 1. Đóng tất cả các lệnh đang mở (positions)
-        self.logger.log("Đang đóng tất cả các lệnh đang mở...")
+        self._sent_position_rows = position_rows
+        self._position_payload_version += 1
+        self.signals.position_update_signal.emit(
+            PositionDelta(self._position_payload_version, full, upserts, removals)
+        )
+
+    def _stage_end_of_day_requests(self):
+        """
+        Chuẩn bị sẵn request đóng mọi lệnh mở và hủy mọi lệnh chờ (luồng gateway), để lúc dọn dẹp chỉ còn
+        gửi liền một lô. Giá đóng lệnh điền lúc gửi. Trả về StagedCleanup, hoặc None nếu truy vấn lỗi.
+        """
         positions = mt5.positions_get()
-        if not positions:
-            self.logger.log("Không có lệnh nào đang mở để đóng.")
-        else:
-            closed_count = 0
-            failed_count = 0
-            for pos in positions:
-                tick = mt5.symbol_info_tick(pos.symbol)
-                if not tick:
-                    self.logger.log(f"Lỗi: Không thể lấy tick data cho '{pos.symbol}' để đóng lệnh {pos.ticket}.")
-                    failed_count += 1
-                    continue
+        orders = mt5.orders_get()
+        if positions is None or orders is None:
+            return None
+        closes = []
+        for pos in positions:
+            closes.append({
+                "action": mt5.TRADE_ACTION_DEAL,
+                "position": pos.ticket,
+                "symbol": pos.symbol,
+                "volume": pos.volume,
+                "type": mt5.ORDER_TYPE_SELL if pos.type == mt5.ORDER_TYPE_BUY else mt5.ORDER_TYPE_BUY,
+                "price": 0.0,
+                "deviation": 20,
+                "magic": pos.magic,
+                "comment": "End of Day Cleanup (UTC)",
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_IOC,
+            })
+        cancels = [(order.symbol, {
+            "action": mt5.TRADE_ACTION_REMOVE,
+            "order": order.ticket,
+            "comment": "End of Day Cleanup (UTC)"
+        }) for order in orders]
+        return StagedCleanup(closes, cancels, time.time())
+
+    def _send_cleanup_batch(self, staged, report, latencies, lines):
+        """
+        Gửi liền các request của lô: giá đóng lệnh lấy từ một lần đọc tick cho mỗi symbol ngay trước khi gửi.
+        Cập nhật report, thêm độ trễ từng lệnh (ms) vào latencies; dòng log gom vào lines để ghi sau khi gửi xong.
+        """
+        ticks = {}
+        for request in staged.closes:
+            sym, ticket = request['symbol'], request['position']
+            if sym not in ticks:
+                ticks[sym] = mt5.symbol_info_tick(sym)
+            tick = ticks[sym]
+            if not tick:
+                lines.append(f"Lỗi: Không thể lấy tick data cho '{sym}' để đóng lệnh {ticket}.")
+                report['close_failed'] += 1
+                continue
+            request['price'] = tick.bid if request['type'] == mt5.ORDER_TYPE_SELL else tick.ask
+            started = time.perf_counter()
+            result = self._send_order('eod_close', request)
+            latency_ms = (time.perf_counter() - started) * 1000
+            latencies.append(latency_ms)
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                lines.append(f"  -> Đã đóng lệnh {ticket} ({sym}) thành công ({latency_ms:.1f} ms).")
+                report['closed'] += 1
+            else:
+                lines.append(f"  -> LỖI đóng lệnh {ticket}: {result.retcode if result else 'None'} "
+                             f"({mt5.last_error()}) ({latency_ms:.1f} ms)")
+                report['close_failed'] += 1
+
+        for sym, request in staged.cancels:
+            started = time.perf_counter()
+            result = self._send_order('eod_cancel', request, symbol=sym)
+            latency_ms = (time.perf_counter() - started) * 1000
+            latencies.append(latency_ms)
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                lines.append(f"  -> Đã hủy lệnh chờ {request['order']} ({sym}) thành công ({latency_ms:.1f} ms).")
+                report['cancelled'] += 1
+            else:
+                lines.append(f"  -> LỖI hủy lệnh chờ {request['order']}: {result.retcode if result else 'None'} "
+                             f"({mt5.last_error()}) ({latency_ms:.1f} ms)")
+                report['cancel_failed'] += 1
+
+    def _perform_end_of_day_cleanup(self, boundary, staged=None, fire_at=None):
+        """
+        Dọn dẹp cuối ngày cho mốc 00:00 UTC boundary (epoch, luồng gateway): gửi liền lô request đóng lệnh mở/hủy
+        lệnh chờ (bộ hẹn giờ đã chuẩn bị sẵn; staged None thì chuẩn bị ngay), quét lại một lần cho lệnh phát sinh
+        sau lần chuẩn bị cuối, rồi xóa trigger. fire_at: thời điểm hẹn (mặc định là mốc), để đo độ trễ kích hoạt.
+        Mỗi mốc chỉ dọn một lần dù bộ hẹn giờ và tác vụ end_of_day cùng gọi.
+        """
+        if boundary <= self._eod_done_boundary:
+            return
+        self._eod_done_boundary = boundary
+        self._eod_pending_boundary = None
+        self._eod_triggers_frozen = True
+        started = time.perf_counter()
+        delay_ms = (time.time() - (fire_at if fire_at is not None else boundary)) * 1000
+        self.logger.log("--- BẮT ĐẦU DỌN DẸP CUỐI NGÀY (UTC) ---")
+        self._record('eod_cleanup', stage='begin', boundary=boundary, delay_ms=round(delay_ms, 3),
+                     staged_ahead=staged is not None)
+
+        report = {'closed': 0, 'close_failed': 0, 'cancelled': 0, 'cancel_failed': 0}
+        latencies, lines = [], []
+        if staged is None:
+            staged = self._stage_end_of_day_requests() or StagedCleanup([], [], time.time())
+        self._send_cleanup_batch(staged, report, latencies, lines)
+        batch_ms = (time.perf_counter() - started) * 1000
+
+        # Quét lại: lệnh mở/lệnh chờ phát sinh sau lần chuẩn bị cuối (lệnh đã gửi trong lô không gửi lại)
+        swept = 0
+        latest = self._stage_end_of_day_requests()
+        if latest is not None:
+            sent_positions = {request['position'] for request in staged.closes}
+            sent_orders = {request['order'] for _, request in staged.cancels}
+            leftover = StagedCleanup([request for request in latest.closes if request['position'] not in sent_positions],
+                                     [item for item in latest.cancels if item[1]['order'] not in sent_orders],
+                                     latest.staged_at)
+            swept = len(leftover.closes) + len(leftover.cancels)
+            if swept:
+                lines.append(f"Quét lại: thêm {swept} lệnh phát sinh sau lần chuẩn bị cuối.")
+                self._send_cleanup_batch(leftover, report, latencies, lines)
+
+        for line in lines:
+            self.logger.log(line)
+        # Xóa tất cả các lệnh kích hoạt đang theo dõi: xếp hàng cho engine áp dụng (chỉ luồng engine sửa trigger);
+        # tới lúc đó _tick_task không cho trigger đặt lệnh (_eod_triggers_frozen)
+        self._commands.put((self._apply_end_of_day_trigger_clear, ()))
+        total_ms = (time.perf_counter() - started) * 1000
+
+        ordered = sorted(latencies)
+        timing = {
+            'delay_ms': round(delay_ms, 3),
+            'batch_ms': round(batch_ms, 3),
+            'total_ms': round(total_ms, 3),
+            'order_p50_ms': round(ordered[len(ordered) // 2], 3) if ordered else None,
+            'order_max_ms': round(ordered[-1], 3) if ordered else None,
+            'swept': swept,
+        }
+        self.eod_status['last_cleanup'] = dict(report, boundary=boundary, **timing)
+        self._record('eod_cleanup', stage='end', boundary=boundary, **report, **timing)
+        per_order = f"mỗi lệnh p50 {timing['order_p50_ms']:.1f} ms, max {timing['order_max_ms']:.1f} ms" \
+            if ordered else "không có lệnh nào"
+        self.logger.log(f"Hoàn tất: đóng {report['closed']} lệnh ({report['close_failed']} lỗi), hủy {report['cancelled']} "
+                        f"lệnh chờ ({report['cancel_failed']} lỗi). Trễ so với thời điểm hẹn {delay_ms:.1f} ms, "
+                        f"lô lệnh {batch_ms:.1f} ms ({per_order}), tổng {total_ms:.1f} ms.")
+        self.logger.log("--- KẾT THÚC DỌN DẸP CUỐI NGÀY (UTC) ---")
 
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "position": pos.ticket,
-                    "symbol": pos.symbol,
-                    "volume": pos.volume,
-                    "deviation": 20,
-                    "magic": pos.magic,
-                    "comment": "End of Day Cleanup (UTC)",
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,
-                }
-
-                if pos.type == mt5.ORDER_TYPE_BUY:
-                    request["type"] = mt5.ORDER_TYPE_SELL
-                    request["price"] = tick.bid
-                else: # SELL
-                    request["type"] = mt5.ORDER_TYPE_BUY
-                    request["price"] = tick.ask
-
-                result = mt5.order_send(request)
-                if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                    self.logger.log(f"  -> Đã đóng lệnh {pos.ticket} ({pos.symbol}) thành công.")
-                    closed_count += 1
-                else:
-                    self.logger.log(f"  -> LỖI đóng lệnh {pos.ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
-                    failed_count += 1
-            self.logger.log(f"Hoàn tất đóng lệnh: {closed_count} thành công, {failed_count} thất bại.")
+    def _sleep_until(self, wall_time):
+        """
+        Bộ hẹn giờ cuối ngày ngủ tới thời điểm wall_time (epoch): chờ sự kiện tới sát thời điểm rồi ngủ từng đoạn
+        ngắn trong EOD_SPIN_WINDOW giây cuối để dậy đúng giờ. Trả về False nếu bị đánh thức sớm (dừng/đổi tham số).
+        """
+        while True:
+            remaining = wall_time - time.time()
+            if remaining <= 0:
+                return True
+            if remaining > EOD_SPIN_WINDOW:
+                if self._eod_wakeup.wait(remaining - EOD_SPIN_WINDOW):
+                    return False
+            else:
+                time.sleep(remaining / 2 if remaining > 0.001 else 0)
 
-        # 2. Hủy tất cả các lệnh chờ (pending orders)
-        self.logger.log("Đang hủy tất cả các lệnh chờ...")
-        orders = mt5.orders_get()
-        if not orders:
-            self.logger.log("Không có lệnh chờ nào để hủy.")
-        else:
-            cancelled_count = 0
-            failed_count = 0
-            for order in orders:
-                request = {
-                    "action": mt5.TRADE_ACTION_REMOVE,
-                    "order": order.ticket,
-                    "comment": "End of Day Cleanup (UTC)"
-                }
-                result = mt5.order_send(request)
-                if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                    self.logger.log(f"  -> Đã hủy lệnh chờ {order.ticket} ({order.symbol}) thành công.")
-                    cancelled_count += 1
-                else:
-                    self.logger.log(f"  -> LỖI hủy lệnh chờ {order.ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
-                    failed_count += 1
-            self.logger.log(f"Hoàn tất hủy lệnh chờ: {cancelled_count} thành công, {failed_count} thất bại.")
+    def _eod_gateway_call(self, func, *args):
+        """Gọi func trên luồng gateway từ bộ hẹn giờ cuối ngày; bỏ qua khi mất kết nối, lỗi thì chỉ ghi log."""
+        if not self.running or not self.connected or not self.connection.link_up:
+            return None
+        try:
+            return self.gateway.call(func, *args)
+        except Exception as e:
+            self.logger.log(f"Lỗi bộ hẹn giờ dọn dẹp cuối ngày: {e}")
+            return None
+
+    def _end_of_day_timer(self):
+        """
+        Luồng bộ hẹn giờ dọn dẹp cuối ngày: ngủ tới eod_stage_seconds giây trước thời điểm dọn dẹp
+        (mốc 00:00 UTC - eod_lead_seconds), chuẩn bị sẵn lô lệnh và làm mới mỗi EOD_RESTAGE_INTERVAL giây tới
+        EOD_FINAL_STAGE giây trước thời điểm đó, rồi dậy đúng thời điểm và gửi cả lô qua gateway ngay.
+        Đổi tham số hoặc dừng luồng sẽ đánh thức bộ hẹn giờ để tính lại từ đầu.
+        """
+        while self.running:
+            self._eod_wakeup.clear()
+            lead = max(0.0, float(self.params.get('eod_lead_seconds', 0.0)))
+            stage_ahead = max(EOD_FINAL_STAGE, float(self.params.get('eod_stage_seconds', 30.0)))
+            boundary, fire_at = next_end_of_day(time.time(), lead)
+            enabled = self.params.get('close_all_at_day_end', False)
+            self.eod_status.update(enabled=enabled, next_fire=fire_at, lead_seconds=lead,
+                                   staged_closes=None, staged_cancels=None, staged_at=None)
+            if not enabled or boundary <= self._eod_done_boundary:
+                # Tắt (hoặc mốc này đã dọn): chỉ chờ đổi tham số hoặc qua thời điểm dọn dẹp
+                self._eod_wakeup.wait(max(fire_at - time.time(), 0.0) + EOD_FINAL_STAGE)
+                continue
+            if not self._sleep_until(fire_at - stage_ahead):
+                continue
 
-        # 3. Xóa tất cả các lệnh kích hoạt đang theo dõi
-        self.logger.log("Đang xóa tất cả các lệnh kích hoạt đang theo dõi...")
-        self.clear_all_triggers()
-        self.logger.log("--- KẾT THÚC DỌN DẸP CUỐI NGÀY (UTC) ---")
+            staged = None
+            while True:
+                staged = self._eod_gateway_call(self._stage_end_of_day_requests) or staged
+                if staged is not None:
+                    self.eod_status.update(staged_closes=len(staged.closes), staged_cancels=len(staged.cancels),
+                                           staged_at=staged.staged_at)
+                if time.time() >= fire_at - EOD_FINAL_STAGE:
+                    break
+                if not self._sleep_until(min(time.time() + EOD_RESTAGE_INTERVAL, fire_at - EOD_FINAL_STAGE)):
+                    break
+            if self._eod_wakeup.is_set() or not self._sleep_until(fire_at):
+                continue
+            if self.params.get('close_all_at_day_end', False):
+                self._eod_gateway_call(self._perform_end_of_day_cleanup, boundary, staged, fire_at)
 
     def run(self):
         """Phương thức chính của luồng, chứa logic hoạt động của bot."""
         self.logger.log("Đang chờ kết nối MT5...")
         # Chờ cho đến khi MT5 được kết nối
         while self.running and not self.connected:
-            time.sleep(1)
+            self._drain_commands()
+            self._stop_event.wait(1)
         if not self.running: # Kiểm tra lại nếu luồng bị dừng trong lúc chờ kết nối
             return
         self.logger.log("MT5 đã kết nối! Bắt đầu giám sát các lệnh.")
-
-        previous_loss = None   # Biến để theo dõi tổng lỗ ngày hôm trước
-        current_utc_day = None # Biến để theo dõi ngày UTC
+        self._record('engine_start', breakeven_on=self.breakeven_on, triggers=len(self.active_triggers))
+        threading.Thread(target=self._end_of_day_timer, name='EndOfDayTimer', daemon=True).start()
 
         while self.running:
-            # Lấy các tham số cấu hình chung mới nhất từ GUI (ví dụ: update_interval)
-            update_interval = self.params.get('update_interval', 5.0)
-            max_loss_per_day = self.params.get('max_loss_per_day', -100.0)
-            break_even_pips = self.params.get('break_even_pips', 3.0)
-            break_even_offset = self.params.get('break_even_offset', 0.5)
-            close_all_at_day_end = self.params.get('close_all_at_day_end', False)
+            # Áp dụng các thay đổi từ GUI trước khi chạy các tác vụ của vòng này
+            self._drain_commands()
 
             if not self.connected: # Nếu bị ngắt kết nối trong lúc chạy
-                time.sleep(1)
+                self.scheduler.reset_schedule()
+                self._stop_event.wait(1)
                 continue
 
-            # --- Logic dọn dẹp cuối ngày (UTC) ---
-            now_utc = datetime.now(pytz.utc)
-            today_utc_date = now_utc.date()
+            # Chạy các tác vụ đến hạn (tick/trigger, GUI, cuối ngày, lịch sử) rồi ngủ đến hạn kế tiếp
+            self.scheduler.run_pending()
+            self.scheduler.wait_next()
 
-            # Khởi tạo ngày UTC lần đầu tiên
-            if current_utc_day is None:
-                current_utc_day = today_utc_date
-                self.logger.log(f"Khởi tạo ngày UTC: {current_utc_day}. Chức năng dọn dẹp cuối ngày sẽ bắt đầu từ ngày mai.")
-
-            # Phát hiện khi ngày UTC thay đổi
-            elif today_utc_date > current_utc_day:
-                self.logger.log(f"Phát hiện ngày UTC mới: {today_utc_date}. Ngày cũ: {current_utc_day}.")
-                current_utc_day = today_utc_date # Cập nhật ngày mới
-
-                # Nếu chức năng được bật, thực hiện dọn dẹp
-                if close_all_at_day_end:
-                    self._perform_end_of_day_cleanup()
-                else:
-                    self.logger.log("Chức năng dọn dẹp cuối ngày đang tắt, bỏ qua.")
-
-            # Lấy tất cả các vị thế đang mở
-            positions = mt5.positions_get()
-
-            # Khởi tạo lại dictionary cho mỗi vòng lặp
-            symbol_ticks = {}
-            symbol_infos = {}
-            valid_positions_for_processing = [] # Danh sách các vị thế có đủ thông tin để xử lý
+    def _end_of_day_task(self):
+        """
+        Tác vụ phát hiện sang ngày mới UTC (chạy trên luồng gateway). Dọn dẹp do bộ hẹn giờ cuối ngày thực hiện;
+        tác vụ này chỉ dọn thay khi mốc đã qua quá EOD_FALLBACK_GRACE giây mà bộ hẹn giờ chưa dọn được.
+        """
+        if not self.connected or not self.running or not self.connection.link_up:
+            return
+        close_all_at_day_end = self.params.get('close_all_at_day_end', False)
+
+        # --- Logic dọn dẹp cuối ngày (UTC) ---
+        now_utc = datetime.now(pytz.utc)
+        today_utc_date = now_utc.date()
+
+        # Khởi tạo ngày UTC lần đầu tiên
+        if self._current_utc_day is None:
+            self._current_utc_day = today_utc_date
+            self.logger.log(f"Khởi tạo ngày UTC: {self._current_utc_day}. Chức năng dọn dẹp cuối ngày sẽ bắt đầu từ ngày mai.")
+
+        # Phát hiện khi ngày UTC thay đổi
+        elif today_utc_date > self._current_utc_day:
+            self.logger.log(f"Phát hiện ngày UTC mới: {today_utc_date}. Ngày cũ: {self._current_utc_day}.")
+            self._current_utc_day = today_utc_date # Cập nhật ngày mới
+
+            # Nếu chức năng được bật mà bộ hẹn giờ chưa dọn mốc này, chờ thêm một chút rồi dọn thay
+            boundary = int(now_utc.timestamp() // 86400) * 86400
+            if not close_all_at_day_end:
+                self.logger.log("Chức năng dọn dẹp cuối ngày đang tắt, bỏ qua.")
+            elif boundary > self._eod_done_boundary:
+                self._eod_pending_boundary = boundary
+
+        pending = self._eod_pending_boundary
+        if pending is not None and time.time() - pending >= EOD_FALLBACK_GRACE:
+            if pending > self._eod_done_boundary:
+                self.logger.log("Bộ hẹn giờ chưa dọn dẹp được đúng mốc (mất kết nối?), dọn dẹp ngay.")
+                self._perform_end_of_day_cleanup(pending)
+            self._eod_pending_boundary = None
+
+    def _tick_task(self):
+        """
+        Tác vụ tần số cao (chạy trên luồng gateway): lấy tick, tính P/L, áp dụng breakeven
+        và kiểm tra giao cắt của các trigger. Kết quả hiển thị được tác vụ GUI gửi đi.
+        """
+        # Kiểm tra lại trên luồng gateway: GUI có thể vừa ngắt kết nối trong lúc công việc chờ trong hàng đợi
+        if not self.connected or not self.running or not self.connection.link_up:
+            return
 
-            # Lấy danh sách ticket của các lệnh đang mở hiện tại
-            current_open_position_tickets = {pos.ticket for pos in positions}
+        # Lấy các tham số cấu hình chung mới nhất từ GUI
+        break_even_pips = self.params.get('break_even_pips', 3.0)
+        break_even_offset = self.params.get('break_even_offset', 0.5)
 
-            # Xóa các lỗi đã báo cáo cho các lệnh đã đóng hoặc không còn tồn tại
-            tickets_to_remove = []
-            for ticket in self.reported_sl_modify_errors:
-                if ticket not in current_open_position_tickets:
-                    tickets_to_remove.append(ticket)
-            for ticket in tickets_to_remove:
-                self.reported_sl_modify_errors.remove(ticket)
+        # Lấy tất cả các vị thế đang mở
+        positions = mt5.positions_get()
+        if positions is None:
+            # Lỗi truy vấn (thường do mất kết nối): bỏ qua vòng này, tác vụ 'connection' sẽ kiểm tra và kết nối lại
+            return
 
-            # --- Lấy thông tin symbol và tick cho tất cả các symbol đang mở + trigger symbols ---
-            symbols_to_fetch = {pos.symbol for pos in positions}
-            for trigger in self.active_triggers:
-                symbols_to_fetch.add(trigger['symbol'])
+        # Khởi tạo lại dictionary cho mỗi vòng lặp
+        symbol_ticks = {}
+        symbol_infos = {}
+        valid_positions_for_processing = [] # Danh sách các vị thế có đủ thông tin để xử lý
+
+        # Lấy danh sách ticket của các lệnh đang mở hiện tại
+        current_open_position_tickets = {pos.ticket for pos in positions}
+
+        # Xóa các lỗi đã báo cáo cho các lệnh đã đóng hoặc không còn tồn tại
+        tickets_to_remove = []
+        for ticket in self.reported_sl_modify_errors:
+            if ticket not in current_open_position_tickets:
+                tickets_to_remove.append(ticket)
+        for ticket in tickets_to_remove:
+            self.reported_sl_modify_errors.remove(ticket)
+
+        # --- Lấy thông tin symbol và tick cho tất cả các symbol đang mở + trigger symbols ---
+        symbols_to_fetch = {pos.symbol for pos in positions}
+        for trigger in self.active_triggers:
+            symbols_to_fetch.add(trigger['symbol'])
+
+        symbol_read_at = {} # Key: symbol, Value: (time.time(), perf_counter) lúc đọc tick, cho vết độ trễ
+        for sym in symbols_to_fetch:
+            s_info, s_tick = self._read_market_data(sym)
+            symbol_read_at[sym] = (time.time(), time.perf_counter())
+
+            if s_info is None:
+                self.logger.log(f"Cảnh báo: Không thể lấy thông tin symbol cho '{sym}'. Bỏ qua symbol này.")
+                continue
 
-            for sym in symbols_to_fetch:
+            if not s_info.visible:
+                if not mt5.symbol_select(sym, True):
+                    self.logger.log(f"Cảnh báo: Không thể làm hiển thị symbol '{sym}'. Bỏ qua symbol này.")
+                    continue
                 s_info = mt5.symbol_info(sym)
-                s_tick = mt5.symbol_info_tick(sym)
-
                 if s_info is None:
-                    self.logger.log(f"Cảnh báo: Không thể lấy thông tin symbol cho '{sym}'. Bỏ qua symbol này.")
+                    self.logger.log(f"Cảnh báo: Lấy lại thông tin symbol '{sym}' sau khi làm hiển thị thất bại. Bỏ qua symbol này.")
                     continue
 
-                if not s_info.visible:
-                    if not mt5.symbol_select(sym, True):
-                        self.logger.log(f"Cảnh báo: Không thể làm hiển thị symbol '{sym}'. Bỏ qua symbol này.")
-                        continue
-                    s_info = mt5.symbol_info(sym)
-                    if s_info is None:
-                        self.logger.log(f"Cảnh báo: Lấy lại thông tin symbol '{sym}' sau khi làm hiển thị thất bại. Bỏ qua symbol này.")
-                        continue
-
-                if s_tick is None:
-                    self.logger.log(f"Cảnh báo: Không thể lấy tick data cho '{sym}'. Bỏ qua symbol này.")
-                    continue
-
-                # --- Kiểm tra thuộc tính stops_level/freeze_level và ghi cảnh báo/thông báo một lần ---
-                if not hasattr(s_info, 'stops_level') or not hasattr(s_info, 'freeze_level'):
-                    if sym not in self.warned_symbols_for_stops_level:
-                        self.logger.log(f"Cảnh báo: SymbolInfo cho '{sym}' thiếu thuộc tính 'stops_level' hoặc 'freeze_level'. Breakeven Protector sẽ coi các giới hạn này là 0.")
-                        self.warned_symbols_for_stops_level.add(sym)
-                    if sym in self.informed_symbols_with_full_support:
-                        self.informed_symbols_with_full_support.remove(sym)
-                else:
-                    if sym in self.warned_symbols_for_stops_level:
-                        self.warned_symbols_for_stops_level.remove(sym)
-                        self.logger.log(f"Thông báo: Symbol '{sym}' hiện đã có đủ thuộc tính 'stops_level' và 'freeze_level'.")
-                    if sym not in self.informed_symbols_with_full_support:
-                        if s_info.stops_level > 0 or s_info.freeze_level > 0:
-                            self.logger.log(f"Thông báo: Symbol '{sym}' hỗ trợ đầy đủ 'stops_level' ({s_info.stops_level} points) và 'freeze_level' ({s_info.freeze_level} points). Breakeven Protector có thể hoạt động.")
-                        else:
-                            self.logger.log(f"Thông báo: Symbol '{sym}' có 'stops_level' ({s_info.stops_level} points) và 'freeze_level' ({s_info.freeze_level} points) nhưng giá trị bằng 0. Breakeven Protector có thể không cần tuân thủ khoảng cách tối thiểu.")
-                        self.informed_symbols_with_full_support.add(sym)
-
-                symbol_infos[sym] = s_info
-                symbol_ticks[sym] = s_tick
-
-            # Lọc các vị thế hợp lệ sau khi đã lấy được thông tin symbol
-            for pos in positions:
-                if pos.symbol in symbol_infos and pos.symbol in symbol_ticks:
-                    valid_positions_for_processing.append(pos)
+            if s_tick is None:
+                self.logger.log(f"Cảnh báo: Không thể lấy tick data cho '{sym}'. Bỏ qua symbol này.")
+                continue
 
+            # --- Kiểm tra thuộc tính stops_level/freeze_level và ghi cảnh báo/thông báo một lần ---
+            if not hasattr(s_info, 'stops_level') or not hasattr(s_info, 'freeze_level'):
+                if sym not in self.warned_symbols_for_stops_level:
+                    self.logger.log(f"Cảnh báo: SymbolInfo cho '{sym}' thiếu thuộc tính 'stops_level' hoặc 'freeze_level'. Breakeven Protector sẽ coi các giới hạn này là 0.")
+                    self.warned_symbols_for_stops_level.add(sym)
+                if sym in self.informed_symbols_with_full_support:
+                    self.informed_symbols_with_full_support.remove(sym)
+            else:
+                if sym in self.warned_symbols_for_stops_level:
+                    self.warned_symbols_for_stops_level.remove(sym)
+                    self.logger.log(f"Thông báo: Symbol '{sym}' hiện đã có đủ thuộc tính 'stops_level' và 'freeze_level'.")
+                if sym not in self.informed_symbols_with_full_support:
+                    if s_info.stops_level > 0 or s_info.freeze_level > 0:
+                        self.logger.log(f"Thông báo: Symbol '{sym}' hỗ trợ đầy đủ 'stops_level' ({s_info.stops_level} points) và 'freeze_level' ({s_info.freeze_level} points). Breakeven Protector có thể hoạt động.")
+                    else:
+                        self.logger.log(f"Thông báo: Symbol '{sym}' có 'stops_level' ({s_info.stops_level} points) và 'freeze_level' ({s_info.freeze_level} points) nhưng giá trị bằng 0. Breakeven Protector có thể không cần tuân thủ khoảng cách tối thiểu.")
+                    self.informed_symbols_with_full_support.add(sym)
 
-            # --- Tính toán P/L Pips và cập nhật bảng lệnh mở trên GUI ---
-            positions_data = []
-            for pos in valid_positions_for_processing:
-                symbol_info = symbol_infos[pos.symbol]
-                tick = symbol_ticks[pos.symbol]
+            symbol_infos[sym] = s_info
+            symbol_ticks[sym] = s_tick
 
-                profit_pips = 0.0
-                current_price = 0.0
-
-                pip_step = 0.0
-                if symbol_info.digits == 5: pip_step = 0.0001
-                elif symbol_info.digits == 3: pip_step = 0.001
-                elif symbol_info.digits == 2: pip_step = 0.1
-                else: pip_step = 10 * symbol_info.point
-
-                if pip_step > 0:
-                    current_price = tick.ask if pos.type == mt5.ORDER_TYPE_BUY else tick.bid
-                    profit_pips = (current_price - pos.price_open) / pip_step
-                    if pos.type == mt5.ORDER_TYPE_SELL:
-                        profit_pips = -profit_pips
-
-                positions_data.append({
-                    "ticket": pos.ticket,
-                    "symbol": pos.symbol,
-                    "type": "Buy" if pos.type == mt5.ORDER_TYPE_BUY else "Sell",
-                    "volume": pos.volume,
-                    "price_open": pos.price_open,
-                    "current_price": current_price,
-                    "sl": pos.sl,
-                    "tp": pos.tp,
-                    "profit_usd": pos.profit,
-                    "profit_pips": profit_pips
-                })
-
-            self.signals.position_update_signal.emit(positions_data) # Gửi dữ liệu về GUI
-
-            # --- Logic Breakeven Protector ---
-            if self.breakeven_on:
-                for pos in valid_positions_for_processing:
-                    symbol_info = symbol_infos[pos.symbol]
-                    tick = symbol_ticks[pos.symbol]
-
-                    pip_step = 0.0
-                    if symbol_info.digits == 5: pip_step = 0.0001
-                    elif symbol_info.digits == 3: pip_step = 0.001
-                    elif symbol_info.digits == 2: pip_step = 0.1
-                    else: pip_step = 10 * symbol_info.point
+        # Lọc các vị thế hợp lệ sau khi đã lấy được thông tin symbol
+        for pos in positions:
+            if pos.symbol in symbol_infos and pos.symbol in symbol_ticks:
+                valid_positions_for_processing.append(pos)
+
+        # --- Watermark tick: xác định các symbol có tick thay đổi so với vòng trước ---
+        changed_symbols = {sym for sym, s_tick in symbol_ticks.items()
+                           if self._update_tick_watermark(sym, s_tick)}
+        if self.journal is not None and self.params.get('journal_ticks', True):
+            for sym in changed_symbols:
+                s_tick = symbol_ticks[sym]
+                self.journal.record('tick', symbol=sym, time_msc=getattr(s_tick, 'time_msc', 0),
+                                    bid=s_tick.bid, ask=s_tick.ask)
+        # Xóa watermark của các symbol không còn được theo dõi
+        for sym in list(self.tick_watermarks):
+            if sym not in symbols_to_fetch:
+                del self.tick_watermarks[sym]
+
+        # Nếu tham số breakeven hoặc trạng thái bật/tắt thay đổi, phải tính lại toàn bộ
+        params_signature = (break_even_pips, break_even_offset, self.breakeven_on)
+        force_full_recompute = params_signature != self._last_params_signature
+        self._last_params_signature = params_signature
+
+        cycle_stats = {
+            'symbols': len(symbol_ticks),
+            'symbols_unchanged': len(symbol_ticks) - len(changed_symbols),
+            'positions': len(valid_positions_for_processing),
+            'positions_skipped': 0,
+            'triggers': len(self.active_triggers),
+            'triggers_skipped': 0,
+        }
 
-                    if pip_step == 0.0:
-                        self.logger.log(f"Không thể xác định giá trị pip cho symbol {pos.symbol} để tính Breakeven. Bỏ qua.")
-                        continue
+        # --- Tính toán P/L Pips và cập nhật bảng lệnh mở trên GUI ---
+        positions_to_process = [] # Các vị thế cần chạy logic breakeven trong vòng này
+        position_rows = {}
+        position_states = {}
+        for pos in valid_positions_for_processing:
+            position_state = (pos.sl, pos.tp, pos.volume)
+            position_states[pos.ticket] = position_state
+            previous_row = self._last_position_rows.get(pos.ticket)
+
+            # Tick không đổi và lệnh không bị sửa: dùng lại kết quả vòng trước. Lệnh dời SL lỗi ở vòng trước
+            # (reported_sl_modify_errors) vẫn được xử lý để breakeven thử lại mà không phải chờ tick mới
+            if not force_full_recompute and pos.symbol not in changed_symbols and \
+               previous_row is not None and self._last_position_state.get(pos.ticket) == position_state and \
+               pos.ticket not in self.reported_sl_modify_errors:
+                position_rows[pos.ticket] = previous_row._replace(profit_usd=pos.profit)
+                cycle_stats['positions_skipped'] += 1
+                continue
 
-                    curr_price = tick.ask if pos.type == mt5.ORDER_TYPE_BUY else tick.bid
+            positions_to_process.append(pos)
+            symbol_info = symbol_infos[pos.symbol]
+            tick = symbol_ticks[pos.symbol]
 
-                    current_profit_pips = abs((curr_price - pos.price_open) / pip_step)
+            profit_pips = 0.0
+            current_price = 0.0
 
-                    new_sl = pos.price_open + break_even_offset * pip_step if pos.type == mt5.ORDER_TYPE_BUY else pos.price_open - break_even_offset * pip_step
+            pip_step = pip_step_for(symbol_info.digits, symbol_info.point)
 
-                    stop_level_points = 0.0
-                    freeze_level_points = 0.0
+            if pip_step > 0:
+                current_price = tick.ask if pos.type == mt5.ORDER_TYPE_BUY else tick.bid
+                profit_pips = (current_price - pos.price_open) / pip_step
+                if pos.type == mt5.ORDER_TYPE_SELL:
+                    profit_pips = -profit_pips
 
-                    if hasattr(symbol_info, 'stops_level'):
-                        stop_level_points = symbol_info.stops_level * symbol_info.point
+            position_rows[pos.ticket] = PositionRow(
+                pos.ticket, pos.symbol,
+                "Buy" if pos.type == mt5.ORDER_TYPE_BUY else "Sell",
+                pos.volume, pos.price_open, current_price,
+                pos.sl, pos.tp, pos.profit, profit_pips
+            )
 
-                    if hasattr(symbol_info, 'freeze_level'):
-                        freeze_level_points = symbol_info.freeze_level * symbol_info.point
+        self._last_position_rows = position_rows
+        self._last_position_state = position_states
 
-                    can_modify = False
-                    enough_profit = current_profit_pips >= break_even_pips
-                    sl_far_enough = True
-                    in_freeze = False
+        self._latest_position_rows = position_rows # Tác vụ GUI sẽ gửi delta về GUI
 
-                    if pos.type == mt5.ORDER_TYPE_BUY:
-                        # SL mới phải ít nhất bằng giá mở lệnh
-                        if new_sl < pos.price_open:
-                            new_sl = pos.price_open
+        # --- Logic Breakeven Protector ---
+        if self.breakeven_on:
+            for pos in positions_to_process:
+                symbol_info = symbol_infos[pos.symbol]
+                tick = symbol_ticks[pos.symbol]
 
-                        # Chỉ kiểm tra nếu stops_level > 0
-                        if stop_level_points > 0 and new_sl >= curr_price - stop_level_points:
-                                sl_far_enough = False
+                pip_step = pip_step_for(symbol_info.digits, symbol_info.point)
 
-                        # Nếu SL hiện tại của lệnh đã tốt hơn SL mới được tính, không cần dời
-                        if pos.sl != 0.0 and pos.sl >= new_sl: sl_far_enough = False
+                if pip_step == 0.0:
+                    self.logger.log(f"Không thể xác định giá trị pip cho symbol {pos.symbol} để tính Breakeven. Bỏ qua.")
+                    continue
 
-                    elif pos.type == mt5.ORDER_TYPE_SELL:
-                        # SL mới phải ít nhất bằng giá mở lệnh
-                        if new_sl > pos.price_open:
-                            new_sl = pos.price_open
+                curr_price = tick.ask if pos.type == mt5.ORDER_TYPE_BUY else tick.bid
+
+                stop_level_points = 0.0
+                freeze_level_points = 0.0
+
+                if hasattr(symbol_info, 'stops_level'):
+                    stop_level_points = symbol_info.stops_level * symbol_info.point
+
+                if hasattr(symbol_info, 'freeze_level'):
+                    freeze_level_points = symbol_info.freeze_level * symbol_info.point
+
+                # Quyết định dùng chung với backtester (protector_core)
+                new_sl = evaluate_breakeven(
+                    pos.type == mt5.ORDER_TYPE_BUY, pos.price_open, pos.sl, curr_price, pip_step,
+                    break_even_pips, break_even_offset, stop_level_points, freeze_level_points, symbol_info.digits
+                )
+
+                if new_sl is not None:
+                    decided_at = time.perf_counter()
+                    old_sl = pos.sl if pos.sl != 0.0 else 0.0
+
+                    request = {
+                        "action": mt5.TRADE_ACTION_SLTP,
+                        "position": pos.ticket,
+                        "sl": new_sl,
+                        "tp": pos.tp
+                    }
+                    res = self._send_order('breakeven', request,
+                                           (getattr(tick, 'time_msc', 0),) + symbol_read_at[pos.symbol] + (decided_at,),
+                                           symbol=pos.symbol, old_sl=old_sl, price=curr_price)
+                    if res and res.retcode == mt5.TRADE_RETCODE_DONE:
+                        # Nếu thành công, xóa khỏi set lỗi đã báo cáo
+                        if pos.ticket in self.reported_sl_modify_errors:
+                            self.reported_sl_modify_errors.remove(pos.ticket)
+                        self.logger.log(f"[{pos.symbol}] Đã dời SL về BE cho lệnh {pos.ticket} ({'Buy' if pos.type==0 else 'Sell'}), SL cũ: {old_sl:.{symbol_info.digits}f}, SL mới: {new_sl:.{symbol_info.digits}f}")
+                    else:
+                        # Chỉ ghi log nếu lỗi này chưa được báo cáo
+                        if pos.ticket not in self.reported_sl_modify_errors:
+                            self.logger.log(f"[{pos.symbol}] LỖI: Không thể dời SL BE lệnh {pos.ticket}: {res.retcode if res else 'None'} ({mt5.last_error()})")
+                            self.reported_sl_modify_errors.add(pos.ticket)
+
+        # --- Logic Order Trigger (Lệnh kích hoạt) ---
+        trigger_monitor_data = [] # Dữ liệu để gửi lên bảng theo dõi GUI
+        trigger_rows = {}
+        for trigger_config in self.active_triggers:
+            trigger_id = trigger_config['id']
+            trigger_symbol = trigger_config['symbol']
+            trigger_price_P = trigger_config['price_P']
+            buy_stop_offset_pips = trigger_config['buy_stop_offset_pips']
+            sell_stop_offset_pips = trigger_config['sell_stop_offset_pips']
+            triggered_orders_lot_size = trigger_config['triggered_orders_lot_size']
+            triggered_orders_tp_pips = trigger_config['triggered_orders_tp_pips']
+            triggered_orders_sl_pips = trigger_config['triggered_orders_sl_pips']
+
+            ## FIX 1: Lấy `order_type` từ config để khắc phục lỗi NameError
+            order_type = trigger_config.get('order_type', 'Double Stop')
+
+            # Lấy giá trước đó cho trigger này
+            previous_price_for_trigger = trigger_config['previous_price_for_trigger']
+
+            # Tick không đổi thì không thể có giao cắt mới: dùng lại dòng hiển thị vòng trước
+            previous_row = self._last_trigger_rows.get(trigger_id)
+            if previous_row is not None and previous_price_for_trigger is not None and \
+               trigger_symbol in symbol_ticks and trigger_symbol not in changed_symbols:
+                row = dict(previous_row, unchanged=True)
+                trigger_rows[trigger_id] = row
+                trigger_monitor_data.append(row)
+                cycle_stats['triggers_skipped'] += 1
+                continue
 
-                        if stop_level_points > 0 and new_sl <= curr_price + stop_level_points:
-                            sl_far_enough = False
+            current_price_for_trigger_display = 0.0
+            status_display = "Đang chờ"
 
-                        if pos.sl != 0.0 and pos.sl <= new_sl: sl_far_enough = False
+            # Lấy giá hiện tại để cập nhật bảng, ngay cả khi trigger đã kích hoạt
+            if trigger_symbol in symbol_ticks:
+                tick = symbol_ticks[trigger_symbol]
+                current_price_for_trigger_display = tick.last if tick.last != 0 else (tick.bid + tick.ask) / 2
+            else:
+                status_display = "Lỗi symbol"
 
-                    if freeze_level_points > 0 and abs(curr_price - pos.price_open) < freeze_level_points:
-                            in_freeze = True
+            if trigger_id in self.activated_trigger_ids:
+                status_display = "Đã kích hoạt"
+            
+            # Dọn dẹp cuối ngày vừa đóng/hủy mọi lệnh và trigger sắp bị xóa: không đặt lệnh mới
+            if trigger_id not in self.activated_trigger_ids and self._eod_triggers_frozen:
+                status_display = "Tạm dừng (dọn dẹp cuối ngày)"
+
+            # Chỉ xử lý nếu trigger chưa được kích hoạt và có đủ thông tin symbol
+            elif trigger_id not in self.activated_trigger_ids:
+                if trigger_symbol in symbol_infos and trigger_symbol in symbol_ticks:
+                    symbol_info = symbol_infos[trigger_symbol]
+                    tick = symbol_ticks[trigger_symbol]
 
-                    # Chỉ được modify nếu đủ profit VÀ SL đủ xa khỏi giá hiện tại/freeze level VÀ SL hiện tại chưa được đặt hoặc tệ hơn SL mới
-                    if enough_profit and sl_far_enough and not in_freeze:
-                        if (pos.sl == 0.0) or \
-                            (pos.type == mt5.ORDER_TYPE_BUY and pos.sl < new_sl) or \
-                            (pos.type == mt5.ORDER_TYPE_SELL and pos.sl > new_sl):
-                            can_modify = True
+                    pip_step = pip_step_for(symbol_info.digits, symbol_info.point)
 
-                    if can_modify:
-                        new_sl = round(new_sl, symbol_info.digits)
-                        old_sl = pos.sl if pos.sl != 0.0 else 0.0
+                    if pip_step == 0.0:
+                        status_display = "Lỗi pip_step"
+                    else:
+                        current_price_for_trigger = current_price_for_trigger_display
 
-                        request = {
-                            "action": mt5.TRADE_ACTION_SLTP,
-                            "position": pos.ticket,
-                            "sl": new_sl,
-                            "tp": pos.tp
-                        }
-                        res = mt5.order_send(request)
-                        if res and res.retcode == mt5.TRADE_RETCODE_DONE:
-                            # Nếu thành công, xóa khỏi set lỗi đã báo cáo
-                            if pos.ticket in self.reported_sl_modify_errors:
-                                self.reported_sl_modify_errors.remove(pos.ticket)
-                            self.logger.log(f"[{pos.symbol}] Đã dời SL về BE cho lệnh {pos.ticket} ({'Buy' if pos.type==0 else 'Sell'}), SL cũ: {old_sl:.{symbol_info.digits}f}, SL mới: {new_sl:.{symbol_info.digits}f}")
+                        # Cập nhật previous_price_for_trigger lần đầu
+                        if previous_price_for_trigger is None:
+                            trigger_config['previous_price_for_trigger'] = current_price_for_trigger
+                            previous_price_for_trigger = current_price_for_trigger
+                            self.logger.log(f"[{trigger_symbol}] Khởi tạo previous_price_for_trigger cho ID {trigger_id}: {previous_price_for_trigger:.{symbol_info.digits}f}")
+                            status_display = "Đang chờ (lần đầu)"
                         else:
-                            # Chỉ ghi log nếu lỗi này chưa được báo cáo
-                            if pos.ticket not in self.reported_sl_modify_errors:
-                                self.logger.log(f"[{pos.symbol}] LỖI: Không thể dời SL BE lệnh {pos.ticket}: {res.retcode if res else 'None'} ({mt5.last_error()})")
-                                self.reported_sl_modify_errors.add(pos.ticket)
-
-            # --- Logic Order Trigger (Lệnh kích hoạt) ---
-            trigger_monitor_data = [] # Dữ liệu để gửi lên bảng theo dõi GUI
-            for trigger_config in self.active_triggers:
-                trigger_id = trigger_config['id']
-                trigger_symbol = trigger_config['symbol']
-                trigger_price_P = trigger_config['price_P']
-                buy_stop_offset_pips = trigger_config['buy_stop_offset_pips']
-                sell_stop_offset_pips = trigger_config['sell_stop_offset_pips']
-                triggered_orders_lot_size = trigger_config['triggered_orders_lot_size']
-                triggered_orders_tp_pips = trigger_config['triggered_orders_tp_pips']
-                triggered_orders_sl_pips = trigger_config['triggered_orders_sl_pips']
-
-                ## FIX 1: Lấy `order_type` từ config để khắc phục lỗi NameError
-                order_type = trigger_config.get('order_type', 'Double Stop')
-
-                # Lấy giá trước đó cho trigger này
-                previous_price_for_trigger = trigger_config['previous_price_for_trigger']
-
-                current_price_for_trigger_display = 0.0
-                status_display = "Đang chờ"
-
-                # Lấy giá hiện tại để cập nhật bảng, ngay cả khi trigger đã kích hoạt
-                if trigger_symbol in symbol_ticks:
-                    tick = symbol_ticks[trigger_symbol]
-                    current_price_for_trigger_display = tick.last if tick.last != 0 else (tick.bid + tick.ask) / 2
+                            # --- Logic KÍCH HOẠT MỚI: Phát hiện giao cắt qua điểm P ---
+                            cross = detect_price_cross(previous_price_for_trigger, current_price_for_trigger, trigger_price_P)
+                            price_P_crossed = cross != CROSS_NONE
+                            if price_P_crossed:
+                                self._record('cross', trigger_id=trigger_id, symbol=trigger_symbol,
+                                             direction='up' if cross == CROSS_UP else 'down', price_P=trigger_price_P,
+                                             previous=previous_price_for_trigger, current=current_price_for_trigger,
+                                             tick_time_msc=getattr(tick, 'time_msc', 0))
+                            if cross == CROSS_UP:
+                                self.logger.log(f"[{trigger_symbol}] Lệnh kích hoạt ID {trigger_id}: Giá đã TĂNG qua điểm P: {trigger_price_P:.{symbol_info.digits}f}")
+                            elif cross == CROSS_DOWN:
+                                self.logger.log(f"[{trigger_symbol}] Lệnh kích hoạt ID {trigger_id}: Giá đã GIẢM qua điểm P: {trigger_price_P:.{symbol_info.digits}f}")
+
+                            ## FIX 2: Cấu trúc lại toàn bộ logic đặt lệnh và kích hoạt
+                            if price_P_crossed:
+                                trace = (getattr(tick, 'time_msc', 0),) + symbol_read_at[trigger_symbol] + \
+                                        (time.perf_counter(),)
+                                self.logger.log(f"[{trigger_symbol}] Phát hiện giao cắt. Loại lệnh: {order_type}.")
+                                
+                                placed_buy_successfully = False
+                                placed_sell_successfully = False
+
+                                # --- Đặt lệnh Buy Stop (nếu cần) ---
+                                order_sides = trigger_order_sides(order_type)
+                                if 'buy' in order_sides:
+                                    buy_stop_price, buy_stop_sl, buy_stop_tp = stop_order_levels(
+                                        trigger_price_P, True, buy_stop_offset_pips, triggered_orders_tp_pips,
+                                        triggered_orders_sl_pips, pip_step, symbol_info.digits
+                                    )
+
+                                    req_buy_stop = {
+                                        "action": mt5.TRADE_ACTION_PENDING, "symbol": trigger_symbol,
+                                        "volume": triggered_orders_lot_size, "type": mt5.ORDER_TYPE_BUY_STOP,
+                                        "price": buy_stop_price, "sl": buy_stop_sl, "tp": buy_stop_tp,
+                                        "deviation": 0, "magic": self.constants['TRIGGER_BUY_MAGIC'],
+                                        "comment": f"Buy Stop from Trigger {trigger_id}",
+                                        "type_time": mt5.ORDER_TIME_GTC, "type_filling": mt5.ORDER_FILLING_IOC,
+                                    }
+                                    res_buy_stop = self._send_order('trigger_buy_stop', req_buy_stop, trace, trigger_id=trigger_id)
+                                    if res_buy_stop and res_buy_stop.retcode == mt5.TRADE_RETCODE_DONE:
+                                                        self.logger.log(f"[{trigger_symbol}] Đã đặt Buy Stop thành công! Ticket: {res_buy_stop.order}, Giá: {buy_stop_price:.{symbol_info.digits}f}")
+                                                        self.triggered_orders_P_price.add(res_buy_stop.order, trigger_price_P)
+                                                        self._publish_triggered_orders()
+                                                        placed_buy_successfully = True
+                                    else:
+                                        self.logger.log(f"[{trigger_symbol}] LỖI: Đặt Buy Stop thất bại: {res_buy_stop.retcode if res_buy_stop else 'None'} ({mt5.last_error()})")
+
+                                # --- Đặt lệnh Sell Stop (nếu cần) ---
+                                if 'sell' in order_sides:
+                                    sell_stop_price, sell_stop_sl, sell_stop_tp = stop_order_levels(
+                                        trigger_price_P, False, sell_stop_offset_pips, triggered_orders_tp_pips,
+                                        triggered_orders_sl_pips, pip_step, symbol_info.digits
+                                    )
+
+                                    req_sell_stop = {
+                                        "action": mt5.TRADE_ACTION_PENDING, "symbol": trigger_symbol,
+                                        "volume": triggered_orders_lot_size, "type": mt5.ORDER_TYPE_SELL_STOP,
+                                        "price": sell_stop_price, "sl": sell_stop_sl, "tp": sell_stop_tp,
+                                        "deviation": 0, "magic": self.constants['TRIGGER_SELL_MAGIC'],
+                                        "comment": f"Sell Stop from Trigger {trigger_id}",
+                                        "type_time": mt5.ORDER_TIME_GTC, "type_filling": mt5.ORDER_FILLING_IOC,
+                                    }
+                                    res_sell_stop = self._send_order('trigger_sell_stop', req_sell_stop, trace, trigger_id=trigger_id)
+                                    if res_sell_stop and res_sell_stop.retcode == mt5.TRADE_RETCODE_DONE:
+                                        self.logger.log(f"[{trigger_symbol}] Đã đặt Sell Stop thành công! Ticket: {res_sell_stop.order}, Giá: {sell_stop_price:.{symbol_info.digits}f}")
+                                        self.triggered_orders_P_price.add(res_sell_stop.order, trigger_price_P)
+                                        self._publish_triggered_orders()
+                                        placed_sell_successfully = True
+                                    else:
+                                        self.logger.log(f"[{trigger_symbol}] LỖI: Đặt Sell Stop thất bại: {res_sell_stop.retcode if res_sell_stop else 'None'} ({mt5.last_error()})")
+                                
+                                # --- Đánh dấu trigger đã kích hoạt ---
+                                if trigger_should_activate(order_type, placed_buy_successfully, placed_sell_successfully):
+                                    self.activated_trigger_ids.add(trigger_id)
+                                    self._record('trigger_activated', trigger_id=trigger_id, symbol=trigger_symbol,
+                                                 buy=placed_buy_successfully, sell=placed_sell_successfully)
+                                    status_display = "Đã kích hoạt" # Cập nhật trạng thái ngay lập tức
+                                    self.logger.log(f"[{trigger_symbol}] Trigger ID {trigger_id} đã được kích hoạt và sẽ không chạy lại.")
+                                else:
+                                    self.logger.log(f"[{trigger_symbol}] Không thể đặt lệnh cho trigger ID {trigger_id}. Sẽ thử lại.")
+                                    self._record('trigger_retry', trigger_id=trigger_id, symbol=trigger_symbol)
+
+                        # Cập nhật giá trước đó cho lần lặp tiếp theo
+                        trigger_config['previous_price_for_trigger'] = current_price_for_trigger
                 else:
+                    if trigger_symbol not in self.warned_symbols_for_stops_level:
+                        self.logger.log(f"Cảnh báo: Không thể lấy thông tin hoặc tick data cho symbol '{trigger_symbol}' của trigger ID {trigger_id}.")
+                        self.warned_symbols_for_stops_level.add(trigger_symbol)
                     status_display = "Lỗi symbol"
 
-                if trigger_id in self.activated_trigger_ids:
-                    status_display = "Đã kích hoạt"
-                
-                # Chỉ xử lý nếu trigger chưa được kích hoạt và có đủ thông tin symbol
-                if trigger_id not in self.activated_trigger_ids:
-                    if trigger_symbol in symbol_infos and trigger_symbol in symbol_ticks:
-                        symbol_info = symbol_infos[trigger_symbol]
-                        tick = symbol_ticks[trigger_symbol]
-
-                        pip_step = 0.0
-                        if symbol_info.digits == 5: pip_step = 0.0001
-                        elif symbol_info.digits == 3: pip_step = 0.001
-                        elif symbol_info.digits == 2: pip_step = 0.1
-                        else: pip_step = 10 * symbol_info.point
-
-                        if pip_step == 0.0:
-                            status_display = "Lỗi pip_step"
-                        else:
-                            current_price_for_trigger = current_price_for_trigger_display
-
-                            # Cập nhật previous_price_for_trigger lần đầu
-                            if previous_price_for_trigger is None:
-                                trigger_config['previous_price_for_trigger'] = current_price_for_trigger
-                                previous_price_for_trigger = current_price_for_trigger
-                                self.logger.log(f"[{trigger_symbol}] Khởi tạo previous_price_for_trigger cho ID {trigger_id}: {previous_price_for_trigger:.{symbol_info.digits}f}")
-                                status_display = "Đang chờ (lần đầu)"
-                            else:
-                                # --- Logic KÍCH HOẠT MỚI: Phát hiện giao cắt qua điểm P ---
-                                price_P_crossed = False
-                                if previous_price_for_trigger < trigger_price_P and current_price_for_trigger >= trigger_price_P:
-                                    price_P_crossed = True
-                                    self.logger.log(f"[{trigger_symbol}] Lệnh kích hoạt ID {trigger_id}: Giá đã TĂNG qua điểm P: {trigger_price_P:.{symbol_info.digits}f}")
-                                elif previous_price_for_trigger > trigger_price_P and current_price_for_trigger <= trigger_price_P:
-                                    price_P_crossed = True
-                                    self.logger.log(f"[{trigger_symbol}] Lệnh kích hoạt ID {trigger_id}: Giá đã GIẢM qua điểm P: {trigger_price_P:.{symbol_info.digits}f}")
-
-                                ## FIX 2: Cấu trúc lại toàn bộ logic đặt lệnh và kích hoạt
-                                if price_P_crossed:
-                                    self.logger.log(f"[{trigger_symbol}] Phát hiện giao cắt. Loại lệnh: {order_type}.")
-                                    
-                                    placed_buy_successfully = False
-                                    placed_sell_successfully = False
-
-                                    # --- Đặt lệnh Buy Stop (nếu cần) ---
-                                    if order_type in ["Double Stop", "Buy Stop"]:
-                                        buy_stop_price = trigger_price_P + buy_stop_offset_pips * pip_step
-                                        buy_stop_tp = buy_stop_price + triggered_orders_tp_pips * pip_step if triggered_orders_tp_pips > 0 else 0.0
-                                        buy_stop_sl = buy_stop_price - triggered_orders_sl_pips * pip_step if triggered_orders_sl_pips > 0 else 0.0
-                                        
-                                        buy_stop_price = round(buy_stop_price, symbol_info.digits)
-                                        buy_stop_tp = round(buy_stop_tp, symbol_info.digits)
-                                        buy_stop_sl = round(buy_stop_sl, symbol_info.digits)
-
-                                        req_buy_stop = {
-                                            "action": mt5.TRADE_ACTION_PENDING, "symbol": trigger_symbol,
-                                            "volume": triggered_orders_lot_size, "type": mt5.ORDER_TYPE_BUY_STOP,
-                                            "price": buy_stop_price, "sl": buy_stop_sl, "tp": buy_stop_tp,
-                                            "deviation": 0, "magic": self.constants['TRIGGER_BUY_MAGIC'],
-                                            "comment": f"Buy Stop from Trigger {trigger_id}",
-                                            "type_time": mt5.ORDER_TIME_GTC, "type_filling": mt5.ORDER_FILLING_IOC,
-                                        }
-                                        res_buy_stop = mt5.order_send(req_buy_stop)
-                                        if res_buy_stop and res_buy_stop.retcode == mt5.TRADE_RETCODE_DONE:
-                                                            self.logger.log(f"[{trigger_symbol}] Đã đặt Buy Stop thành công! Ticket: {res_buy_stop.order}, Giá: {buy_stop_price:.{symbol_info.digits}f}")
-                                                            self.triggered_orders_P_price[res_buy_stop.order] = trigger_price_P
-                                                            placed_buy_successfully = True
-                                        else:
-                                            self.logger.log(f"[{trigger_symbol}] LỖI: Đặt Buy Stop thất bại: {res_buy_stop.retcode if res_buy_stop else 'None'} ({mt5.last_error()})")
-
-                                    # --- Đặt lệnh Sell Stop (nếu cần) ---
-                                    if order_type in ["Double Stop", "Sell Stop"]:
-                                        sell_stop_price = trigger_price_P - sell_stop_offset_pips * pip_step
-                                        sell_stop_tp = sell_stop_price - triggered_orders_tp_pips * pip_step if triggered_orders_tp_pips > 0 else 0.0
-                                        sell_stop_sl = sell_stop_price + triggered_orders_sl_pips * pip_step if triggered_orders_sl_pips > 0 else 0.0
-                                        
-                                        sell_stop_price = round(sell_stop_price, symbol_info.digits)
-                                        sell_stop_tp = round(sell_stop_tp, symbol_info.digits)
-                                        sell_stop_sl = round(sell_stop_sl, symbol_info.digits)
-
-                                        req_sell_stop = {
-                                            "action": mt5.TRADE_ACTION_PENDING, "symbol": trigger_symbol,
-                                            "volume": triggered_orders_lot_size, "type": mt5.ORDER_TYPE_SELL_STOP,
-                                            "price": sell_stop_price, "sl": sell_stop_sl, "tp": sell_stop_tp,
-                                            "deviation": 0, "magic": self.constants['TRIGGER_SELL_MAGIC'],
-                                            "comment": f"Sell Stop from Trigger {trigger_id}",
-                                            "type_time": mt5.ORDER_TIME_GTC, "type_filling": mt5.ORDER_FILLING_IOC,
-                                        }
-                                        res_sell_stop = mt5.order_send(req_sell_stop)
-                                        if res_sell_stop and res_sell_stop.retcode == mt5.TRADE_RETCODE_DONE:
-                                            self.logger.log(f"[{trigger_symbol}] Đã đặt Sell Stop thành công! Ticket: {res_sell_stop.order}, Giá: {sell_stop_price:.{symbol_info.digits}f}")
-                                            self.triggered_orders_P_price[res_sell_stop.order] = trigger_price_P
-                                            placed_sell_successfully = True
-                                        else:
-                                            self.logger.log(f"[{trigger_symbol}] LỖI: Đặt Sell Stop thất bại: {res_sell_stop.retcode if res_sell_stop else 'None'} ({mt5.last_error()})")
-                                    
-                                    # --- Đánh dấu trigger đã kích hoạt ---
-                                    should_activate = False
-                                    if order_type == "Double Stop" and (placed_buy_successfully or placed_sell_successfully):
-                                        should_activate = True
-                                    elif order_type == "Buy Stop" and placed_buy_successfully:
-                                        should_activate = True
-                                    elif order_type == "Sell Stop" and placed_sell_successfully:
-                                        should_activate = True
-                                    
-                                    if should_activate:
-                                        self.activated_trigger_ids.add(trigger_id)
-                                        status_display = "Đã kích hoạt" # Cập nhật trạng thái ngay lập tức
-                                        self.logger.log(f"[{trigger_symbol}] Trigger ID {trigger_id} đã được kích hoạt và sẽ không chạy lại.")
-                                    else:
-                                        self.logger.log(f"[{trigger_symbol}] Không thể đặt lệnh cho trigger ID {trigger_id}. Sẽ thử lại.")
+            # Cập nhật dữ liệu để hiển thị trên bảng theo dõi
+            row = {
+                'id': trigger_id,
+                'symbol': trigger_symbol,
+                'price_P': trigger_price_P,
+                'current_price': current_price_for_trigger_display,
+                'status': status_display,
+                'order_type': order_type, ## FIX 3: Thêm order_type vào dữ liệu gửi lên GUI
+                'digits': symbol_infos[trigger_symbol].digits if trigger_symbol in symbol_infos else 5,
+                'unchanged': False
+            }
+            trigger_rows[trigger_id] = row
+            trigger_monitor_data.append(row)
+
+        self._last_trigger_rows = trigger_rows
+
+        self._latest_trigger_monitor_data = trigger_monitor_data
+
+        # --- Thống kê công việc đã bỏ qua nhờ watermark tick ---
+        total_work = cycle_stats['positions'] + cycle_stats['triggers']
+        skipped_work = cycle_stats['positions_skipped'] + cycle_stats['triggers_skipped']
+        cycle_stats['skipped_fraction'] = skipped_work / total_work if total_work else 0.0
+
+        self.skip_counters['cycles'] += 1
+        for key in ('positions', 'positions_skipped', 'triggers', 'triggers_skipped'):
+            self.skip_counters[key] += cycle_stats[key]
+        cumulative_total = self.skip_counters['positions'] + self.skip_counters['triggers']
+        cumulative_skipped = self.skip_counters['positions_skipped'] + self.skip_counters['triggers_skipped']
+        cycle_stats['cumulative_skipped_fraction'] = cumulative_skipped / cumulative_total if cumulative_total else 0.0
+        if self.tick_cache is not None:
+            cycle_stats['tick_cache'] = f"{self.tick_cache.summary()}, hỏi MT5 {self.tick_cache_fallbacks} lần"
+        if self.journal is not None:
+            cycle_stats['journal'] = self.journal.summary()
+
+        self._latest_cycle_stats = cycle_stats
+
+    def _gui_task(self):
+        """Tác vụ cập nhật GUI: gửi kết quả mới nhất của tác vụ tick và thống kê bộ lập lịch."""
+        self._emit_position_delta(self._latest_position_rows) # Gửi dữ liệu về GUI
+
+        # Lọc chỉ những trigger chưa được kích hoạt hoặc đang có lỗi để hiển thị
+        self.signals.trigger_monitor_update_signal.emit([
+            t for t in self._latest_trigger_monitor_data if t['status'] not in ["Đã kích hoạt"]
+        ])
 
-                            # Cập nhật giá trước đó cho lần lặp tiếp theo
-                            trigger_config['previous_price_for_trigger'] = current_price_for_trigger
-                    else:
-                        if trigger_symbol not in self.warned_symbols_for_stops_level:
-                            self.logger.log(f"Cảnh báo: Không thể lấy thông tin hoặc tick data cho symbol '{trigger_symbol}' của trigger ID {trigger_id}.")
-                            self.warned_symbols_for_stops_level.add(trigger_symbol)
-                        status_display = "Lỗi symbol"
-
-                # Cập nhật dữ liệu để hiển thị trên bảng theo dõi
-                trigger_monitor_data.append({
-                    'id': trigger_id,
-                    'symbol': trigger_symbol,
-                    'price_P': trigger_price_P,
-                    'current_price': current_price_for_trigger_display,
-                    'status': status_display,
-                    'order_type': order_type ## FIX 3: Thêm order_type vào dữ liệu gửi lên GUI
-                })
-
-            # Sau khi xử lý tất cả các trigger, gửi dữ liệu lên GUI
-            # Lọc chỉ những trigger chưa được kích hoạt hoặc đang có lỗi để hiển thị
-            self.signals.trigger_monitor_update_signal.emit([
-                t for t in trigger_monitor_data if t['status'] not in ["Đã kích hoạt"]
-            ])
-
-            # --- Tính toán lãi/lỗ trong ngày ---
-            try:
-                now = datetime.now(pytz.UTC)
-                start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self._latest_cycle_stats is not None:
+            # Dòng kết nối lấy tại đây: khi mất kết nối tác vụ tick dừng nhưng trạng thái vẫn phải hiển thị
+            self.signals.cycle_stats_signal.emit(dict(self._latest_cycle_stats, connection=self.connection.summary(),
+                                                      latency=self.latency.summary_line()))
+        scheduler_stats = self.scheduler.stats()
+        self.signals.scheduler_stats_signal.emit(scheduler_stats)
+
+        if self.state_server is not None:
+            self.state_server.publish(self._public_state(scheduler_stats))
+
+    def _public_state(self, scheduler_stats):
+        """
+        Trạng thái gửi cho API chỉ-đọc: chỉ gom tham chiếu tới kết quả đã tính của chu kỳ
+        (dòng lệnh mở, dòng trigger, thống kê); luồng server tự chuyển sang JSON và tính delta.
+        """
+        rows = self._latest_position_rows
+        return {
+            'account': {
+                'connected': self.connected,
+                'breakeven_on': self.breakeven_on,
+                'open_positions': len(rows),
+                'floating_pnl': sum(row.profit_usd for row in rows.values()),
+                'daily_pnl': self.daily_profit_today,
+                'max_loss_per_day': self.params.get('max_loss_per_day'),
+                'active_triggers': len(self.active_triggers),
+                'triggered_orders': len(self.triggered_orders_snapshot),
+            },
+            'positions': rows,
+            'triggers': {row['id']: row for row in self._latest_trigger_monitor_data},
+            'cycle_stats': self._latest_cycle_stats or {},
+            'scheduler': scheduler_stats,
+            'connection': self.connection.status(),
+            'end_of_day': self.eod_status,
+            'latency': self.latency.summary(),
+        }
 
-                deals = mt5.history_deals_get(start.timestamp(), now.timestamp())
+    def _connection_task(self):
+        """
+        Tác vụ giám sát kết nối (chạy trên luồng gateway): kiểm tra terminal/phiên đăng nhập; khi mất kết nối thì
+        thử kết nối lại theo backoff, thành công thì làm mới bộ đệm, đối chiếu lệnh và cho engine chạy tiếp.
+        """
+        if not self.connected or not self.running:
+            return
+        connection = self.connection
+        if connection.link_up:
+            reason = connection.probe()
+            if reason is None:
+                return
+            connection.mark_lost(reason)
+            self.logger.log(f"MẤT KẾT NỐI MT5: {reason}. Tạm dừng breakeven/trigger, đang tự động kết nối lại...")
+            self._record('connection_lost', reason=reason)
 
-                total_profit_today = sum(d.profit for d in deals if d.entry == mt5.DEAL_ENTRY_OUT)
+        # Nửa chu kỳ dung sai: lần thử kế tiếp rơi vào lượt chạy gần nhất của tác vụ, không bị lỡ sang lượt sau
+        if connection.retry_in() > self.scheduler.tasks['connection'].interval / 2:
+            return
+        attempt_started = time.monotonic()
+        error = connection.reconnect()
+        if error:
+            self.logger.log(f"Kết nối lại lần {connection.attempts} thất bại: {error}. "
+                            f"Thử lại sau {connection.retry_in():.0f} giây.")
+            self._record('reconnect_failed', attempt=connection.attempts, error=error)
+            return
+
+        resume = self._resume_after_reconnect()
+        outage = connection.mark_recovered(attempt_started)
+        self.logger.log(f"ĐÃ KẾT NỐI LẠI MT5 sau {outage['outage_seconds']:.1f} giây ({outage['attempts']} lần thử, "
+                        f"khôi phục {outage['recovery_seconds']:.2f} giây). Giữ nguyên {len(self.active_triggers)} trigger; "
+                        f"làm mới {resume['primed']}/{resume['symbols']} symbol; lệnh đã đóng trong lúc mất kết nối: "
+                        f"{resume['closed'] or 'không'}; lệnh mới: {resume['opened'] or 'không'}.")
+        self._record('reconnected', **outage, **resume)
+
+    def _resume_after_reconnect(self):
+        """
+        Khôi phục sau khi kết nối lại (luồng gateway): bỏ watermark/kết quả đã tính để vòng tick kế tiếp tính lại
+        toàn bộ, chọn lại symbol vào Market Watch và lấy trước thông số/tick, đối chiếu lệnh mở và sổ 'Giá P'.
+        Trigger giữ nguyên previous_price_for_trigger, nên giá đi qua điểm P trong lúc mất kết nối vẫn được phát hiện.
+        """
+        self.tick_watermarks.clear()
+        self._last_position_rows = {}
+        self._last_position_state = {}
+        self._last_trigger_rows = {}
+        self._last_params_signature = None
+        self._full_snapshot_requested = True
+        if self.tick_cache is not None:
+            self.tick_cache.reattach()
+
+        symbols = {trigger['symbol'] for trigger in self.active_triggers}
+        symbols.update(row.symbol for row in self._latest_position_rows.values())
+        primed = 0
+        for sym in symbols:
+            if mt5.symbol_select(sym, True) and mt5.symbol_info(sym) is not None \
+               and mt5.symbol_info_tick(sym) is not None:
+                primed += 1
+
+        closed, opened = [], []
+        positions = mt5.positions_get()
+        if positions is not None:
+            known = set(self._latest_position_rows)
+            live = {pos.ticket for pos in positions}
+            closed = sorted(known - live)
+            opened = sorted(live - known)
+        orders_removed = 0
+        orders = mt5.orders_get()
+        if orders is not None and len(self.triggered_orders_P_price):
+            orders_removed = self.triggered_orders_P_price.reconcile({order.ticket for order in orders})
+            if orders_removed:
+                self._publish_triggered_orders()
+        self._daily_pnl_task()
+        return {'symbols': len(symbols), 'primed': primed, 'closed': closed, 'opened': opened,
+                'orders_removed': orders_removed}
+
+    def _reconcile_triggered_orders_task(self):
+        """Tác vụ tần số thấp: loại khỏi sổ các lệnh chờ do trigger đặt nhưng không còn trên terminal."""
+        if not self.connected or not self.running or not self.connection.link_up \
+           or not len(self.triggered_orders_P_price):
+            return
+        orders = mt5.orders_get()
+        if orders is None:
+            # Lỗi truy vấn: không đối chiếu để tránh xóa nhầm toàn bộ sổ
+            return
+        removed = self.triggered_orders_P_price.reconcile({order.ticket for order in orders})
+        if removed:
+            self._publish_triggered_orders()
+            self.logger.log(f"Đã dọn {removed} lệnh chờ không còn tồn tại khỏi danh sách 'Giá P' "
+                            f"(còn lại {len(self.triggered_orders_P_price)}).")
+
+    def _daily_pnl_task(self):
+        """Tác vụ tần số thấp: truy vấn lịch sử deal để tính lãi/lỗ trong ngày (chạy trên luồng gateway)."""
+        if not self.connected or not self.running or not self.connection.link_up:
+            return
+        max_loss_per_day = self.params.get('max_loss_per_day', -100.0)
+
+        # --- Tính toán lãi/lỗ trong ngày ---
+        try:
+            now = datetime.now(pytz.UTC)
+            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+            deals = mt5.history_deals_get(start.timestamp(), now.timestamp())
 
-                if total_profit_today <= max_loss_per_day and total_profit_today < 0:
-                    self.logger.log(f"CẢNH BÁO: Đã vượt giới hạn lỗ {max_loss_per_day} USD, bạn cần kiểm soát rủi ro!")
-            except Exception as e:
-                self.logger.log(f"Lỗi khi tính toán tổng lãi/lỗ hôm nay: {e}")
+            total_profit_today = sum(d.profit for d in deals if d.entry == mt5.DEAL_ENTRY_OUT)
+            self.daily_profit_today = total_profit_today
+
+            if total_profit_today <= max_loss_per_day and total_profit_today < 0:
+                self.logger.log(f"CẢNH BÁO: Đã vượt giới hạn lỗ {max_loss_per_day} USD, bạn cần kiểm soát rủi ro!")
+                self._record('loss_limit', daily_pnl=total_profit_today, max_loss_per_day=max_loss_per_day)
+        except Exception as e:
+            self.logger.log(f"Lỗi khi tính toán tổng lãi/lỗ hôm nay: {e}")
 
-            time.sleep(update_interval)
 
 
 # --- MainWindow Class (GUI) ---
@@ -657,6 +1644,11 @@ class MainWindow(QWidget):
 
         self.mt5_connected = False
         self.breakeven_on = False
+
+        # Trạng thái áp dụng delta cho bảng lệnh mở
+        self._position_table_rows = {}       # Key: ticket, Value: chỉ số dòng trong bảng
+        self._position_table_data = {}       # Key: ticket, Value: PositionRow đang hiển thị
+        self._position_payload_version = 0   # Phiên bản delta cuối cùng đã áp dụng
         
         ## NEW: Tạo một dict chứa các hằng số để truyền vào thread
         self.constants = {
@@ -666,13 +1658,7 @@ class MainWindow(QWidget):
         }
 
         # Tham số cài đặt mặc định (chỉ những cái chung cho toàn bộ app, không phải của từng trigger)
-        self.default_global_params = {
-            "break_even_pips": 3.0,
-            "break_even_offset": 0.5,
-            "max_loss_per_day": -100.0,
-            "update_interval": 5.0,
-            "close_all_at_day_end": False, # Thêm tham số mới
-        }
+        self.default_global_params = DEFAULT_GLOBAL_PARAMS.copy()
         self._global_params = self.default_global_params.copy() # Tạo bản sao để sửa đổi
 
         # Tham số mặc định cho một lệnh trigger mới
@@ -685,12 +1671,25 @@ class MainWindow(QWidget):
         }
 
 
+        # Luồng gateway: nơi duy nhất gọi MetaTrader5, kết quả trả về GUI qua signal
+        self.gateway = BrokerGateway(self.logger)
+        self.gateway.start()
+        self.gateway_signals = GatewaySignals()
+        self.gateway_signals.job_done_signal.connect(self._on_gateway_job_done)
+        self._pending_refresh_in_flight = False # Tránh xếp chồng nhiều lần refresh lệnh chờ
+
+        # API trạng thái chỉ-đọc: sống cùng cửa sổ, giữ nguyên qua các lần reset luồng protector.
+        # Mở cổng sau khi dựng giao diện (để ghi log được); trước đó publish không làm gì
+        self.state_server = None
+        if self._global_params.get('state_api_port'):
+            self.state_server = StateServer(self._global_params['state_api_host'],
+                                            self._global_params['state_api_port'], self.logger)
+
+        # Nhật ký sự kiện của phiên: mở sau khi dựng giao diện, dùng chung qua các lần reset luồng protector
+        self.journal = None
+
         # Khởi tạo và chạy luồng bảo vệ Breakeven
-        self.protector_thread = BreakevenProtector(self.logger, self._global_params.copy(), self.constants)
-        # Kết nối signal từ luồng protector_thread đến phương thức cập nhật UI
-        self.protector_thread.signals.position_update_signal.connect(self.update_open_positions_table)
-        self.protector_thread.signals.trigger_monitor_update_signal.connect(self.update_trigger_monitor_table)
-        self.protector_thread.start()
+        self._start_protector_thread(self._global_params.copy())
 
         # QTimer để refresh lệnh chờ (chạy trên luồng chính GUI)
         self.pending_orders_timer = QTimer(self)
@@ -704,6 +1703,56 @@ class MainWindow(QWidget):
 
         self.create_ui()
         self.apply_default_settings() # Áp dụng cài đặt mặc định khi khởi tạo
+        if self.state_server is not None:
+            self.state_server.start()
+        self.journal = open_event_journal(self._global_params, self.logger)
+        self.protector_thread.journal = self.journal
+
+    def _start_protector_thread(self, params):
+        """Tạo luồng BreakevenProtector mới, kết nối các signal của nó với GUI và khởi chạy."""
+        self.protector_thread = BreakevenProtector(self.logger, params, self.constants, self.gateway,
+                                                   self.state_server, self.journal)
+        # Kết nối signal từ luồng protector_thread đến phương thức cập nhật UI
+        self.protector_thread.signals.position_update_signal.connect(self.update_open_positions_table)
+        self.protector_thread.signals.trigger_monitor_update_signal.connect(self.update_trigger_monitor_table)
+        self.protector_thread.signals.cycle_stats_signal.connect(self.update_cycle_stats)
+        self.protector_thread.signals.scheduler_stats_signal.connect(self.update_scheduler_stats)
+        self.protector_thread.start()
+
+    def _stop_protector_thread(self):
+        """Dừng luồng protector hiện tại mà không chờ (không chặn GUI) và ngắt các signal của nó."""
+        signals = self.protector_thread.signals
+        signals.position_update_signal.disconnect()
+        signals.trigger_monitor_update_signal.disconnect()
+        signals.cycle_stats_signal.disconnect()
+        signals.scheduler_stats_signal.disconnect()
+        self.protector_thread.stop()
+
+    def _run_in_gateway(self, func, on_done, error_context, *args, on_error=None):
+        """
+        Chạy func(*args) trên luồng gateway.
+        on_done(result) được gọi lại trên luồng GUI khi công việc hoàn tất.
+        on_error(error): gọi trên luồng GUI nếu công việc lỗi (ví dụ công việc nền do timer chạy);
+        mặc định ghi log và hiện hộp thoại lỗi.
+        """
+        future = self.gateway.submit(func, *args)
+        future.add_done_callback(
+            lambda f: self.gateway_signals.job_done_signal.emit((on_done, error_context, on_error), f)
+        )
+        return future
+
+    def _on_gateway_job_done(self, callback_info, future):
+        """Nhận kết quả công việc gateway trên luồng GUI."""
+        on_done, error_context, on_error = callback_info
+        error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+                return
+            self.append_log(f"Lỗi không xác định khi {error_context}: {error}")
+            QMessageBox.critical(self, "Lỗi", f"Có lỗi xảy ra: {error}")
+            return
+        on_done(future.result())
 
     def create_ui(self):
         """Tạo và bố trí các thành phần giao diện người dùng."""
@@ -730,7 +1779,7 @@ class MainWindow(QWidget):
         self.server_input = QLineEdit()
         grid_settings.addWidget(self.server_input, 2, 1)
 
-        grid_settings.addWidget(QLabel("Thời gian cập nhật (giây):"), 3, 0)
+        grid_settings.addWidget(QLabel("Thời gian cập nhật GUI (giây):"), 3, 0)
         self.update_interval_input = QLineEdit()
         grid_settings.addWidget(self.update_interval_input, 3, 1)
 
@@ -961,6 +2010,16 @@ class MainWindow(QWidget):
         right_panel.addLayout(control_buttons_layout)
 
 
+        # Nhãn thống kê công việc bỏ qua nhờ watermark tick
+        self.cycle_stats_label = QLabel("Tick không đổi: -")
+        self.cycle_stats_label.setStyleSheet("color: #555;")
+        right_panel.addWidget(self.cycle_stats_label)
+
+        # Nhãn thống kê độ trễ của các tác vụ trong bộ lập lịch
+        self.scheduler_stats_label = QLabel("Bộ lập lịch: -")
+        self.scheduler_stats_label.setStyleSheet("color: #555;")
+        right_panel.addWidget(self.scheduler_stats_label)
+
         # --- Vùng Log ---
         self.log_area = QTextEdit()
         self.log_area.setReadOnly(True)
@@ -1025,7 +2084,7 @@ class MainWindow(QWidget):
         self.log_area.verticalScrollBar().setValue(self.log_area.verticalScrollBar().maximum())
 
     def connect_mt5(self):
-        """Kết nối đến tài khoản MetaTrader 5."""
+        """Kết nối đến tài khoản MetaTrader 5 (đăng nhập chạy trên luồng gateway)."""
         try:
             account = int(self.account_input.text())
             password = self.password_input.text()
@@ -1035,13 +2094,12 @@ class MainWindow(QWidget):
             QMessageBox.warning(self, "Lỗi", f"Thông tin nhập không hợp lệ (số/chuỗi): {e}")
             return
 
+        disconnect_first = self.mt5_connected
         if self.mt5_connected:
             self.append_log("Đang ngắt kết nối MT5 cũ...")
+            # Vòng xử lý kế tiếp của bot sẽ thấy cờ này trên luồng gateway và bỏ qua
             self.protector_thread.connected = False
-            time.sleep(0.5)
 
-            if mt5.initialize():
-                mt5.shutdown()
             self.mt5_connected = False
             self.place_order_btn.setEnabled(False)
             self.modify_pending_btn.setEnabled(False)
@@ -1056,20 +2114,40 @@ class MainWindow(QWidget):
             self.remove_selected_trigger_btn.setEnabled(False)
             self.clear_all_triggers_btn.setEnabled(False)
 
-            self.append_log("Đã ngắt kết nối MT5 cũ.")
-            time.sleep(0.5)
-
+        self.connect_btn.setEnabled(False)
+        self.append_log(f"Đang đăng nhập MT5 tài khoản {account}...")
+        self._run_in_gateway(
+            self._gateway_connect,
+            lambda error: self._on_connect_done(error, account, update_interval, password, server),
+            "kết nối MT5",
+            account, password, server, disconnect_first
+        )
+
+    def _gateway_connect(self, account, password, server, disconnect_first):
+        """Chạy trên luồng gateway: (ngắt kết nối cũ), khởi tạo và đăng nhập. Trả về thông báo lỗi hoặc None."""
+        if disconnect_first:
+            if mt5.initialize():
+                mt5.shutdown()
+            self.logger.log("Đã ngắt kết nối MT5 cũ.")
 
         if not mt5.initialize():
-            QMessageBox.warning(self, "Lỗi", "Không thể khởi tạo MetaTrader5. Đảm bảo MT5 terminal đang chạy.")
-            return
+            return "Không thể khởi tạo MetaTrader5. Đảm bảo MT5 terminal đang chạy."
 
         if not mt5.login(account, password=password, server=server):
-            QMessageBox.warning(self, "Lỗi", f"Đăng nhập MT5 thất bại. Kiểm tra tài khoản, mật khẩu, server. Mã lỗi: {mt5.last_error()}")
+            error = f"Đăng nhập MT5 thất bại. Kiểm tra tài khoản, mật khẩu, server. Mã lỗi: {mt5.last_error()}"
             mt5.shutdown()
+            return error
+        return None
+
+    def _on_connect_done(self, error, account, update_interval, password, server):
+        """Cập nhật giao diện sau khi đăng nhập xong (luồng GUI)."""
+        self.connect_btn.setEnabled(True)
+        if error:
+            QMessageBox.warning(self, "Lỗi", error)
             return
 
         self.mt5_connected = True
+        self.protector_thread.set_connection_credentials({'login': account, 'password': password, 'server': server})
         self.protector_thread.connected = True
         self.append_log(f"Kết nối MT5 tài khoản {account} thành công!")
 
@@ -1085,6 +2163,7 @@ class MainWindow(QWidget):
 
         self._global_params['update_interval'] = update_interval
         self.protector_thread.update_global_params(self._global_params)
+        self.protector_thread.request_full_snapshot()
 
         self.refresh_pending_orders()
 
@@ -1114,13 +2193,11 @@ class MainWindow(QWidget):
         self.append_log(f"Chế độ bảo vệ breakeven: {'ON' if self.breakeven_on else 'OFF'}")
 
     def update_eod_countdown(self):
-        """Cập nhật nhãn đồng hồ đếm ngược đến 00:00 UTC."""
+        """Cập nhật nhãn đồng hồ đếm ngược đến thời điểm dọn dẹp (00:00 UTC trừ eod_lead_seconds)."""
         try:
-            now_utc = datetime.now(pytz.utc)
-            tomorrow_utc_date = now_utc.date() + timedelta(days=1)
-            next_midnight_utc = datetime.combine(tomorrow_utc_date, datetime.min.time(), tzinfo=pytz.utc)
-            time_left = next_midnight_utc - now_utc
-            total_seconds = int(time_left.total_seconds())
+            now = time.time()
+            _, fire_at = next_end_of_day(now, float(self._global_params.get('eod_lead_seconds', 0.0)))
+            total_seconds = int(fire_at - now)
             hours = total_seconds // 3600
             minutes = (total_seconds % 3600) // 60
             seconds = total_seconds % 60
@@ -1152,12 +2229,12 @@ class MainWindow(QWidget):
             self.eod_countdown_label.setVisible(False)
             
     ## NEW: Helper method để tránh lặp code kiểm tra Symbol
-    def _validate_and_get_symbol_info(self, symbol_raw):
-        """Kiểm tra symbol, thử thêm hậu tố 'm', làm hiển thị và trả về symbol_info hợp lệ."""
-        if not symbol_raw:
-            QMessageBox.warning(self, "Lỗi", "Vui lòng nhập 'Cặp tiền (Symbol)'.")
-            return None, None
-
+    ## NEW: Helper method để tránh lặp code kiểm tra Symbol
+    def _resolve_symbol(self, symbol_raw):
+        """
+        Chạy trên luồng gateway: kiểm tra symbol, thử thêm hậu tố 'm', làm hiển thị.
+        Trả về (symbol, symbol_info, None) nếu hợp lệ, ngược lại (None, None, thông báo lỗi).
+        """
         current_symbol = symbol_raw
         symbol_info = mt5.symbol_info(current_symbol)
 
@@ -1171,28 +2248,24 @@ class MainWindow(QWidget):
                 symbol_info = symbol_info_potential
                 self.logger.log(f"Đã tìm thấy symbol với hậu tố: '{current_symbol}'.")
             else:
-                msg = f"Symbol '{symbol_raw}' và '{potential_symbol}' đều không tồn tại."
-                self.append_log(f"Lỗi: {msg}")
-                QMessageBox.warning(self, "Lỗi Symbol", msg)
-                return None, None
-        
+                return None, None, f"Symbol '{symbol_raw}' và '{potential_symbol}' đều không tồn tại."
+
         # Nếu symbol đã xác định nhưng chưa hiển thị, cố gắng làm hiển thị
         if not symbol_info.visible:
             self.logger.log(f"Symbol '{current_symbol}' không hiển thị, đang thử kích hoạt...")
             if not mt5.symbol_select(current_symbol, True):
-                msg = f"Không thể làm hiển thị symbol '{current_symbol}'."
-                self.append_log(f"Lỗi: {msg}")
-                QMessageBox.warning(self, "Lỗi Symbol", msg)
-                return None, None
+                return None, None, f"Không thể làm hiển thị symbol '{current_symbol}'."
             # Lấy lại thông tin sau khi làm hiển thị, vì nó có thể đã thay đổi
             symbol_info = mt5.symbol_info(current_symbol)
             if symbol_info is None:
-                msg = f"Lấy lại thông tin symbol '{current_symbol}' sau khi làm hiển thị thất bại."
-                self.append_log(f"Lỗi: {msg}")
-                QMessageBox.warning(self, "Lỗi Symbol", msg)
-                return None, None
-        
-        return current_symbol, symbol_info
+                return None, None, f"Lấy lại thông tin symbol '{current_symbol}' sau khi làm hiển thị thất bại."
+
+        return current_symbol, symbol_info, None
+
+    def _report_symbol_error(self, message):
+        """Hiển thị lỗi symbol trả về từ _resolve_symbol (luồng GUI)."""
+        self.append_log(f"Lỗi: {message}")
+        QMessageBox.warning(self, "Lỗi Symbol", message)
 
     def add_new_trigger(self):
         """Thêm một lệnh kích hoạt mới vào danh sách theo dõi."""
@@ -1208,20 +2281,27 @@ class MainWindow(QWidget):
             tp = float(self.new_triggered_tp_input.text())
             sl = float(self.new_triggered_sl_input.text())
             order_type = self.trigger_order_type_combo.currentText()
+        except ValueError as e:
+            QMessageBox.warning(self, "Lỗi", f"Vui lòng nhập số hợp lệ cho cài đặt lệnh: {e}")
+            return
 
-            # --- Validation ---
-            if price_P <= 0 or lot <= 0 or buy_stop_offset <= 0 or sell_stop_offset <= 0:
-                QMessageBox.warning(self, "Lỗi", "Giá trị Giá P, Lot, và Offset phải lớn hơn 0.")
-                return
+        # --- Validation ---
+        if price_P <= 0 or lot <= 0 or buy_stop_offset <= 0 or sell_stop_offset <= 0:
+            QMessageBox.warning(self, "Lỗi", "Giá trị Giá P, Lot, và Offset phải lớn hơn 0.")
+            return
+        if not symbol_raw:
+            QMessageBox.warning(self, "Lỗi", "Vui lòng nhập 'Cặp tiền (Symbol)'.")
+            return
 
-            ## NEW: Sử dụng helper method để kiểm tra symbol
-            current_symbol, symbol_info = self._validate_and_get_symbol_info(symbol_raw)
-            if not symbol_info:
+        def on_symbol_resolved(resolved):
+            current_symbol, symbol_info, error = resolved
+            if error:
+                self._report_symbol_error(error)
                 return
-            
+
             # Cập nhật lại ô input nếu symbol đã được thay đổi (thêm 'm')
             self.new_trigger_symbol_input.setText(current_symbol)
-            
+
             # Kiểm tra Lot size theo min/max/step của symbol
             if lot < symbol_info.volume_min or lot > symbol_info.volume_max or \
                round((lot - symbol_info.volume_min) % symbol_info.volume_step, 5) != 0:
@@ -1238,11 +2318,8 @@ class MainWindow(QWidget):
             }
             self.protector_thread.add_trigger(trigger_config)
 
-        except ValueError as e:
-            QMessageBox.warning(self, "Lỗi", f"Vui lòng nhập số hợp lệ cho cài đặt lệnh: {e}")
-        except Exception as e:
-            self.append_log(f"Lỗi không xác định khi thêm lệnh kích hoạt: {e}")
-            QMessageBox.critical(self, "Lỗi", f"Có lỗi xảy ra: {e}")
+        ## NEW: Sử dụng helper method để kiểm tra symbol (chạy trên luồng gateway)
+        self._run_in_gateway(self._resolve_symbol, on_symbol_resolved, "thêm lệnh kích hoạt", symbol_raw)
 
     def remove_selected_trigger(self):
         """Xóa lệnh kích hoạt được chọn từ bảng theo dõi."""
@@ -1281,12 +2358,6 @@ class MainWindow(QWidget):
             sl_pips = float(self.sl_pips_input.text()) if self.sl_pips_input.text() else 0.0
 
             order_type_text = self.pending_type_combo.currentText()
-            order_type_map = {
-                "Buy": mt5.ORDER_TYPE_BUY, "Sell": mt5.ORDER_TYPE_SELL,
-                "Buy Limit": mt5.ORDER_TYPE_BUY_LIMIT, "Sell Limit": mt5.ORDER_TYPE_SELL_LIMIT,
-                "Buy Stop": mt5.ORDER_TYPE_BUY_STOP, "Sell Stop": mt5.ORDER_TYPE_SELL_STOP
-            }
-            order_type = order_type_map[order_type_text]
 
             price = None
             if order_type_text not in ['Buy', 'Sell']:
@@ -1294,94 +2365,136 @@ class MainWindow(QWidget):
                     QMessageBox.warning(self, "Lỗi", "Bạn cần nhập giá đặt cho lệnh chờ.")
                     return
                 price = float(self.pending_price_input.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Lỗi nhập liệu", f"Vui lòng nhập số hợp lệ: {e}")
+            return
 
-            ## NEW: Sử dụng helper method để kiểm tra symbol
-            current_symbol, symbol_info = self._validate_and_get_symbol_info(symbol_raw)
-            if not symbol_info:
-                return
+        if not symbol_raw:
+            QMessageBox.warning(self, "Lỗi", "Vui lòng nhập 'Cặp tiền (Symbol)'.")
+            return
 
-            # Kiểm tra Lot size
-            if lot < symbol_info.volume_min or lot > symbol_info.volume_max or \
-               round((lot - symbol_info.volume_min) % symbol_info.volume_step, 5) != 0:
-                QMessageBox.warning(self, "Lỗi Lot", f"Lot size không hợp lệ cho {current_symbol}.")
-                return
+        def on_order_done(error):
+            if error:
+                QMessageBox.warning(self, *error)
+            else:
+                self.refresh_pending_orders()
 
-            pip_step = (10 ** -symbol_info.digits) * (10 if "JPY" not in current_symbol else 1000)
+        self._run_in_gateway(self._gateway_place_order, on_order_done, "vào lệnh",
+                             symbol_raw, order_type_text, lot, price, tp_pips, sl_pips)
 
-            current_tick = mt5.symbol_info_tick(current_symbol)
-            if not current_tick:
-                QMessageBox.warning(self, "Lỗi Tick Data", f"Không thể lấy tick data cho '{current_symbol}'.")
-                return
+    def _gateway_place_order(self, symbol_raw, order_type_text, lot, price, tp_pips, sl_pips):
+        """Chạy trên luồng gateway: kiểm tra symbol/lot, tạo và gửi lệnh. Trả về (tiêu đề, thông báo) nếu lỗi, None nếu thành công."""
+        order_type_map = {
+            "Buy": mt5.ORDER_TYPE_BUY, "Sell": mt5.ORDER_TYPE_SELL,
+            "Buy Limit": mt5.ORDER_TYPE_BUY_LIMIT, "Sell Limit": mt5.ORDER_TYPE_SELL_LIMIT,
+            "Buy Stop": mt5.ORDER_TYPE_BUY_STOP, "Sell Stop": mt5.ORDER_TYPE_SELL_STOP
+        }
+        order_type = order_type_map[order_type_text]
 
-            request = {
-                "symbol": current_symbol, "volume": lot, "type": order_type,
-                "magic": self.MANUAL_ORDER_MAGIC, "comment": f"Manual {order_type_text}",
-                "type_time": mt5.ORDER_TIME_GTC, "type_filling": mt5.ORDER_FILLING_IOC,
-            }
+        ## NEW: Sử dụng helper method để kiểm tra symbol
+        current_symbol, symbol_info, error = self._resolve_symbol(symbol_raw)
+        if error:
+            self.logger.log(f"Lỗi: {error}")
+            return "Lỗi Symbol", error
 
-            if order_type_text in ['Buy', 'Sell']:
-                price_exec = current_tick.ask if order_type_text == "Buy" else current_tick.bid
-                tp = price_exec + tp_pips * pip_step if tp_pips > 0 else 0.0
-                sl = price_exec - sl_pips * pip_step if sl_pips > 0 else 0.0
-                if order_type_text == "Sell":
-                    tp = price_exec - tp_pips * pip_step if tp_pips > 0 else 0.0
-                    sl = price_exec + sl_pips * pip_step if sl_pips > 0 else 0.0
-                
-                request.update({
-                    "action": mt5.TRADE_ACTION_DEAL, "price": round(price_exec, symbol_info.digits),
-                    "sl": round(sl, symbol_info.digits), "tp": round(tp, symbol_info.digits), "deviation": 20
-                })
-            else: # Lệnh chờ
-                tp = price + tp_pips * pip_step if tp_pips > 0 else 0.0
-                sl = price - sl_pips * pip_step if sl_pips > 0 else 0.0
-                if order_type_text in ["Sell Limit", "Sell Stop"]:
-                    tp = price - tp_pips * pip_step if tp_pips > 0 else 0.0
-                    sl = price + sl_pips * pip_step if sl_pips > 0 else 0.0
-
-                request.update({
-                    "action": mt5.TRADE_ACTION_PENDING, "price": round(price, symbol_info.digits),
-                    "sl": round(sl, symbol_info.digits), "tp": round(tp, symbol_info.digits)
-                })
+        # Kiểm tra Lot size
+        if lot < symbol_info.volume_min or lot > symbol_info.volume_max or \
+           round((lot - symbol_info.volume_min) % symbol_info.volume_step, 5) != 0:
+            return "Lỗi Lot", f"Lot size không hợp lệ cho {current_symbol}."
 
-            result = mt5.order_send(request)
-            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                self.append_log(f"Đã gửi lệnh {order_type_text} {current_symbol} thành công! Ticket: {result.order}")
-                self.refresh_pending_orders()
-            else:
-                error_msg = mt5.last_error()
-                self.append_log(f"Lỗi gửi lệnh: {result.retcode if result else 'None'} ({error_msg})")
-                QMessageBox.warning(self, "Lỗi Gửi Lệnh", f"Gửi lệnh thất bại: {result.comment if result else ''} (Mã: {result.retcode if result else 'N/A'})\nDetails: {error_msg}")
+        pip_step = (10 ** -symbol_info.digits) * (10 if "JPY" not in current_symbol else 1000)
 
-        except ValueError as e:
-            QMessageBox.warning(self, "Lỗi nhập liệu", f"Vui lòng nhập số hợp lệ: {e}")
-        except Exception as e:
-            self.append_log(f"Lỗi không xác định khi vào lệnh: {e}")
-            QMessageBox.critical(self, "Lỗi", f"Có lỗi xảy ra: {e}")
+        current_tick = mt5.symbol_info_tick(current_symbol)
+        if not current_tick:
+            return "Lỗi Tick Data", f"Không thể lấy tick data cho '{current_symbol}'."
+
+        request = {
+            "symbol": current_symbol, "volume": lot, "type": order_type,
+            "magic": self.MANUAL_ORDER_MAGIC, "comment": f"Manual {order_type_text}",
+            "type_time": mt5.ORDER_TIME_GTC, "type_filling": mt5.ORDER_FILLING_IOC,
+        }
+
+        if order_type_text in ['Buy', 'Sell']:
+            price_exec = current_tick.ask if order_type_text == "Buy" else current_tick.bid
+            tp = price_exec + tp_pips * pip_step if tp_pips > 0 else 0.0
+            sl = price_exec - sl_pips * pip_step if sl_pips > 0 else 0.0
+            if order_type_text == "Sell":
+                tp = price_exec - tp_pips * pip_step if tp_pips > 0 else 0.0
+                sl = price_exec + sl_pips * pip_step if sl_pips > 0 else 0.0
+
+            request.update({
+                "action": mt5.TRADE_ACTION_DEAL, "price": round(price_exec, symbol_info.digits),
+                "sl": round(sl, symbol_info.digits), "tp": round(tp, symbol_info.digits), "deviation": 20
+            })
+        else: # Lệnh chờ
+            tp = price + tp_pips * pip_step if tp_pips > 0 else 0.0
+            sl = price - sl_pips * pip_step if sl_pips > 0 else 0.0
+            if order_type_text in ["Sell Limit", "Sell Stop"]:
+                tp = price - tp_pips * pip_step if tp_pips > 0 else 0.0
+                sl = price + sl_pips * pip_step if sl_pips > 0 else 0.0
+
+            request.update({
+                "action": mt5.TRADE_ACTION_PENDING, "price": round(price, symbol_info.digits),
+                "sl": round(sl, symbol_info.digits), "tp": round(tp, symbol_info.digits)
+            })
+
+        result = mt5.order_send(request)
+        if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+            self.logger.log(f"Đã gửi lệnh {order_type_text} {current_symbol} thành công! Ticket: {result.order}")
+            return None
+
+        error_msg = mt5.last_error()
+        self.logger.log(f"Lỗi gửi lệnh: {result.retcode if result else 'None'} ({error_msg})")
+        return "Lỗi Gửi Lệnh", f"Gửi lệnh thất bại: {result.comment if result else ''} (Mã: {result.retcode if result else 'N/A'})\nDetails: {error_msg}"
 
     def refresh_pending_orders(self):
-        """Cập nhật bảng các lệnh chờ đang hoạt động."""
+        """Cập nhật bảng các lệnh chờ đang hoạt động (dữ liệu lấy trên luồng gateway)."""
         if not self.mt5_connected:
             self.pending_orders_table.setRowCount(0)
             return
-        orders = mt5.orders_get()
+        if self._pending_refresh_in_flight:
+            return
+        self._pending_refresh_in_flight = True
+        self._run_in_gateway(self._gateway_fetch_pending_orders, self._fill_pending_orders_table,
+                             "cập nhật lệnh chờ", on_error=self._on_pending_refresh_error)
+
+    def _on_pending_refresh_error(self, error):
+        """Lần cập nhật lệnh chờ (chạy nền theo timer) bị lỗi: chỉ ghi log, lần kế tiếp vẫn chạy bình thường."""
+        self._pending_refresh_in_flight = False
+        self.append_log(f"Lỗi khi cập nhật lệnh chờ: {error}")
+
+    def _gateway_fetch_pending_orders(self):
+        """Chạy trên luồng gateway: lấy danh sách lệnh chờ kèm số chữ số thập phân của symbol."""
+        rows = []
+        digits_cache = {}
+        for order in mt5.orders_get() or []:
+            if order.symbol not in digits_cache:
+                symbol_info = mt5.symbol_info(order.symbol)
+                digits_cache[order.symbol] = symbol_info.digits if symbol_info else 5
+            rows.append((order, digits_cache[order.symbol]))
+        return rows
+
+    def _fill_pending_orders_table(self, rows):
+        """Hiển thị danh sách lệnh chờ đã lấy được lên bảng (luồng GUI)."""
+        self._pending_refresh_in_flight = False
         self.pending_orders_table.setRowCount(0)
+        if not self.mt5_connected:
+            return
 
-        triggered_orders_P_price = self.protector_thread.triggered_orders_P_price
+        triggered_orders_P_price = self.protector_thread.triggered_orders_snapshot
 
-        for order in orders or []:
+        type_name_map = {
+            mt5.ORDER_TYPE_BUY_LIMIT: "Buy Limit", mt5.ORDER_TYPE_SELL_LIMIT: "Sell Limit",
+            mt5.ORDER_TYPE_BUY_STOP: "Buy Stop", mt5.ORDER_TYPE_SELL_STOP: "Sell Stop",
+        }
+
+        for order, digits in rows:
             row = self.pending_orders_table.rowCount()
             self.pending_orders_table.insertRow(row)
 
-            symbol_info = mt5.symbol_info(order.symbol)
-            digits = symbol_info.digits if symbol_info else 5
-
             self.pending_orders_table.setItem(row, 0, QTableWidgetItem(str(order.ticket)))
             self.pending_orders_table.setItem(row, 1, QTableWidgetItem(order.symbol))
 
-            type_name_map = {
-                mt5.ORDER_TYPE_BUY_LIMIT: "Buy Limit", mt5.ORDER_TYPE_SELL_LIMIT: "Sell Limit",
-                mt5.ORDER_TYPE_BUY_STOP: "Buy Stop", mt5.ORDER_TYPE_SELL_STOP: "Sell Stop",
-            }
             type_name = type_name_map.get(order.type, f"Unknown ({order.type})")
             self.pending_orders_table.setItem(row, 2, QTableWidgetItem(type_name))
 
@@ -1407,8 +2520,7 @@ class MainWindow(QWidget):
             row = self.trigger_monitor_table.rowCount()
             self.trigger_monitor_table.insertRow(row)
 
-            symbol_info = mt5.symbol_info(data['symbol'])
-            digits = symbol_info.digits if symbol_info else 5
+            digits = data.get('digits', 5)
 
             self.trigger_monitor_table.setItem(row, 0, QTableWidgetItem(str(data['id'])))
             self.trigger_monitor_table.setItem(row, 1, QTableWidgetItem(data['symbol']))
@@ -1426,26 +2538,85 @@ class MainWindow(QWidget):
         self.trigger_monitor_table.resizeColumnsToContents()
         self.trigger_monitor_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
 
-    def update_open_positions_table(self, positions_data):
-        """Cập nhật bảng các lệnh đang mở trên GUI."""
-        self.open_positions_table.setRowCount(0)
-        for pos_data in positions_data:
-            row = self.open_positions_table.rowCount()
-            self.open_positions_table.insertRow(row)
-
-            self.open_positions_table.setItem(row, 0, QTableWidgetItem(str(pos_data['ticket'])))
-            self.open_positions_table.setItem(row, 1, QTableWidgetItem(pos_data['symbol']))
-
-            pips_item = QTableWidgetItem(f"{pos_data['profit_pips']:.2f}")
-            pips_item.setForeground(Qt.darkGreen if pos_data['profit_pips'] >= 0 else Qt.red)
-            self.open_positions_table.setItem(row, 2, pips_item)
-
-            usd_item = QTableWidgetItem(f"{pos_data['profit_usd']:.2f}")
-            usd_item.setForeground(Qt.darkGreen if pos_data['profit_usd'] >= 0 else Qt.red)
-            self.open_positions_table.setItem(row, 3, usd_item)
+    def update_open_positions_table(self, delta):
+        """
+        Áp dụng gói PositionDelta lên bảng các lệnh đang mở.
+        Snapshot đầy đủ sẽ dựng lại bảng; delta chỉ sửa/thêm/xóa các dòng liên quan.
+        """
+        if delta.full:
+            self.open_positions_table.setRowCount(0)
+            self._position_table_rows = {}
+            self._position_table_data = {}
+        elif delta.version != self._position_payload_version + 1:
+            # Mất gói (ví dụ thread vừa được tạo lại): xin snapshot đầy đủ và bỏ qua gói này
+            self.protector_thread.request_full_snapshot()
+            return
+        self._position_payload_version = delta.version
+
+        if delta.removals:
+            # Xóa từ dòng dưới lên: mỗi lần xóa làm dịch chỉ số các dòng phía dưới
+            removed_rows = sorted((self._position_table_rows.pop(ticket) for ticket in delta.removals
+                                   if ticket in self._position_table_rows), reverse=True)
+            for ticket in delta.removals:
+                self._position_table_data.pop(ticket, None)
+            for row in removed_rows:
+                self.open_positions_table.removeRow(row)
+            # Đánh lại chỉ số dòng sau khi xóa
+            self._position_table_rows = {
+                int(self.open_positions_table.item(row, 0).text()): row
+                for row in range(self.open_positions_table.rowCount())
+            }
 
-        self.open_positions_table.resizeColumnsToContents()
-        self.open_positions_table.horizontalHeader().setStretchLastSection(True)
+        rows_added = False
+        for pos_row in delta.upserts:
+            previous = self._position_table_data.get(pos_row.ticket)
+            if previous == pos_row:
+                continue # Dòng không đổi so với đang hiển thị (ví dụ tick không đổi)
+            self._position_table_data[pos_row.ticket] = pos_row
+            row = self._position_table_rows.get(pos_row.ticket)
+            if row is None:
+                rows_added = True
+                row = self.open_positions_table.rowCount()
+                self.open_positions_table.insertRow(row)
+                self._position_table_rows[pos_row.ticket] = row
+                self.open_positions_table.setItem(row, 0, QTableWidgetItem(str(pos_row.ticket)))
+                self.open_positions_table.setItem(row, 1, QTableWidgetItem(pos_row.symbol))
+
+            # Chỉ ghi lại ô có giá trị thay đổi
+            if previous is None or previous.profit_pips != pos_row.profit_pips:
+                pips_item = QTableWidgetItem(f"{pos_row.profit_pips:.2f}")
+                pips_item.setForeground(Qt.darkGreen if pos_row.profit_pips >= 0 else Qt.red)
+                self.open_positions_table.setItem(row, 2, pips_item)
+
+            if previous is None or previous.profit_usd != pos_row.profit_usd:
+                usd_item = QTableWidgetItem(f"{pos_row.profit_usd:.2f}")
+                usd_item.setForeground(Qt.darkGreen if pos_row.profit_usd >= 0 else Qt.red)
+                self.open_positions_table.setItem(row, 3, usd_item)
+
+        if delta.full or delta.removals or rows_added:
+            self.open_positions_table.resizeColumnsToContents()
+            self.open_positions_table.horizontalHeader().setStretchLastSection(True)
+
+    def update_cycle_stats(self, stats):
+        """Hiển thị tỷ lệ công việc đã bỏ qua trong vòng lặp gần nhất (tick không đổi)."""
+        self.cycle_stats_label.setText(
+            f"Tick không đổi: {stats['symbols_unchanged']}/{stats['symbols']} symbol | "
+            f"Bỏ qua vòng này: {stats['skipped_fraction'] * 100:.0f}% "
+            f"({stats['positions_skipped']}/{stats['positions']} lệnh, {stats['triggers_skipped']}/{stats['triggers']} trigger) | "
+            f"Tích lũy: {stats['cumulative_skipped_fraction'] * 100:.0f}%"
+            + "".join(f"\n{stats[key]}" for key in ('connection', 'latency', 'tick_cache', 'journal') if key in stats)
+        )
+
+    def update_scheduler_stats(self, stats):
+        """Hiển thị chu kỳ, độ trễ (trung bình/p95/max) và số lần overrun của từng tác vụ."""
+        parts = []
+        for name, task_stats in stats.items():
+            parts.append(
+                f"{name} {task_stats['interval'] * 1000:.0f}ms: trễ {task_stats['lateness_avg'] * 1000:.1f}/"
+                f"{task_stats['lateness_p95'] * 1000:.1f}/{task_stats['lateness_max'] * 1000:.1f}ms, "
+                f"overrun {task_stats['overruns']}, lỡ {task_stats['skipped_slots']}"
+            )
+        self.scheduler_stats_label.setText("Bộ lập lịch (trễ TB/p95/max): " + " | ".join(parts))
 
     def modify_pending_order(self):
         """Sửa đổi các thuộc tính của lệnh chờ đã chọn."""
@@ -1462,92 +2633,104 @@ class MainWindow(QWidget):
             ticket = int(self.pending_orders_table.item(row, 0).text())
             symbol = self.pending_orders_table.item(row, 1).text()
 
-            symbol_info = mt5.symbol_info(symbol)
-            if not symbol_info:
-                QMessageBox.warning(self, "Lỗi", f"Không thể lấy thông tin symbol cho {symbol}.")
-                return
-
-            orders = mt5.orders_get(ticket=ticket)
-            if not orders:
-                QMessageBox.warning(self, "Lỗi", f"Không tìm thấy lệnh chờ {ticket}.")
-                self.refresh_pending_orders()
-                return
-            current_order = orders[0]
-            
             # Chỉ cập nhật các giá trị được người dùng nhập vào
-            request = {"action": mt5.TRADE_ACTION_MODIFY, "order": ticket}
-            
-            if self.pending_price_input.text():
-                request["price"] = round(float(self.pending_price_input.text()), symbol_info.digits)
-            if self.pending_lot_input.text():
-                 request["volume"] = float(self.pending_lot_input.text())
-
-            # Tính toán lại TP/SL nếu người dùng nhập pips
-            base_price = request.get("price", current_order.price_open)
-            pip_step = (10 ** -symbol_info.digits) * (10 if "JPY" not in symbol else 1000)
-
-            if self.tp_pips_input.text():
-                tp_pips = float(self.tp_pips_input.text())
-                tp_val = base_price + tp_pips * pip_step if current_order.type in [mt5.ORDER_TYPE_BUY_LIMIT, mt5.ORDER_TYPE_BUY_STOP] else base_price - tp_pips * pip_step
-                request["tp"] = round(tp_val, symbol_info.digits)
-            
-            if self.sl_pips_input.text():
-                sl_pips = float(self.sl_pips_input.text())
-                sl_val = base_price - sl_pips * pip_step if current_order.type in [mt5.ORDER_TYPE_BUY_LIMIT, mt5.ORDER_TYPE_BUY_STOP] else base_price + sl_pips * pip_step
-                request["sl"] = round(sl_val, symbol_info.digits)
+            new_price = float(self.pending_price_input.text()) if self.pending_price_input.text() else None
+            new_volume = float(self.pending_lot_input.text()) if self.pending_lot_input.text() else None
+            tp_pips = float(self.tp_pips_input.text()) if self.tp_pips_input.text() else None
+            sl_pips = float(self.sl_pips_input.text()) if self.sl_pips_input.text() else None
+        except ValueError as e:
+            QMessageBox.warning(self, "Lỗi nhập liệu", f"Vui lòng nhập số hợp lệ: {e}")
+            return
 
-            result = mt5.order_send(request)
-            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                self.append_log(f"Sửa lệnh chờ {ticket} thành công.")
-            else:
-                self.append_log(f"Lỗi sửa lệnh chờ {ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
-                QMessageBox.warning(self, "Lỗi Sửa Lệnh", f"Sửa lệnh thất bại: {result.comment} (Mã lỗi: {result.retcode})")
+        def on_modify_done(error):
+            if error:
+                QMessageBox.warning(self, *error)
             self.refresh_pending_orders()
 
-        except ValueError as e:
-            QMessageBox.warning(self, "Lỗi nhập liệu", f"Vui lòng nhập số hợp lệ: {e}")
-        except Exception as e:
-            self.append_log(f"Lỗi không xác định khi sửa lệnh chờ: {e}")
-            QMessageBox.critical(self, "Lỗi", f"Có lỗi xảy ra: {e}")
+        self._run_in_gateway(self._gateway_modify_pending_order, on_modify_done, "sửa lệnh chờ",
+                             ticket, symbol, new_price, new_volume, tp_pips, sl_pips)
+
+    def _gateway_modify_pending_order(self, ticket, symbol, new_price, new_volume, tp_pips, sl_pips):
+        """Chạy trên luồng gateway: tạo và gửi yêu cầu sửa lệnh chờ. Trả về (tiêu đề, thông báo) nếu lỗi."""
+        symbol_info = mt5.symbol_info(symbol)
+        if not symbol_info:
+            return "Lỗi", f"Không thể lấy thông tin symbol cho {symbol}."
+
+        orders = mt5.orders_get(ticket=ticket)
+        if not orders:
+            return "Lỗi", f"Không tìm thấy lệnh chờ {ticket}."
+        current_order = orders[0]
+
+        request = {"action": mt5.TRADE_ACTION_MODIFY, "order": ticket}
+
+        if new_price is not None:
+            request["price"] = round(new_price, symbol_info.digits)
+        if new_volume is not None:
+            request["volume"] = new_volume
+
+        # Tính toán lại TP/SL nếu người dùng nhập pips
+        base_price = request.get("price", current_order.price_open)
+        pip_step = (10 ** -symbol_info.digits) * (10 if "JPY" not in symbol else 1000)
+        is_buy_order = current_order.type in [mt5.ORDER_TYPE_BUY_LIMIT, mt5.ORDER_TYPE_BUY_STOP]
+
+        if tp_pips is not None:
+            tp_val = base_price + tp_pips * pip_step if is_buy_order else base_price - tp_pips * pip_step
+            request["tp"] = round(tp_val, symbol_info.digits)
+
+        if sl_pips is not None:
+            sl_val = base_price - sl_pips * pip_step if is_buy_order else base_price + sl_pips * pip_step
+            request["sl"] = round(sl_val, symbol_info.digits)
+
+        result = mt5.order_send(request)
+        if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+            self.logger.log(f"Sửa lệnh chờ {ticket} thành công.")
+            return None
+
+        self.logger.log(f"Lỗi sửa lệnh chờ {ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
+        return "Lỗi Sửa Lệnh", f"Sửa lệnh thất bại: {result.comment if result else ''} (Mã lỗi: {result.retcode if result else 'N/A'})"
 
     def cancel_pending_order(self):
         """Huỷ lệnh chờ đã chọn."""
         if not self.mt5_connected:
             QMessageBox.warning(self, "Lỗi", "Bạn cần kết nối MT5!")
             return
-        try:
-            selected_rows = self.pending_orders_table.selectionModel().selectedRows()
-            if not selected_rows:
-                QMessageBox.warning(self, "Chọn lệnh", "Chọn một lệnh để hủy.")
-                return
+        selected_rows = self.pending_orders_table.selectionModel().selectedRows()
+        if not selected_rows:
+            QMessageBox.warning(self, "Chọn lệnh", "Chọn một lệnh để hủy.")
+            return
 
-            row = selected_rows[0].row()
-            ticket = int(self.pending_orders_table.item(row, 0).text())
+        row = selected_rows[0].row()
+        ticket = int(self.pending_orders_table.item(row, 0).text())
 
-            reply = QMessageBox.question(self, "Xác nhận Hủy",
-                                         f"Bạn có chắc chắn muốn hủy lệnh chờ {ticket} không?",
-                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-            if reply == QMessageBox.No:
-                return
+        reply = QMessageBox.question(self, "Xác nhận Hủy",
+                                     f"Bạn có chắc chắn muốn hủy lệnh chờ {ticket} không?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply == QMessageBox.No:
+            return
 
-            request = {
-                "action": mt5.TRADE_ACTION_REMOVE,
-                "order": ticket,
-                "comment": "Cancel pending order from GUI"
-            }
-            result = mt5.order_send(request)
-            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                self.append_log(f"Đã huỷ lệnh chờ {ticket} thành công.")
-                if ticket in self.protector_thread.triggered_orders_P_price:
-                    del self.protector_thread.triggered_orders_P_price[ticket]
+        def on_cancel_done(error):
+            if error:
+                QMessageBox.warning(self, *error)
             else:
-                self.append_log(f"Lỗi huỷ lệnh chờ {ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
-                QMessageBox.warning(self, "Lỗi Hủy Lệnh", f"Hủy lệnh thất bại: {result.comment} (Mã lỗi: {result.retcode})")
+                self.protector_thread.forget_triggered_order(ticket)
             self.refresh_pending_orders()
 
-        except Exception as e:
-            self.append_log(f"Lỗi khi huỷ lệnh chờ: {e}")
-            QMessageBox.critical(self, "Lỗi", f"Có lỗi xảy ra: {e}")
+        self._run_in_gateway(self._gateway_cancel_pending_order, on_cancel_done, "huỷ lệnh chờ", ticket)
+
+    def _gateway_cancel_pending_order(self, ticket):
+        """Chạy trên luồng gateway: gửi yêu cầu hủy lệnh chờ. Trả về (tiêu đề, thông báo) nếu lỗi."""
+        request = {
+            "action": mt5.TRADE_ACTION_REMOVE,
+            "order": ticket,
+            "comment": "Cancel pending order from GUI"
+        }
+        result = mt5.order_send(request)
+        if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+            self.logger.log(f"Đã huỷ lệnh chờ {ticket} thành công.")
+            return None
+
+        self.logger.log(f"Lỗi huỷ lệnh chờ {ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
+        return "Lỗi Hủy Lệnh", f"Hủy lệnh thất bại: {result.comment if result else ''} (Mã lỗi: {result.retcode if result else 'N/A'})"
 
     def close_all_open_positions(self):
         """Đóng tất cả các lệnh đang mở."""
@@ -1561,16 +2744,28 @@ class MainWindow(QWidget):
         if reply == QMessageBox.No:
             return
 
+        def on_close_done(counts):
+            if counts is None:
+                QMessageBox.information(self, "Thông báo", "Không có lệnh nào đang mở để đóng.")
+                return
+            closed_count, failed_count = counts
+            self.append_log(f"Hoàn tất: Đã đóng {closed_count} lệnh, thất bại {failed_count} lệnh.")
+            QMessageBox.information(self, "Kết quả", f"Hoàn tất: Đã đóng {closed_count} lệnh, thất bại {failed_count} lệnh.")
+
+        self.append_log("Đang đóng tất cả lệnh đang mở...")
+        self._run_in_gateway(self._gateway_close_all_positions, on_close_done, "đóng tất cả lệnh")
+
+    def _gateway_close_all_positions(self):
+        """Chạy trên luồng gateway: đóng lần lượt từng lệnh đang mở. Trả về (số thành công, số thất bại) hoặc None nếu không có lệnh."""
         positions = mt5.positions_get()
         if not positions:
-            QMessageBox.information(self, "Thông báo", "Không có lệnh nào đang mở để đóng.")
-            return
+            return None
 
         closed_count, failed_count = 0, 0
         for pos in positions:
             tick = mt5.symbol_info_tick(pos.symbol)
             if not tick:
-                self.append_log(f"Lỗi: Không thể lấy tick data cho '{pos.symbol}' để đóng lệnh {pos.ticket}.")
+                self.logger.log(f"Lỗi: Không thể lấy tick data cho '{pos.symbol}' để đóng lệnh {pos.ticket}.")
                 failed_count += 1
                 continue
 
@@ -1593,14 +2788,13 @@ class MainWindow(QWidget):
 
             result = mt5.order_send(request)
             if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                self.append_log(f"Đã đóng lệnh {pos.ticket} thành công.")
+                self.logger.log(f"Đã đóng lệnh {pos.ticket} thành công.")
                 closed_count += 1
             else:
-                self.append_log(f"Lỗi đóng lệnh {pos.ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
+                self.logger.log(f"Lỗi đóng lệnh {pos.ticket}: {result.retcode if result else 'None'} ({mt5.last_error()})")
                 failed_count += 1
 
-        self.append_log(f"Hoàn tất: Đã đóng {closed_count} lệnh, thất bại {failed_count} lệnh.")
-        QMessageBox.information(self, "Kết quả", f"Hoàn tất: Đã đóng {closed_count} lệnh, thất bại {failed_count} lệnh.")
+        return closed_count, failed_count
 
     def reset_program(self):
         """Đặt lại chương trình về trạng thái ban đầu."""
@@ -1612,22 +2806,17 @@ class MainWindow(QWidget):
 
         self.append_log("Đang reset chương trình...")
 
+        # Luồng cũ tự kết thúc sau vòng hiện tại; không join để GUI không bị chặn
+        self.protector_thread.connected = False
+        self._stop_protector_thread()
+
         if self.mt5_connected:
-            self.protector_thread.connected = False
-            time.sleep(0.5)
-            if mt5.initialize():
-                mt5.shutdown()
             self.mt5_connected = False
-            self.append_log("Đã ngắt kết nối MT5.")
+            self._run_in_gateway(self._gateway_shutdown, lambda _: self.append_log("Đã ngắt kết nối MT5."),
+                                 "ngắt kết nối MT5")
 
-        self.protector_thread.stop()
-        self.protector_thread.join(timeout=2)
-        
         self._global_params = self.default_global_params.copy()
-        self.protector_thread = BreakevenProtector(self.logger, self._global_params, self.constants)
-        self.protector_thread.signals.position_update_signal.connect(self.update_open_positions_table)
-        self.protector_thread.signals.trigger_monitor_update_signal.connect(self.update_trigger_monitor_table)
-        self.protector_thread.start()
+        self._start_protector_thread(self._global_params)
         self.append_log("Breakeven Protector thread đã được khởi tạo lại.")
 
         self.apply_default_settings()
@@ -1646,6 +2835,9 @@ class MainWindow(QWidget):
         self.clear_all_triggers_btn.setEnabled(False)
 
         self.open_positions_table.setRowCount(0)
+        self._position_table_rows = {}
+        self._position_table_data = {}
+        self._position_payload_version = 0
         self.pending_orders_table.setRowCount(0)
         self.trigger_monitor_table.setRowCount(0)
 
@@ -1653,6 +2845,11 @@ class MainWindow(QWidget):
         self.append_log("Chương trình đã được reset về trạng thái ban đầu.")
         QMessageBox.information(self, "Hoàn tất", "Chương trình đã được reset.")
 
+    def _gateway_shutdown(self):
+        """Chạy trên luồng gateway: đóng kết nối với terminal MT5."""
+        if mt5.initialize():
+            mt5.shutdown()
+
     def closeEvent(self, event):
         """Xử lý sự kiện đóng cửa sổ chính."""
         self.append_log("Đang đóng chương trình...")
@@ -1661,19 +2858,358 @@ class MainWindow(QWidget):
             self.protector_thread.stop()
             self.protector_thread.join(timeout=5)
 
-        if mt5.initialize():
-            mt5.shutdown()
+        try:
+            self.gateway.submit(self._gateway_shutdown).result(timeout=5)
             self.logger.log("Đã ngắt kết nối MT5.")
+        except Exception:
+            pass
+        self.gateway.stop()
+        if self.state_server is not None:
+            self.state_server.stop()
+        close_event_journal(self.journal)
 
         self.logger.log("Chương trình đã đóng.")
         super().closeEvent(event)
 
 
+# --- Chạy nhiều tài khoản: mỗi engine một tiến trình riêng ---
+class QueueLogger:
+    """Logger dùng trong tiến trình engine: gửi log về tiến trình giám sát qua hàng đợi."""
+    def __init__(self, account_name, status_queue):
+        self.account_name = account_name
+        self.status_queue = status_queue
+
+    def log(self, message):
+        self.status_queue.put(('log', self.account_name, message))
+
+
+def assign_state_api_ports(account_configs):
+    """
+    Chạy nhiều tài khoản: mỗi engine một cổng API trạng thái riêng. Tài khoản không khai báo state_api_port
+    trong params nhận cổng mặc định + thứ tự của nó trong danh sách; 0 vẫn là tắt API.
+    Trả về bản sao các cấu hình đã gán cổng; ValueError nếu hai tài khoản trùng cổng.
+    """
+    base_port = DEFAULT_GLOBAL_PARAMS['state_api_port']
+    assigned = []
+    owners = {}
+    for index, config in enumerate(account_configs):
+        params = dict(config.get('params', {}))
+        if 'state_api_port' not in params:
+            params['state_api_port'] = base_port + index if base_port else 0
+        port = int(params['state_api_port'])
+        if port:
+            if port in owners:
+                raise ValueError(f"Tài khoản '{config['name']}' và '{owners[port]}' trùng cổng API trạng thái {port}")
+            owners[port] = config['name']
+        assigned.append(dict(config, params=params))
+    return assigned
+
+
+def run_engine_process(account_config, status_queue, stop_event):
+    """
+    Điểm vào của tiến trình con: kết nối một terminal/tài khoản MT5 và chạy một BreakevenProtector
+    không có GUI. Sức khỏe và P/L được gửi định kỳ về tiến trình giám sát.
+    Thoát với mã khác 0 nếu không kết nối được hoặc engine bị dừng bất thường (để được khởi động lại).
+    Không mở được cổng API trạng thái thì engine vẫn bảo vệ tài khoản, chỉ báo lỗi qua log và health.
+    """
+    name = account_config['name']
+    logger = QueueLogger(name, status_queue)
+    gateway = BrokerGateway(logger)
+    gateway.start()
+
+    def connect():
+        init_kwargs = {}
+        if account_config.get('terminal_path'):
+            init_kwargs['path'] = account_config['terminal_path']
+        if not mt5.initialize(**init_kwargs):
+            return f"Không thể khởi tạo MetaTrader5: {mt5.last_error()}"
+        if not mt5.login(int(account_config['login']), password=account_config['password'],
+                         server=account_config['server']):
+            error = f"Đăng nhập MT5 thất bại: {mt5.last_error()}"
+            mt5.shutdown()
+            return error
+        return None
+
+    error = gateway.call(connect)
+    if error:
+        logger.log(error)
+        gateway.stop()
+        sys.exit(2)
+
+    params = DEFAULT_GLOBAL_PARAMS.copy()
+    params.update(account_config.get('params', {}))
+    constants = {
+        'MANUAL_ORDER_MAGIC': MainWindow.MANUAL_ORDER_MAGIC,
+        'TRIGGER_BUY_MAGIC': MainWindow.TRIGGER_BUY_MAGIC,
+        'TRIGGER_SELL_MAGIC': MainWindow.TRIGGER_SELL_MAGIC,
+    }
+    state_server = None
+    if params.get('state_api_port'):
+        state_server = StateServer(params['state_api_host'], params['state_api_port'], logger)
+        if not state_server.start():
+            # Cổng bị chiếm/cấu hình sai: không dừng bảo vệ tài khoản vì API chỉ-đọc, nhưng báo rõ trên cửa sổ giám sát
+            logger.log(f"LỖI: Không mở được API trạng thái trên cổng {params['state_api_port']}; "
+                       f"engine vẫn chạy nhưng không có API.")
+            state_server = None
+    journal = open_event_journal(params, logger, prefix=name)
+    protector = BreakevenProtector(logger, params, constants, gateway, state_server, journal)
+    protector.set_breakeven_on(bool(account_config.get('breakeven_on', False)))
+    protector.set_connection_credentials({'login': account_config['login'], 'password': account_config['password'],
+                                          'server': account_config['server'],
+                                          'path': account_config.get('terminal_path')})
+    for trigger_config in account_config.get('triggers', []):
+        protector.add_trigger(trigger_config)
+    protector.connected = True
+    protector.start()
+    logger.log(f"Engine đã chạy (PID {os.getpid()}"
+               + (f", API trạng thái cổng {params['state_api_port']}" if state_server is not None else "") + ").")
+
+    health_interval = float(account_config.get('health_interval', 2.0))
+    exit_code = 0
+    while not stop_event.wait(health_interval):
+        if not protector.is_alive():
+            logger.log("Engine dừng bất thường.")
+            exit_code = 1
+            break
+        rows = protector._latest_position_rows
+        status_queue.put(('health', name, {
+            'time': time.time(),
+            'open_positions': len(rows),
+            'floating_pnl': sum(row.profit_usd for row in rows.values()),
+            'daily_pnl': protector.daily_profit_today,
+            'active_triggers': len(protector.active_triggers),
+            'tick_lateness_max': protector.scheduler.tasks['tick'].lateness_max,
+            'tick_overruns': protector.scheduler.tasks['tick'].overruns,
+            'link_up': protector.connection.link_up,
+            'outages': protector.connection.outages,
+            'state_api_error': bool(params.get('state_api_port')) and state_server is None,
+        }))
+
+    protector.stop()
+    protector.join(timeout=5)
+    if state_server is not None:
+        state_server.stop()
+    close_event_journal(journal)
+    try:
+        gateway.submit(mt5.shutdown).result(timeout=5)
+    except Exception:
+        pass
+    gateway.stop()
+    sys.exit(exit_code)
+
+
+class EngineSupervisor:
+    """
+    Quản lý các tiến trình engine theo từng tài khoản: khởi động, theo dõi heartbeat,
+    khởi động lại với thời gian chờ tăng dần (backoff) khi tiến trình chết hoặc không phản hồi.
+    Chạy trên luồng GUI, được gọi định kỳ qua poll().
+    """
+    BACKOFF_INITIAL = 1.0      # Giây chờ trước lần khởi động lại đầu tiên
+    BACKOFF_MAX = 60.0         # Giây chờ tối đa giữa hai lần khởi động lại
+    STABLE_AFTER = 60.0        # Chạy ổn định lâu hơn thời gian này thì reset backoff
+    HEARTBEAT_TIMEOUT = 30.0   # Không nhận được health quá thời gian này thì coi là treo
+
+    def __init__(self, account_configs):
+        self._ctx = multiprocessing.get_context('spawn')
+        self.status_queue = self._ctx.Queue()
+        self.engines = {}
+        for config in assign_state_api_ports(account_configs):
+            self.engines[config['name']] = {
+                'config': config,
+                'process': None,
+                'stop_event': None,
+                'started_at': None,
+                'restart_at': 0.0,   # Thời điểm (time.monotonic) được phép khởi động lại
+                'backoff': self.BACKOFF_INITIAL,
+                'restarts': 0,
+                'last_heartbeat': None,
+                'health': {},
+                'status': 'Chưa chạy',
+            }
+        self.stopping = False
+
+    def _start_engine(self, engine):
+        engine['stop_event'] = self._ctx.Event()
+        engine['process'] = self._ctx.Process(
+            target=run_engine_process,
+            args=(engine['config'], self.status_queue, engine['stop_event']),
+            name=f"engine-{engine['config']['name']}",
+            daemon=True,
+        )
+        engine['process'].start()
+        engine['started_at'] = time.monotonic()
+        engine['last_heartbeat'] = time.monotonic()
+        engine['status'] = 'Đang chạy'
+
+    def poll(self):
+        """
+        Nhận các thông điệp log/health từ tiến trình con và kiểm tra sức khỏe từng engine.
+        Trả về danh sách (tên tài khoản, tin nhắn log) mới nhận được.
+        """
+        logs = []
+        while True:
+            try:
+                kind, name, payload = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+            engine = self.engines.get(name)
+            if engine is None:
+                continue
+            if kind == 'health':
+                engine['health'] = payload
+                engine['last_heartbeat'] = time.monotonic()
+            else:
+                logs.append((name, payload))
+
+        if self.stopping:
+            return logs
+
+        now = time.monotonic()
+        for name, engine in self.engines.items():
+            process = engine['process']
+            if process is not None and process.is_alive():
+                if now - engine['last_heartbeat'] > self.HEARTBEAT_TIMEOUT:
+                    logs.append((name, "Không nhận được heartbeat, dừng tiến trình để khởi động lại."))
+                    process.terminate()
+                    process.join(timeout=1)
+                else:
+                    if now - engine['started_at'] > self.STABLE_AFTER:
+                        engine['backoff'] = self.BACKOFF_INITIAL
+                    continue
+
+            if process is not None and engine['restart_at'] <= engine['started_at']:
+                # Tiến trình vừa mới chết: lên lịch khởi động lại sau thời gian backoff
+                engine['restart_at'] = now + engine['backoff']
+                engine['status'] = f"Lỗi (mã {process.exitcode}), thử lại sau {engine['backoff']:.0f}s"
+                logs.append((name, f"Tiến trình engine kết thúc với mã {process.exitcode}. "
+                                   f"Khởi động lại sau {engine['backoff']:.0f} giây."))
+                engine['backoff'] = min(engine['backoff'] * 2, self.BACKOFF_MAX)
+                continue
+
+            if now >= engine['restart_at']:
+                if process is not None:
+                    engine['restarts'] += 1
+                self._start_engine(engine)
+                logs.append((name, "Đã khởi động tiến trình engine."))
+        return logs
+
+    def totals(self):
+        """Tổng hợp P/L nổi và P/L ngày của tất cả tài khoản."""
+        floating = sum(e['health'].get('floating_pnl', 0.0) for e in self.engines.values())
+        daily = sum(e['health'].get('daily_pnl') or 0.0 for e in self.engines.values())
+        return floating, daily
+
+    def stop_all(self, timeout=10):
+        """Yêu cầu tất cả engine dừng, chờ tối đa timeout giây rồi buộc dừng các tiến trình còn lại."""
+        self.stopping = True
+        for engine in self.engines.values():
+            if engine['stop_event'] is not None:
+                engine['stop_event'].set()
+        deadline = time.monotonic() + timeout
+        for engine in self.engines.values():
+            process = engine['process']
+            if process is not None:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+
+
+class SupervisorWindow(QWidget):
+    """Cửa sổ điều khiển chung: sức khỏe và P/L của tất cả tài khoản đang chạy engine."""
+    def __init__(self, account_configs):
+        super().__init__()
+        self.setWindowTitle("MT5 Breakeven Protector - Giám sát nhiều tài khoản")
+        self.resize(1000, 600)
+
+        self.supervisor = EngineSupervisor(account_configs)
+
+        layout = QVBoxLayout()
+        self.engines_table = QTableWidget()
+        self.engines_table.setColumnCount(9)
+        self.engines_table.setHorizontalHeaderLabels([
+            'Tài khoản', 'Trạng thái', 'PID', 'Khởi động lại', 'Lệnh mở',
+            'P/L nổi (USD)', 'P/L ngày (USD)', 'Trigger', 'Heartbeat (giây)'
+        ])
+        self.engines_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.engines_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.engines_table.setRowCount(len(self.supervisor.engines))
+        layout.addWidget(self.engines_table)
+
+        self.totals_label = QLabel("Tổng: -")
+        self.totals_label.setStyleSheet("font-weight: bold;")
+        layout.addWidget(self.totals_label)
+
+        self.log_area = QTextEdit()
+        self.log_area.setReadOnly(True)
+        layout.addWidget(QLabel("Log các engine:"))
+        layout.addWidget(self.log_area)
+        self.setLayout(layout)
+
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self.poll_engines)
+        self.poll_timer.start(500)
+        self.poll_engines()
+
+    def poll_engines(self):
+        """Nhận log/health từ các engine và cập nhật bảng."""
+        for name, message in self.supervisor.poll():
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            self.log_area.append(f"[{timestamp}] [{name}] {message}")
+
+        now = time.monotonic()
+        for row, (name, engine) in enumerate(self.supervisor.engines.items()):
+            health = engine['health']
+            process = engine['process']
+            daily_pnl = health.get('daily_pnl')
+            heartbeat_age = now - engine['last_heartbeat'] if engine['last_heartbeat'] else None
+            values = [
+                name,
+                engine['status'] if process is None or not process.is_alive()
+                else ('Đang chạy' if health.get('link_up', True) else 'Mất kết nối MT5, đang kết nối lại')
+                + (' (lỗi API trạng thái)' if health.get('state_api_error') else ''),
+                str(process.pid) if process is not None and process.is_alive() else "-",
+                str(engine['restarts']),
+                str(health.get('open_positions', '-')),
+                f"{health['floating_pnl']:.2f}" if 'floating_pnl' in health else "-",
+                f"{daily_pnl:.2f}" if daily_pnl is not None else "-",
+                str(health.get('active_triggers', '-')),
+                f"{heartbeat_age:.0f}" if heartbeat_age is not None else "-",
+            ]
+            for col, value in enumerate(values):
+                self.engines_table.setItem(row, col, QTableWidgetItem(value))
+
+        floating, daily = self.supervisor.totals()
+        self.totals_label.setText(f"Tổng {len(self.supervisor.engines)} tài khoản - P/L nổi: {floating:.2f} USD | P/L ngày: {daily:.2f} USD")
+
+    def closeEvent(self, event):
+        """Dừng tất cả tiến trình engine khi đóng cửa sổ."""
+        self.poll_timer.stop()
+        self.supervisor.stop_all()
+        super().closeEvent(event)
+
+
 # --- Main Application Entry Point ---
 def main():
-    """Khởi chạy ứng dụng."""
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    """
+    Khởi chạy ứng dụng.
+    Mặc định mở giao diện một tài khoản; với --accounts <file.json> sẽ chạy mỗi tài khoản
+    trong một tiến trình engine riêng và mở cửa sổ giám sát chung.
+    """
+    parser = argparse.ArgumentParser(description="MT5 Breakeven Protector & Order Trigger")
+    parser.add_argument('--accounts', help="File JSON: danh sách tài khoản (name, login, password, server, "
+                                           "terminal_path, params, breakeven_on, triggers)")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    if args.accounts:
+        with open(args.accounts, encoding='utf-8') as f:
+            account_configs = json.load(f)
+        try:
+            window = SupervisorWindow(account_configs)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        window = MainWindow()
     window.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,415 @@
+import sys
+import csv
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from protector_core import (
+    pip_step_for, breakeven_target_sl, evaluate_breakeven, detect_price_cross,
+    trigger_order_sides, stop_order_levels, trigger_should_activate, CROSS_NONE,
+)
+
+
+# --- Dữ liệu tick ---
+def load_ticks(path, poll_interval=0.0):
+    """
+    Đọc tick lịch sử từ file CSV (cột time_msc, bid, ask và tùy chọn last) hoặc .npy
+    (mảng có cấu trúc cùng tên trường, hoặc mảng 2 chiều theo đúng thứ tự cột trên).
+    Nếu poll_interval > 0 (giây), chỉ giữ tick cuối cùng của mỗi chu kỳ để mô phỏng nhịp lấy tick của engine thật.
+    Trả về (time_msc, bid, ask, last) dạng mảng numpy.
+    """
+    if path.lower().endswith('.npy'):
+        data = np.load(path, mmap_mode='r')
+        if data.dtype.names:
+            time_msc = np.asarray(data['time_msc'], dtype=np.int64)
+            bid = np.asarray(data['bid'], dtype=np.float64)
+            ask = np.asarray(data['ask'], dtype=np.float64)
+            last = np.asarray(data['last'], dtype=np.float64) if 'last' in data.dtype.names else np.zeros_like(bid)
+        else:
+            time_msc = np.asarray(data[:, 0], dtype=np.int64)
+            bid = np.asarray(data[:, 1], dtype=np.float64)
+            ask = np.asarray(data[:, 2], dtype=np.float64)
+            last = np.asarray(data[:, 3], dtype=np.float64) if data.shape[1] > 3 else np.zeros_like(bid)
+    else:
+        frame = pd.read_csv(path)
+        time_msc = frame['time_msc'].to_numpy(dtype=np.int64)
+        bid = frame['bid'].to_numpy(dtype=np.float64)
+        ask = frame['ask'].to_numpy(dtype=np.float64)
+        last = frame['last'].to_numpy(dtype=np.float64) if 'last' in frame.columns else np.zeros_like(bid)
+
+    # Bỏ các tick thiếu giá bid/ask (tick chỉ có last/volume)
+    valid = (bid > 0) & (ask > 0)
+    if not valid.all():
+        time_msc, bid, ask, last = time_msc[valid], bid[valid], ask[valid], last[valid]
+
+    if poll_interval > 0 and len(time_msc):
+        slots = time_msc // max(1, int(poll_interval * 1000))
+        keep = np.flatnonzero(np.append(slots[1:] != slots[:-1], True))
+        time_msc, bid, ask, last = time_msc[keep], bid[keep], ask[keep], last[keep]
+
+    return time_msc, bid, ask, last
+
+
+def trigger_prices(bid, ask, last):
+    """Giá dùng cho trigger giống engine thật: last nếu khác 0, ngược lại là giá giữa bid/ask."""
+    return np.where(last != 0, last, (bid + ask) / 2)
+
+
+# --- Bộ chạy lại (replay) ---
+class ReplayBacktester:
+    """
+    Chạy lại chuỗi tick qua đúng logic quyết định của BreakevenProtector (protector_core):
+    dời SL hòa vốn, phát hiện giao cắt điểm P của trigger và tính giá lệnh Buy Stop/Sell Stop.
+    Broker được mô phỏng: khớp lệnh chờ khi giá chạm, đóng vị thế khi chạm SL/TP, từ chối SL/lệnh chờ
+    sai phía giá hiện tại.
+
+    Để đạt tốc độ hàng triệu tick/giây, vòng lặp không duyệt từng tick: với mỗi vị thế, lệnh chờ và
+    trigger, numpy tìm chỉ số tick sớm nhất có thể xảy ra sự kiện, rồi logic dùng chung được gọi đúng
+    tại tick đó để xác nhận. Giữa hai sự kiện trạng thái không đổi nên kết quả giống hệt việc duyệt từng tick.
+    """
+    SEARCH_CHUNK = 4096         # Kích thước đoạn tìm kiếm ban đầu
+    SEARCH_CHUNK_MAX = 1 << 20  # Kích thước đoạn tìm kiếm tối đa
+
+    def __init__(self, time_msc, bid, ask, last, symbol_spec, params, breakeven_on=True,
+                 triggers=None, positions=None, trigger_price=None):
+        self.time_msc = time_msc
+        self.bid = bid
+        self.ask = ask
+        # Giá dùng cho trigger có thể truyền sẵn (ví dụ mảng memory-mapped dùng chung giữa các tiến trình) để khỏi tính lại.
+        self.trigger_price = trigger_price if trigger_price is not None else trigger_prices(bid, ask, last)
+        self.n = len(time_msc)
+
+        self.digits = int(symbol_spec.get('digits', 5))
+        self.point = float(symbol_spec.get('point', 10.0 ** -self.digits))
+        self.contract_size = float(symbol_spec.get('contract_size', 100000))
+        self.stop_level = symbol_spec.get('stops_level', 0) * self.point
+        self.freeze_level = symbol_spec.get('freeze_level', 0) * self.point
+        self.pip_step = pip_step_for(self.digits, self.point)
+        if self.pip_step == 0.0:
+            raise ValueError("Không thể xác định giá trị pip cho symbol (point = 0).")
+
+        self.break_even_pips = float(params.get('break_even_pips', 3.0))
+        self.break_even_offset = float(params.get('break_even_offset', 0.5))
+        self.breakeven_on = breakeven_on
+
+        self.trigger_configs = [dict(t) for t in (triggers or [])]
+        self.position_configs = [dict(p) for p in (positions or [])]
+
+        self.trades = []
+        self.stats = {}
+        self._next_ticket = 1
+        self._counters = {'be_moves': 0, 'be_rejected': 0, 'triggers_activated': 0,
+                          'orders_placed': 0, 'orders_rejected': 0, 'orders_filled': 0}
+
+    # --- Tìm kiếm sự kiện bằng numpy ---
+    def _find_first(self, start, condition):
+        """Chỉ số tick đầu tiên >= start thỏa condition(start, end) (mảng bool), hoặc None."""
+        chunk = self.SEARCH_CHUNK
+        while start < self.n:
+            end = min(start + chunk, self.n)
+            hits = np.flatnonzero(condition(start, end))
+            if hits.size:
+                return start + int(hits[0])
+            start = end
+            chunk = min(chunk * 4, self.SEARCH_CHUNK_MAX)
+        return None
+
+    def _position_event(self, pos, start):
+        """Tick sớm nhất mà vị thế có thể chạm SL/TP hoặc đủ điều kiện dời SL hòa vốn."""
+        is_buy = pos['is_buy']
+        sl, tp, price_open = pos['sl'], pos['tp'], pos['price_open']
+
+        be_target = round(breakeven_target_sl(is_buy, price_open, self.break_even_offset, self.pip_step), self.digits)
+        check_be = self.breakeven_on and (sl == 0.0 or (is_buy and sl < be_target) or (not is_buy and sl > be_target))
+
+        def condition(s, e):
+            close_side = self.bid[s:e] if is_buy else self.ask[s:e]
+            if is_buy:
+                mask = (close_side <= sl) if sl else np.zeros(e - s, dtype=bool)
+                if tp:
+                    mask |= close_side >= tp
+            else:
+                mask = (close_side >= sl) if sl else np.zeros(e - s, dtype=bool)
+                if tp:
+                    mask |= close_side <= tp
+            if check_be:
+                # Điều kiện cần: đủ pip (cùng công thức với protector_core) và broker chấp nhận SL mới
+                curr = self.ask[s:e] if is_buy else self.bid[s:e]
+                be_mask = np.abs((curr - price_open) / self.pip_step) >= self.break_even_pips
+                if is_buy:
+                    be_mask &= be_target < close_side - self.stop_level
+                else:
+                    be_mask &= be_target > close_side + self.stop_level
+                if self.freeze_level > 0:
+                    be_mask &= np.abs(curr - price_open) >= self.freeze_level
+                mask |= be_mask
+            return mask
+
+        return self._find_first(start, condition)
+
+    def _order_event(self, order, start):
+        """Tick sớm nhất mà lệnh chờ được khớp (Buy Stop: ask >= giá đặt, Sell Stop: bid <= giá đặt)."""
+        price = order['price']
+        if order['is_buy']:
+            return self._find_first(start, lambda s, e: self.ask[s:e] >= price)
+        return self._find_first(start, lambda s, e: self.bid[s:e] <= price)
+
+    def _trigger_event(self, trigger, start):
+        """Tick sớm nhất mà giá trigger đi qua điểm P so với tick liền trước."""
+        price_P = trigger['price_P']
+        prices = self.trigger_price
+
+        def condition(s, e):
+            prev = prices[s - 1:e - 1]
+            curr = prices[s:e]
+            return ((prev < price_P) & (curr >= price_P)) | ((prev > price_P) & (curr <= price_P))
+
+        return self._find_first(max(start, 1), condition)
+
+    # --- Broker mô phỏng ---
+    def _open_position(self, index, is_buy, volume, sl, tp, source):
+        price_open = float(self.ask[index] if is_buy else self.bid[index])
+        pos = {'ticket': self._next_ticket, 'is_buy': is_buy, 'volume': volume, 'price_open': price_open,
+               'sl': sl, 'tp': tp, 'open_index': index, 'source': source, 'be_moved': False}
+        self._next_ticket += 1
+        return pos
+
+    def _close_position(self, pos, index, reason):
+        close_price = float(self.bid[index] if pos['is_buy'] else self.ask[index])
+        direction = 1 if pos['is_buy'] else -1
+        profit_pips = (close_price - pos['price_open']) / self.pip_step * direction
+        profit = (close_price - pos['price_open']) * direction * pos['volume'] * self.contract_size
+        self.trades.append({
+            'ticket': pos['ticket'],
+            'source': pos['source'],
+            'type': "Buy" if pos['is_buy'] else "Sell",
+            'volume': pos['volume'],
+            'open_time_msc': int(self.time_msc[pos['open_index']]),
+            'open_price': pos['price_open'],
+            'close_time_msc': int(self.time_msc[index]),
+            'close_price': close_price,
+            'sl': pos['sl'],
+            'tp': pos['tp'],
+            'reason': reason,
+            'be_moved': pos['be_moved'],
+            'profit_pips': round(profit_pips, 2),
+            'profit': round(profit, 2),
+        })
+
+    def _handle_position(self, pos, index):
+        """Xử lý vị thế tại tick index. Trả về True nếu vị thế đã đóng."""
+        bid, ask = self.bid[index], self.ask[index]
+        is_buy = pos['is_buy']
+        close_side = bid if is_buy else ask
+        if pos['sl'] and ((is_buy and close_side <= pos['sl']) or (not is_buy and close_side >= pos['sl'])):
+            self._close_position(pos, index, 'be_sl' if pos['be_moved'] else 'sl')
+            return True
+        if pos['tp'] and ((is_buy and close_side >= pos['tp']) or (not is_buy and close_side <= pos['tp'])):
+            self._close_position(pos, index, 'tp')
+            return True
+
+        if self.breakeven_on:
+            new_sl = evaluate_breakeven(
+                is_buy, pos['price_open'], pos['sl'], float(ask if is_buy else bid), self.pip_step,
+                self.break_even_pips, self.break_even_offset, self.stop_level, self.freeze_level, self.digits
+            )
+            if new_sl is not None:
+                # Broker từ chối SL nằm sai phía giá đóng lệnh hiện tại
+                if (is_buy and new_sl < bid - self.stop_level) or (not is_buy and new_sl > ask + self.stop_level):
+                    pos['sl'] = new_sl
+                    pos['be_moved'] = True
+                    self._counters['be_moves'] += 1
+                else:
+                    self._counters['be_rejected'] += 1
+        return False
+
+    def _handle_trigger(self, trigger, index, pending_orders):
+        """Xử lý giao cắt điểm P tại tick index. Trả về True nếu trigger đã kích hoạt."""
+        price_P = trigger['price_P']
+        if detect_price_cross(self.trigger_price[index - 1], self.trigger_price[index], price_P) == CROSS_NONE:
+            return False
+
+        order_type = trigger.get('order_type', 'Double Stop')
+        placed = {'buy': False, 'sell': False}
+        for side in trigger_order_sides(order_type):
+            is_buy = side == 'buy'
+            price, sl, tp = stop_order_levels(
+                price_P, is_buy,
+                trigger['buy_stop_offset_pips'] if is_buy else trigger['sell_stop_offset_pips'],
+                trigger['triggered_orders_tp_pips'], trigger['triggered_orders_sl_pips'],
+                self.pip_step, self.digits
+            )
+            # Lệnh Stop phải nằm đúng phía giá hiện tại và cách ít nhất stops_level
+            if (is_buy and price > self.ask[index] + self.stop_level) or \
+               (not is_buy and price < self.bid[index] - self.stop_level):
+                order = {'is_buy': is_buy, 'price': price, 'sl': sl, 'tp': tp,
+                         'volume': trigger['triggered_orders_lot_size'], 'trigger_id': trigger['id']}
+                order['next_index'] = self._order_event(order, index + 1)
+                pending_orders.append(order)
+                placed[side] = True
+                self._counters['orders_placed'] += 1
+            else:
+                self._counters['orders_rejected'] += 1
+
+        if trigger_should_activate(order_type, placed['buy'], placed['sell']):
+            self._counters['triggers_activated'] += 1
+            return True
+        return False
+
+    # --- Vòng lặp chính ---
+    def run(self):
+        """Chạy lại toàn bộ chuỗi tick. Trả về (danh sách giao dịch, thống kê tổng hợp)."""
+        started = time.perf_counter()
+        positions = []
+        pending_orders = []
+        triggers = []
+
+        if self.n == 0:
+            self.stats = self._summarize(0.0, 0)
+            return self.trades, self.stats
+
+        for i, trigger in enumerate(self.trigger_configs):
+            trigger.setdefault('id', i + 1)
+            start = int(np.searchsorted(self.time_msc, trigger.get('start_time_msc', self.time_msc[0])))
+            trigger['next_index'] = self._trigger_event(trigger, start + 1)
+            triggers.append(trigger)
+
+        for config in self.position_configs:
+            index = int(np.searchsorted(self.time_msc, config.get('time_msc', self.time_msc[0])))
+            if index >= self.n:
+                continue
+            is_buy = config.get('type', 'Buy') == 'Buy'
+            open_price = float(self.ask[index] if is_buy else self.bid[index])
+            direction = 1 if is_buy else -1
+            sl_pips, tp_pips = config.get('sl_pips', 0), config.get('tp_pips', 0)
+            sl = round(open_price - direction * sl_pips * self.pip_step, self.digits) if sl_pips > 0 else 0.0
+            tp = round(open_price + direction * tp_pips * self.pip_step, self.digits) if tp_pips > 0 else 0.0
+            pos = self._open_position(index, is_buy, config.get('volume', 0.01), sl, tp, 'manual')
+            pos['next_index'] = self._position_event(pos, index + 1)
+            positions.append(pos)
+
+        events = 0
+        while True:
+            # Chọn sự kiện sớm nhất trong tất cả đối tượng đang theo dõi
+            next_index, kind, item = None, None, None
+            for group_kind, group in (('position', positions), ('order', pending_orders), ('trigger', triggers)):
+                for candidate in group:
+                    if candidate['next_index'] is not None and (next_index is None or candidate['next_index'] < next_index):
+                        next_index, kind, item = candidate['next_index'], group_kind, candidate
+            if next_index is None:
+                break
+            events += 1
+
+            if kind == 'position':
+                if self._handle_position(item, next_index):
+                    positions.remove(item)
+                else:
+                    item['next_index'] = self._position_event(item, next_index + 1)
+            elif kind == 'order':
+                pending_orders.remove(item)
+                self._counters['orders_filled'] += 1
+                pos = self._open_position(next_index, item['is_buy'], item['volume'], item['sl'], item['tp'],
+                                          f"trigger {item['trigger_id']}")
+                pos['next_index'] = self._position_event(pos, next_index + 1)
+                positions.append(pos)
+            else:
+                if self._handle_trigger(item, next_index, pending_orders):
+                    triggers.remove(item)
+                else:
+                    item['next_index'] = self._trigger_event(item, next_index + 1)
+
+        # Đóng các vị thế còn mở tại tick cuối cùng
+        for pos in positions:
+            self._close_position(pos, self.n - 1, 'end')
+        self.trades.sort(key=lambda t: (t['close_time_msc'], t['ticket']))
+
+        self.stats = self._summarize(time.perf_counter() - started, events)
+        self.stats['pending_orders_left'] = len(pending_orders)
+        self.stats['triggers_not_activated'] = len(triggers)
+        return self.trades, self.stats
+
+    def _summarize(self, elapsed, events):
+        """Thống kê tổng hợp của lần chạy."""
+        profits = np.array([t['profit'] for t in self.trades], dtype=np.float64)
+        pips = np.array([t['profit_pips'] for t in self.trades], dtype=np.float64)
+        equity = np.cumsum(profits) if len(profits) else np.zeros(1)
+        drawdown = np.maximum.accumulate(np.maximum(equity, 0.0)) - equity
+        wins = int((profits > 0).sum())
+        stats = {
+            'ticks': self.n,
+            'events': events,
+            'elapsed_sec': round(elapsed, 4),
+            'ticks_per_sec': round(self.n / elapsed) if elapsed > 0 else 0,
+            'trades': len(self.trades),
+            'wins': wins,
+            'losses': int((profits < 0).sum()),
+            'win_rate': round(wins / len(profits), 4) if len(profits) else 0.0,
+            'net_profit': round(float(profits.sum()), 2),
+            'net_pips': round(float(pips.sum()), 2),
+            'avg_profit': round(float(profits.mean()), 2) if len(profits) else 0.0,
+            'max_drawdown': round(float(drawdown.max()), 2),
+            'be_stopouts': sum(1 for t in self.trades if t['reason'] == 'be_sl'),
+        }
+        stats.update(self._counters)
+        return stats
+
+
+def write_trades_csv(trades, path):
+    """Ghi nhật ký giao dịch ra file CSV."""
+    fields = ['ticket', 'source', 'type', 'volume', 'open_time_msc', 'open_price', 'close_time_msc',
+              'close_price', 'sl', 'tp', 'reason', 'be_moved', 'profit_pips', 'profit']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(trades)
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """
+    Chạy backtest từ dòng lệnh. File cấu hình JSON gồm:
+    symbol (digits, point, contract_size, stops_level, freeze_level), params (break_even_pips, break_even_offset),
+    breakeven_on, triggers (giống cấu hình trigger trên GUI, thêm start_time_msc tùy chọn)
+    và positions (type, volume, sl_pips, tp_pips, time_msc) để mở sẵn vị thế.
+    """
+    parser = argparse.ArgumentParser(description="Backtest logic breakeven/trigger bằng dữ liệu tick lịch sử")
+    parser.add_argument('ticks', help="File tick .csv hoặc .npy (time_msc, bid, ask[, last])")
+    parser.add_argument('--config', required=True, help="File cấu hình JSON của kịch bản")
+    parser.add_argument('--poll-interval', type=float, default=0.0,
+                        help="Mô phỏng chu kỳ lấy tick của engine (giây), 0 = dùng mọi tick")
+    parser.add_argument('--be-pips', type=float, help="Ghi đè break_even_pips")
+    parser.add_argument('--be-offset', type=float, help="Ghi đè break_even_offset")
+    parser.add_argument('--trades-out', help="Ghi nhật ký giao dịch ra file CSV")
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+    params = dict(config.get('params', {}))
+    if args.be_pips is not None:
+        params['break_even_pips'] = args.be_pips
+    if args.be_offset is not None:
+        params['break_even_offset'] = args.be_offset
+
+    load_started = time.perf_counter()
+    time_msc, bid, ask, last = load_ticks(args.ticks, args.poll_interval)
+    load_elapsed = time.perf_counter() - load_started
+
+    backtester = ReplayBacktester(
+        time_msc, bid, ask, last, config.get('symbol', {}), params,
+        breakeven_on=config.get('breakeven_on', True),
+        triggers=config.get('triggers', []), positions=config.get('positions', [])
+    )
+    trades, stats = backtester.run()
+    stats['load_sec'] = round(load_elapsed, 4)
+
+    if args.trades_out:
+        write_trades_csv(trades, args.trades_out)
+    json.dump(stats, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
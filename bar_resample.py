@@ -0,0 +1,196 @@
+import sys
+import argparse
+
+import numpy as np
+
+from bar_store import BAR_DTYPE, to_bar_array
+
+
+# Độ dài danh nghĩa của mỗi khung thời gian (giây). W1 và MN1 không chia đều theo giây nên được
+# nhóm theo lịch (tuần bắt đầu Chủ nhật, tháng bắt đầu ngày 1); MN1 dùng 31 ngày để ước lượng số nến cần tải.
+TIMEFRAME_SECONDS = {
+    'M1': 60, 'M5': 300, 'M15': 900, 'M30': 1800,
+    'H1': 3600, 'H4': 14400, 'D1': 86400, 'W1': 7 * 86400, 'MN1': 31 * 86400,
+}
+CALENDAR_TIMEFRAMES = ('W1', 'MN1')
+# 1970-01-01 là thứ Năm; nến W1 của MT5 mở lúc 00:00 Chủ nhật (giờ server), Chủ nhật đầu tiên là 1970-01-04
+WEEK_ORIGIN = 3 * 86400
+# Giới hạn số nến khung gốc cần tải để dựng một khung lớn hơn; vượt quá thì tải trực tiếp khung đó từ terminal
+MAX_BASE_BARS = 20000
+
+
+# --- Nhóm nến theo khung thời gian ---
+def period_start(times: np.ndarray, tf_str: str) -> np.ndarray:
+    """
+    Thời gian mở nến khung tf_str chứa mỗi mốc thời gian (giây).
+    Thời gian nến của MT5 là giờ server dạng epoch, nên ranh giới ngày/tuần/tháng tính trực tiếp trên giá trị này
+    chính là ranh giới theo giờ server của broker.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    if tf_str == 'MN1':
+        months = times.astype('datetime64[s]').astype('datetime64[M]')
+        return months.astype('datetime64[s]').astype(np.int64)
+    if tf_str == 'W1':
+        week = TIMEFRAME_SECONDS['W1']
+        return (times - WEEK_ORIGIN) // week * week + WEEK_ORIGIN
+    seconds = TIMEFRAME_SECONDS[tf_str]
+    return times // seconds * seconds
+
+
+def can_derive(base_tf: str, target_tf: str) -> bool:
+    """Khung target_tf có dựng được từ base_tf không (mỗi nến gốc nằm trọn trong một nến đích)."""
+    if base_tf == target_tf or base_tf not in TIMEFRAME_SECONDS or target_tf not in TIMEFRAME_SECONDS:
+        return False
+    if base_tf in CALENDAR_TIMEFRAMES:
+        return False # Tuần không nằm trọn trong tháng
+    if target_tf in CALENDAR_TIMEFRAMES:
+        return TIMEFRAME_SECONDS[base_tf] <= TIMEFRAME_SECONDS['D1']
+    return TIMEFRAME_SECONDS[target_tf] % TIMEFRAME_SECONDS[base_tf] == 0
+
+
+def base_bars_needed(base_tf: str, target_tf: str, target_bars: int) -> int:
+    """
+    Số nến base_tf cần tải để có target_bars nến target_tf đã đóng, tính thêm nến đang chạy và
+    nến đầu tiên có thể thiếu dữ liệu (bị bỏ khi dựng).
+    """
+    if base_tf == target_tf:
+        return target_bars
+    ratio = -(-TIMEFRAME_SECONDS[target_tf] // TIMEFRAME_SECONDS[base_tf])
+    return (target_bars + 2) * ratio
+
+
+def plan_timeframes(tf_strs, target_bars: int, max_base_bars: int = MAX_BASE_BARS) -> dict:
+    """
+    Chia các khung thời gian cần tính thành nhóm theo khung gốc: mỗi nhóm chỉ tải nến của khung gốc
+    (khung nhỏ nhất trong danh sách dựng được khung đó với không quá max_base_bars nến), các khung khác
+    trong nhóm được dựng lại cục bộ. Trả về {khung gốc: [các khung đích, gồm cả khung gốc nếu được yêu cầu]}.
+    """
+    requested = [tf for tf in dict.fromkeys(tf_strs) if tf in TIMEFRAME_SECONDS]
+    ordered = sorted(requested, key=lambda tf: TIMEFRAME_SECONDS[tf])
+    plan = {}
+    for tf in ordered:
+        base = next((b for b in plan if can_derive(b, tf)
+                     and base_bars_needed(b, tf, target_bars) <= max_base_bars), tf)
+        plan.setdefault(base, []).append(tf)
+    return plan
+
+
+def resample_bars(bars: np.ndarray, tf_str: str, drop_first_partial: bool = True) -> np.ndarray:
+    """
+    Dựng nến tf_str từ nến khung nhỏ hơn (BAR_DTYPE, tăng dần theo thời gian) bằng phép nhóm vector hóa:
+    open của nến đầu nhóm, high/low lớn nhất/nhỏ nhất, close của nến cuối nhóm, volume cộng dồn,
+    spread nhỏ nhất trong nhóm.
+    drop_first_partial: bỏ nhóm đầu tiên vì dữ liệu gốc có thể bắt đầu giữa chừng nến đích.
+    Nhóm cuối cùng là nến đang chạy nếu nến gốc cuối cùng là nến đang chạy.
+    """
+    if len(bars) == 0:
+        return np.zeros(0, dtype=BAR_DTYPE)
+    starts_time = period_start(bars['time'], tf_str)
+    starts = np.flatnonzero(np.concatenate(([True], starts_time[1:] != starts_time[:-1])))
+    ends = np.append(starts[1:], len(bars)) - 1
+
+    result = np.zeros(len(starts), dtype=BAR_DTYPE)
+    result['time'] = starts_time[starts]
+    result['open'] = bars['open'][starts]
+    result['high'] = np.maximum.reduceat(bars['high'], starts)
+    result['low'] = np.minimum.reduceat(bars['low'], starts)
+    result['close'] = bars['close'][ends]
+    result['tick_volume'] = np.add.reduceat(bars['tick_volume'], starts)
+    result['real_volume'] = np.add.reduceat(bars['real_volume'], starts)
+    result['spread'] = np.minimum.reduceat(bars['spread'], starts)
+    return result[1:] if drop_first_partial else result
+
+
+# --- Đối chiếu với nến của terminal ---
+def compare_with_terminal(derived: np.ndarray, terminal_bars: np.ndarray, digits: int) -> dict:
+    """
+    So sánh nến dựng cục bộ với nến của terminal trên khoảng thời gian chung (bỏ nến đang chạy của cả hai).
+    Giá được so sánh sau khi làm tròn theo digits. Trả về thống kê số nến khớp/lệch và vài ví dụ lệch.
+    """
+    derived = derived[:-1]
+    terminal_bars = to_bar_array(terminal_bars)[:-1]
+    report = {'compared': 0, 'price_mismatches': 0, 'volume_mismatches': 0,
+              'missing_local': 0, 'missing_terminal': 0, 'examples': []}
+    if not len(derived) or not len(terminal_bars):
+        return report
+
+    first = max(derived['time'][0], terminal_bars['time'][0])
+    last = min(derived['time'][-1], terminal_bars['time'][-1])
+    derived = derived[(derived['time'] >= first) & (derived['time'] <= last)]
+    terminal_bars = terminal_bars[(terminal_bars['time'] >= first) & (terminal_bars['time'] <= last)]
+
+    common, local_index, terminal_index = np.intersect1d(derived['time'], terminal_bars['time'], return_indices=True)
+    report['compared'] = len(common)
+    report['missing_local'] = len(terminal_bars) - len(common)
+    report['missing_terminal'] = len(derived) - len(common)
+
+    local, remote = derived[local_index], terminal_bars[terminal_index]
+    price_diff = np.zeros(len(common), dtype=bool)
+    for field in ('open', 'high', 'low', 'close'):
+        price_diff |= np.round(local[field], digits) != np.round(remote[field], digits)
+    volume_diff = local['tick_volume'] != remote['tick_volume']
+    report['price_mismatches'] = int(price_diff.sum())
+    report['volume_mismatches'] = int(volume_diff.sum())
+    for i in np.flatnonzero(price_diff)[:5]:
+        report['examples'].append({
+            'time': int(common[i]),
+            'local': [float(local[i][f]) for f in ('open', 'high', 'low', 'close')],
+            'terminal': [float(remote[i][f]) for f in ('open', 'high', 'low', 'close')],
+        })
+    return report
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Đối chiếu nến dựng cục bộ từ khung gốc với nến của terminal cho một hoặc nhiều symbol."""
+    parser = argparse.ArgumentParser(description="Kiểm tra nến dựng cục bộ so với nến của terminal MT5")
+    parser.add_argument('symbols', nargs='+', help="Các symbol cần kiểm tra")
+    parser.add_argument('--base', default='D1', help="Khung gốc dùng để dựng (mặc định D1)")
+    parser.add_argument('--targets', default='W1,MN1', help="Các khung cần dựng, cách nhau bởi dấu phẩy")
+    parser.add_argument('--bars', type=int, default=100, help="Số nến khung đích cần đối chiếu")
+    args = parser.parse_args(argv)
+
+    import MetaTrader5 as mt5 # Chỉ cần khi chạy kiểm tra với terminal
+    if not mt5.initialize():
+        print(f"Không thể kết nối MT5: {mt5.last_error()}", file=sys.stderr)
+        return 1
+
+    targets = [tf.strip() for tf in args.targets.split(',') if tf.strip()]
+    failed = False
+    try:
+        for symbol in args.symbols:
+            info = mt5.symbol_info(symbol)
+            if info is None or not mt5.symbol_select(symbol, True):
+                print(f"{symbol}: không tìm thấy symbol", file=sys.stderr)
+                failed = True
+                continue
+            base_count = max(base_bars_needed(args.base, tf, args.bars) for tf in targets)
+            base_rates = mt5.copy_rates_from_pos(symbol, getattr(mt5, f"TIMEFRAME_{args.base}"), 0, base_count)
+            if base_rates is None:
+                print(f"{symbol}: không tải được nến {args.base}: {mt5.last_error()}", file=sys.stderr)
+                failed = True
+                continue
+            base_bars = to_bar_array(base_rates)
+            for tf in targets:
+                if not can_derive(args.base, tf):
+                    print(f"{symbol} {tf}: không dựng được từ {args.base}")
+                    continue
+                terminal_rates = mt5.copy_rates_from_pos(symbol, getattr(mt5, f"TIMEFRAME_{tf}"), 0, args.bars + 1)
+                if terminal_rates is None:
+                    print(f"{symbol} {tf}: không tải được nến từ terminal: {mt5.last_error()}", file=sys.stderr)
+                    failed = True
+                    continue
+                report = compare_with_terminal(resample_bars(base_bars, tf), terminal_rates, info.digits)
+                failed |= report['price_mismatches'] > 0 or report['missing_local'] > 0 or report['missing_terminal'] > 0
+                print(f"{symbol} {args.base}->{tf}: so sánh {report['compared']} nến, lệch giá {report['price_mismatches']}, "
+                      f"lệch volume {report['volume_mismatches']}, thiếu cục bộ {report['missing_local']}, "
+                      f"thiếu trên terminal {report['missing_terminal']}")
+                for example in report['examples']:
+                    print(f"    {example}")
+    finally:
+        mt5.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import os
+import datetime
+import threading
+
+import numpy as np
+
+
+# Cấu trúc một nến, cùng thứ tự trường với mảng trả về từ copy_rates_* của MT5
+BAR_DTYPE = np.dtype([
+    ('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+    ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8'),
+])
+BAR_FILE_EXTENSION = '.bars'
+
+
+def to_bar_array(rates) -> np.ndarray:
+    """Chuyển mảng nến của MT5 (hoặc mảng có cấu trúc cùng tên trường) sang BAR_DTYPE, theo tên trường."""
+    rates = np.asarray(rates)
+    bars = np.zeros(len(rates), dtype=BAR_DTYPE)
+    for name in BAR_DTYPE.names:
+        if rates.dtype.names and name in rates.dtype.names:
+            bars[name] = rates[name]
+    return bars
+
+
+class BarStore:
+    """
+    Kho nến cục bộ trên đĩa: mỗi cặp symbol/khung thời gian là một file nhị phân gồm các bản ghi BAR_DTYPE
+    liên tiếp (root_dir/<symbol>/<khung thời gian>.bars), sắp xếp tăng dần theo thời gian mở nến.
+    - Đọc bằng np.memmap chỉ đọc: không sao chép dữ liệu, các cột như bars['close'] là view trên file.
+    - Ghi chỉ nối thêm các nến mới hơn nến cuối đã lưu, nên mỗi lần quét chỉ phải tải phần đuôi còn thiếu từ MT5.
+    - Chỉ lưu nến đã đóng; nến đang chạy luôn lấy trực tiếp từ terminal.
+    terminal: module MetaTrader5 (chỉ cần cho sync); để None khi chỉ đọc, ví dụ trong backtest.
+    View trả về từ read/sync không nên giữ qua lần sync kế tiếp của cùng symbol/khung thời gian,
+    vì file có thể được ghi lại khi cần tải thêm lịch sử cũ.
+    """
+    def __init__(self, root_dir: str, terminal=None):
+        self.root_dir = root_dir
+        self.terminal = terminal
+        self._maps = {}  # Key: (symbol, tf_str), Value: memmap đang mở (độ dài tại thời điểm mở)
+        self._lock = threading.Lock()
+        self.fetched_bars = 0  # Tổng số nến đã tải từ MT5, để theo dõi hiệu quả của kho
+
+    def path_for(self, symbol: str, tf_str: str) -> str:
+        return os.path.join(self.root_dir, symbol, tf_str + BAR_FILE_EXTENSION)
+
+    # --- Đọc ---
+    def read(self, symbol: str, tf_str: str) -> np.ndarray:
+        """Toàn bộ nến đã lưu dạng memmap chỉ đọc (mảng rỗng nếu chưa có)."""
+        with self._lock:
+            return self._open(symbol, tf_str)
+
+    def last_time(self, symbol: str, tf_str: str):
+        """Thời gian mở của nến cuối cùng đã lưu, hoặc None nếu chưa có."""
+        bars = self.read(symbol, tf_str)
+        return int(bars['time'][-1]) if len(bars) else None
+
+    def _open(self, symbol: str, tf_str: str) -> np.ndarray:
+        """Mở (hoặc dùng lại) memmap của file; mở lại khi file đã dài thêm. Gọi khi đang giữ _lock."""
+        key = (symbol, tf_str)
+        path = self.path_for(symbol, tf_str)
+        if not os.path.exists(path):
+            self._maps.pop(key, None)
+            return np.zeros(0, dtype=BAR_DTYPE)
+
+        size = os.path.getsize(path)
+        count = size // BAR_DTYPE.itemsize
+        cached = self._maps.get(key)
+        if cached is not None and len(cached) == count:
+            return cached
+
+        self._maps.pop(key, None)
+        if size % BAR_DTYPE.itemsize:
+            # Bản ghi cuối bị ghi dở (ví dụ chương trình bị tắt giữa chừng): bỏ phần thừa
+            with open(path, 'r+b') as f:
+                f.truncate(count * BAR_DTYPE.itemsize)
+        if count == 0:
+            return np.zeros(0, dtype=BAR_DTYPE)
+        bars = np.memmap(path, dtype=BAR_DTYPE, mode='r', shape=(count,))
+        self._maps[key] = bars
+        return bars
+
+    # --- Ghi ---
+    def append(self, symbol: str, tf_str: str, rates) -> int:
+        """Nối thêm các nến mới hơn nến cuối đã lưu. Trả về số nến đã ghi."""
+        with self._lock:
+            return self._append(symbol, tf_str, to_bar_array(rates))
+
+    def _append(self, symbol: str, tf_str: str, bars: np.ndarray) -> int:
+        stored = self._open(symbol, tf_str)
+        if len(stored):
+            bars = bars[bars['time'] > stored['time'][-1]]
+        if not len(bars):
+            return 0
+        path = self.path_for(symbol, tf_str)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(np.sort(bars, order='time').tobytes())
+        return len(bars)
+
+    def _rewrite(self, symbol: str, tf_str: str, bars: np.ndarray):
+        """Ghi lại toàn bộ file (khi cần thêm lịch sử cũ hơn phần đã lưu). Ghi ra file tạm rồi thay thế."""
+        self._maps.pop((symbol, tf_str), None) # Đóng memmap cũ trước khi thay file (bắt buộc trên Windows)
+        path = self.path_for(symbol, tf_str)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(np.sort(bars, order='time').tobytes())
+        os.replace(temp_path, path)
+
+    # --- Đồng bộ với MT5 ---
+    def sync(self, symbol: str, tf_str: str, timeframe: int, closed_bar_time: int, min_bars: int) -> np.ndarray:
+        """
+        Đảm bảo kho có các nến đã đóng đến closed_bar_time (thời gian mở nến đã đóng gần nhất) và ít nhất
+        min_bars nến, chỉ tải phần còn thiếu từ MT5:
+        - Nến cuối đã lưu là closed_bar_time: không gọi MT5.
+        - Đủ lịch sử nhưng thiếu phần đuôi: copy_rates_range từ sau nến cuối đã lưu đến closed_bar_time.
+        - Chưa có hoặc chưa đủ min_bars nến: tải lại min_bars nến đã đóng bằng copy_rates_from_pos.
+        Trả về view chỉ đọc của các nến có thời gian mở <= closed_bar_time.
+        Ném RuntimeError nếu MT5 không trả về dữ liệu hoặc không đủ min_bars nến.
+        """
+        with self._lock:
+            stored = self._open(symbol, tf_str)
+            last_time = int(stored['time'][-1]) if len(stored) else None
+
+            if last_time is None or len(stored) < min_bars:
+                rates = self.terminal.copy_rates_from_pos(symbol, timeframe, 1, min_bars)
+                if rates is None or len(rates) == 0:
+                    raise RuntimeError(f"Không tải được nến cho {symbol} {tf_str}: {self.terminal.last_error()}")
+                fetched = to_bar_array(rates)
+                self.fetched_bars += len(fetched)
+                if len(stored):
+                    # Giữ phần đã lưu mới hơn dữ liệu vừa tải (nếu có) để không làm mất nến
+                    fetched = np.concatenate([fetched, stored[stored['time'] > fetched['time'][-1]]])
+                stored = None # Bỏ tham chiếu tới memmap cũ trước khi thay file
+                self._rewrite(symbol, tf_str, fetched)
+            elif last_time < closed_bar_time:
+                date_from = datetime.datetime.fromtimestamp(last_time + 1, tz=datetime.timezone.utc)
+                date_to = datetime.datetime.fromtimestamp(closed_bar_time, tz=datetime.timezone.utc)
+                rates = self.terminal.copy_rates_range(symbol, timeframe, date_from, date_to)
+                if rates is None:
+                    raise RuntimeError(f"Không tải được nến mới cho {symbol} {tf_str}: {self.terminal.last_error()}")
+                self.fetched_bars += len(rates)
+                self._append(symbol, tf_str, to_bar_array(rates))
+
+            bars = self._open(symbol, tf_str)
+            end = int(np.searchsorted(bars['time'], closed_bar_time, side='right')) if len(bars) else 0
+            if end < min_bars:
+                raise RuntimeError(f"Không đủ dữ liệu cho {symbol} {tf_str}: chỉ có {end}/{min_bars} nến.")
+            return bars[:end]
+
+    def summary(self) -> str:
+        """Chuỗi thống kê ngắn để hiển thị trên nhãn trạng thái."""
+        return f"Kho nến: {self.fetched_bars} nến tải từ MT5"
@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque, Counter
+
+
+# --- Nhật ký sự kiện có cấu trúc của engine (JSON Lines, chỉ ghi nối) ---
+# Luồng engine gọi EventJournal.record(): chỉ thêm (thời điểm, loại, trường) vào một deque rồi trả về, không
+# serialize và không chạm tới đĩa. Luồng ghi nền gom các sự kiện thành lô, ghi một lần mỗi lô và fsync theo
+# chính sách đã chọn. Mỗi dòng là một JSON: {"t": epoch giây, "seq": số thứ tự, "ev": loại sự kiện, ...trường}.
+#
+# Loại sự kiện do bot ghi:
+#   session_start/session_end  thông tin phiên (tham số, pid) và thống kê của nhật ký khi đóng
+#   tick          tick mới của symbol đang theo dõi (time_msc, bid, ask)
+#   cross         trigger phát hiện giá đi qua điểm P (hướng, giá trước/sau)
+#   order         yêu cầu gửi tới terminal: action, request rút gọn, retcode, ticket kết quả, latency_ms
+#                 lệnh breakeven/trigger có thêm vết độ trễ tick->lệnh (latency_trace.py): tick_time_msc,
+#                 poll_interval_ms và các đoạn tick_age_ms ... tick_to_done_ms
+#   trigger_*     thêm/xóa/kích hoạt trigger
+#   eod_cleanup   dọn dẹp cuối ngày (bắt đầu/kết thúc, số lệnh đóng/hủy)
+#   loss_limit    lãi/lỗ ngày vượt giới hạn
+
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal")
+FSYNC_ALWAYS = 'always'       # fsync sau mỗi lô (an toàn nhất, chậm nhất)
+FSYNC_INTERVAL = 'interval'   # fsync tối đa một lần mỗi fsync_interval giây
+FSYNC_NEVER = 'never'         # Chỉ flush vào bộ đệm hệ điều hành
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+FLUSH_INTERVAL = 0.5          # Chu kỳ ghi lô khi ít sự kiện (giây)
+FSYNC_EVERY = 5.0             # Chu kỳ fsync của chính sách 'interval' (giây)
+BATCH_SIZE = 512              # Đủ số sự kiện này thì đánh thức luồng ghi ngay
+MAX_PENDING = 100000          # Hàng đợi đầy (đĩa quá chậm) thì bỏ sự kiện mới thay vì chặn engine
+
+
+def session_journal_path(directory: str = JOURNAL_DIR, prefix: str = "session") -> str:
+    """Đường dẫn file nhật ký của một phiên: <directory>/<prefix>_<YYYYmmdd_HHMMSS>_<pid>.jsonl."""
+    return os.path.join(directory, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl")
+
+
+class EventJournal:
+    """
+    Nhật ký sự kiện chỉ ghi nối với luồng ghi nền. record() an toàn khi gọi từ nhiều luồng và không bao giờ chặn:
+    khi hàng đợi vượt max_pending (đĩa treo), sự kiện mới bị bỏ và được đếm trong dropped.
+    """
+    def __init__(self, path, fsync=FSYNC_INTERVAL, flush_interval=FLUSH_INTERVAL, fsync_interval=FSYNC_EVERY,
+                 batch_size=BATCH_SIZE, max_pending=MAX_PENDING, logger=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Chính sách fsync không hợp lệ: {fsync} ({', '.join(FSYNC_POLICIES)})")
+        self.path = path
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.logger = logger
+
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._file = None
+        self._seq = 0
+        self._last_fsync = 0.0
+        self.dropped = 0
+        self.counters = {'written': 0, 'batches': 0, 'bytes': 0, 'fsyncs': 0, 'errors': 0,
+                         'batch_max': 0, 'write_ms_max': 0.0}
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.log(message)
+
+    # --- Vòng đời ---
+    def open(self) -> bool:
+        """Mở file (tạo thư mục nếu cần) và khởi chạy luồng ghi. Trả về False (và ghi log) nếu không mở được."""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8', buffering=1 << 16)
+        except OSError as e:
+            self._log(f"Không mở được nhật ký sự kiện {self.path}: {e}")
+            return False
+        self._thread = threading.Thread(target=self._run, name="event-journal", daemon=True)
+        self._thread.start()
+        self._log(f"Nhật ký sự kiện: {self.path} (fsync: {self.fsync})")
+        return True
+
+    def close(self, timeout=5.0):
+        """Ghi nốt các sự kiện đang chờ, fsync (trừ chính sách 'never') và đóng file."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._thread is not None
+
+    # --- Phía engine ---
+    def record(self, kind: str, **fields):
+        """Ghi nhận một sự kiện (không chặn). Thời điểm lấy ngay lúc gọi, không phải lúc ghi xuống đĩa."""
+        if self._thread is None:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((time.time(), kind, fields))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    # --- Luồng ghi ---
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            stopping = self._stopping
+            self._write_batch()
+            if stopping:
+                break
+        try:
+            self._file.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._file.fileno())
+            self._file.close()
+        except OSError as e:
+            self._log(f"Lỗi khi đóng nhật ký sự kiện: {e}")
+
+    def _write_batch(self):
+        pending = self._pending
+        count = len(pending)
+        if not count:
+            return
+        lines = []
+        for _ in range(count):
+            timestamp, kind, fields = pending.popleft()
+            self._seq += 1
+            event = {'t': round(timestamp, 6), 'seq': self._seq, 'ev': kind}
+            event.update(fields)
+            lines.append(json.dumps(event, ensure_ascii=False, separators=(',', ':'), default=str))
+        data = "\n".join(lines) + "\n"
+        started = time.perf_counter()
+        try:
+            self._file.write(data)
+            self._file.flush()
+            now = time.monotonic()
+            if self.fsync == FSYNC_ALWAYS or (self.fsync == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+                self.counters['fsyncs'] += 1
+        except OSError as e:
+            self.counters['errors'] += 1
+            if self.counters['errors'] == 1:
+                self._log(f"Lỗi ghi nhật ký sự kiện {self.path}: {e}")
+            return
+        counters = self.counters
+        counters['written'] += count
+        counters['batches'] += 1
+        counters['bytes'] += len(data)
+        counters['batch_max'] = max(counters['batch_max'], count)
+        counters['write_ms_max'] = max(counters['write_ms_max'], (time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        return dict(self.counters, pending=len(self._pending), dropped=self.dropped)
+
+    def summary(self) -> str:
+        c = self.counters
+        return (f"Nhật ký: {c['written']} sự kiện, {c['batches']} lô, {c['bytes'] / 1024:.0f} KB, "
+                f"ghi lâu nhất {c['write_ms_max']:.1f}ms, chờ {len(self._pending)}, bỏ {self.dropped}")
+
+
+# --- Đọc và tóm tắt nhật ký ---
+def read_journal(path: str):
+    """Đọc lần lượt các sự kiện; bỏ qua dòng hỏng (ví dụ dòng cuối bị cắt khi chương trình bị tắt đột ngột)."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _percentile(sorted_values: list, fraction: float):
+    return sorted_values[int(fraction * (len(sorted_values) - 1))] if sorted_values else None
+
+
+def summarize_events(events) -> dict:
+    """
+    Tóm tắt một phiên: số sự kiện theo loại, số tick theo symbol, số giao cắt, kết quả và độ trễ lệnh theo action
+    (retcode, p50/p95/max latency_ms), các lần dọn dẹp cuối ngày và thống kê nhật ký khi đóng phiên.
+    """
+    kinds = Counter()
+    ticks = Counter()
+    crosses = Counter()
+    orders = {}
+    sessions = []
+    eod_runs = []
+    first = last = None
+    for event in events:
+        kind = event.get('ev')
+        timestamp = event.get('t')
+        kinds[kind] += 1
+        if timestamp is not None:
+            first = timestamp if first is None else min(first, timestamp)
+            last = timestamp if last is None else max(last, timestamp)
+        if kind == 'tick':
+            ticks[event.get('symbol')] += 1
+        elif kind == 'cross':
+            crosses[f"{event.get('symbol')} {event.get('direction')}"] += 1
+        elif kind == 'order':
+            action = orders.setdefault(event.get('action'), {'sent': 0, 'done': 0, 'failed': 0,
+                                                             'retcodes': Counter(), 'latency': []})
+            action['sent'] += 1
+            action['done' if event.get('ok') else 'failed'] += 1
+            action['retcodes'][str(event.get('retcode'))] += 1
+            if event.get('latency_ms') is not None:
+                action['latency'].append(event['latency_ms'])
+        elif kind == 'session_start':
+            sessions.append({'start': timestamp, 'pid': event.get('pid'), 'end': None, 'journal': None})
+        elif kind == 'session_end' and sessions:
+            sessions[-1].update(end=timestamp, journal=event.get('journal'))
+        elif kind == 'eod_cleanup' and event.get('stage') == 'end':
+            eod_runs.append({key: event.get(key) for key in ('t', 'closed', 'close_failed', 'cancelled', 'cancel_failed')})
+
+    order_summary = {}
+    for name, action in orders.items():
+        latency = sorted(action['latency'])
+        order_summary[name] = {
+            'sent': action['sent'], 'done': action['done'], 'failed': action['failed'],
+            'retcodes': dict(action['retcodes']),
+            'latency_ms_p50': _percentile(latency, 0.5),
+            'latency_ms_p95': _percentile(latency, 0.95),
+            'latency_ms_max': latency[-1] if latency else None,
+        }
+    return {
+        'events': sum(kinds.values()),
+        'start': first,
+        'end': last,
+        'duration': round(last - first, 3) if first is not None else 0.0,
+        'kinds': dict(kinds),
+        'ticks': dict(ticks),
+        'crosses': dict(crosses),
+        'orders': order_summary,
+        'eod_cleanups': eod_runs,
+        'sessions': sessions,
+    }
+
+
+def format_summary(path: str, summary: dict) -> str:
+    def stamp(value):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value)) if value is not None else "-"
+
+    lines = [f"{path}: {summary['events']} sự kiện, {stamp(summary['start'])} -> {stamp(summary['end'])} "
+             f"({summary['duration']:.0f} giây, {len(summary['sessions'])} phiên)"]
+    lines.append("  Loại: " + ", ".join(f"{kind} {count}" for kind, count in sorted(summary['kinds'].items())))
+    if summary['ticks']:
+        lines.append("  Tick: " + ", ".join(f"{symbol} {count}" for symbol, count in
+                                            sorted(summary['ticks'].items(), key=lambda item: -item[1])))
+    if summary['crosses']:
+        lines.append("  Giao cắt: " + ", ".join(f"{key} {count}" for key, count in sorted(summary['crosses'].items())))
+    for action, stats in sorted(summary['orders'].items()):
+        latency = (f"latency p50/p95/max {stats['latency_ms_p50']:.1f}/{stats['latency_ms_p95']:.1f}/"
+                   f"{stats['latency_ms_max']:.1f}ms" if stats['latency_ms_max'] is not None else "latency -")
+        lines.append(f"  Lệnh {action}: gửi {stats['sent']}, thành công {stats['done']}, lỗi {stats['failed']}, "
+                     f"{latency}, retcode {stats['retcodes']}")
+    for run in summary['eod_cleanups']:
+        lines.append(f"  Dọn dẹp cuối ngày {stamp(run['t'])}: đóng {run['closed']} (lỗi {run['close_failed']}), "
+                     f"hủy {run['cancelled']} (lỗi {run['cancel_failed']})")
+    for session in summary['sessions']:
+        journal = session['journal'] or {}
+        lines.append(f"  Phiên PID {session['pid']}: {stamp(session['start'])} -> {stamp(session['end'])}"
+                     + (f", bỏ {journal.get('dropped', 0)} sự kiện, ghi lâu nhất {journal.get('write_ms_max', 0):.1f}ms"
+                        if journal else " (không đóng bình thường)"))
+    return "\n".join(lines)
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Tóm tắt hoặc lọc nhật ký sự kiện của engine."""
+    parser = argparse.ArgumentParser(description="Đọc nhật ký sự kiện (JSON Lines) của Breakeven Protector")
+    parser.add_argument('files', nargs='+', help="Các file nhật ký (.jsonl)")
+    parser.add_argument('--events', help="In các sự kiện thuộc các loại này (cách nhau bởi dấu phẩy) thay cho tóm tắt")
+    parser.add_argument('--symbol', help="Chỉ in sự kiện của symbol này (dùng cùng --events)")
+    parser.add_argument('--json', action='store_true', help="In tóm tắt dạng JSON")
+    args = parser.parse_args(argv)
+
+    kinds = {kind.strip() for kind in args.events.split(',') if kind.strip()} if args.events else None
+    for path in args.files:
+        try:
+            if kinds is not None:
+                for event in read_journal(path):
+                    if event.get('ev') in kinds and (not args.symbol or event.get('symbol') == args.symbol):
+                        print(json.dumps(event, ensure_ascii=False))
+                continue
+            summary = summarize_events(read_journal(path))
+        except OSError as e:
+            print(f"Không đọc được {path}: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(dict(summary, file=path), ensure_ascii=False) if args.json else format_summary(path, summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import sys
+import csv
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from bar_resample import can_derive, resample_bars, TIMEFRAME_SECONDS
+from bar_store import BarStore
+from scanner_core import (
+    connect_scanner, solve_level_arrays, ModelSpec, AVERAGE_COUNTS, DEFAULT_MODEL, PREDICTION_MODES, TIMEFRAME_NAMES,
+)
+
+
+# Nhóm khoảng cách (pip) từ giá mở nến được dự đoán tới nghiệm, dùng để so sánh tỉ lệ chạm công bằng hơn
+DISTANCE_BUCKETS = ((0, 10), (10, 50), (50, 200), (200, float('inf')))
+STAT_FIELDS = ('symbol', 'timeframe', 'mode', 'bars', 'levels', 'hit_next_bar', 'hit_within_horizon',
+               'mean_bars_to_hit', 'median_bars_to_hit', 'median_distance_pips') + tuple(
+               f"hit_next_bar_{low:g}_{high:g}pip" for low, high in DISTANCE_BUCKETS)
+
+
+# --- Tính nghiệm cho mọi nến lịch sử ---
+class BarFeatures:
+    """
+    Đại lượng trung gian tính trên toàn bộ lịch sử bars, tính một lần và dùng lại giữa các chế độ/mô hình
+    (ví dụ khi quét nhiều ModelSpec trên cùng một symbol/khung thời gian):
+    - mean(field, k): giá trung bình dùng để dự đoán từng nến: giá trị ở vị trí t là trung bình của k nến ngay
+      trước nến t (bars[t-k:t]), giống get_average_prices khi nến t đang chạy. NaN khi chưa đủ nến.
+    - forward_ranges(horizon): biên độ tích lũy (thấp nhất, cao nhất) từ nến t tới nến t+k, k = 0..horizon-1.
+    """
+    def __init__(self, bars: np.ndarray):
+        self.bars = bars
+        self._cumulative = {}  # Key: trường giá, Value: tổng tích lũy (bắt đầu bằng 0)
+        self._means = {}       # Key: (trường giá, số nến), Value: mảng giá trung bình đã làm tròn
+        self._ranges = {}      # Key: horizon, Value: danh sách (running_low, running_high)
+
+    def mean(self, field: str, bar_count: int) -> np.ndarray:
+        key = (field, bar_count)
+        if key not in self._means:
+            cumulative = self._cumulative.get(field)
+            if cumulative is None:
+                cumulative = np.concatenate(([0.0], np.cumsum(np.asarray(self.bars[field], dtype=np.float64))))
+                self._cumulative[field] = cumulative
+            n = len(self.bars)
+            values = np.full(n, np.nan)
+            values[bar_count:] = (cumulative[bar_count:n] - cumulative[:n - bar_count]) / bar_count
+            # Làm tròn giống get_average_prices trước khi giải
+            self._means[key] = np.round(values, 8)
+        return self._means[key]
+
+    def forward_ranges(self, horizon: int) -> list:
+        if horizon not in self._ranges:
+            n = len(self.bars)
+            high = np.asarray(self.bars['high'], dtype=np.float64)
+            low = np.asarray(self.bars['low'], dtype=np.float64)
+            running_high = np.full(n, -np.inf)
+            running_low = np.full(n, np.inf)
+            ranges = []
+            for k in range(horizon):
+                # Nến t+k của mỗi vị trí t; vị trí vượt quá dữ liệu không được tính
+                available = n - k
+                running_high[:available] = np.maximum(running_high[:available], high[k:])
+                running_low[:available] = np.minimum(running_low[:available], low[k:])
+                running_high[available:] = np.nan
+                running_low[available:] = np.nan
+                ranges.append((running_low.copy(), running_high.copy()))
+            self._ranges[horizon] = ranges
+        return self._ranges[horizon]
+
+
+def rolling_averages(bars: np.ndarray, counts: dict = AVERAGE_COUNTS, features: BarFeatures = None) -> dict:
+    """Giá trung bình dùng để dự đoán từng nến cho mọi khóa của counts (xem BarFeatures.mean)."""
+    features = features if features is not None else BarFeatures(bars)
+    return {key: features.mean(key.rsplit('_', 1)[0], count) for key, count in counts.items()}
+
+
+def historical_levels(bars: np.ndarray, digits: int, modes=PREDICTION_MODES, model: ModelSpec = DEFAULT_MODEL,
+                      features: BarFeatures = None) -> dict:
+    """Nghiệm (đã làm tròn theo digits) dự đoán cho từng nến, mọi chế độ: {chế độ: mảng (n, 2), NaN nếu không có}."""
+    features = features if features is not None else BarFeatures(bars)
+    levels = {}
+    for mode in modes:
+        points = np.column_stack([features.mean(field, bar_count) for field, bar_count in model.points[mode]])
+        x1, x2 = solve_level_arrays(points, model.abscissae(mode))
+        pair = np.round(np.column_stack((x1, x2)), digits)
+        pair.sort(axis=1) # NaN được xếp cuối
+        pair[pair[:, 1] == pair[:, 0], 1] = np.nan # Hai nghiệm trùng nhau sau khi làm tròn chỉ tính một lần
+        levels[mode] = pair
+    return levels
+
+
+def bars_to_hit(bars: np.ndarray, levels: np.ndarray, horizon: int, features: BarFeatures = None) -> np.ndarray:
+    """
+    Số nến (0 = chính nến được dự đoán) cho tới khi giá chạm nghiệm, tính trên biên độ tích lũy
+    (thấp nhất/cao nhất từ nến t tới nến t+k), -1 nếu không chạm trong horizon nến hoặc không đủ dữ liệu.
+    levels: mảng (n, m) nghiệm của từng nến. Trả về mảng (n, m) số nguyên.
+    """
+    features = features if features is not None else BarFeatures(bars)
+    result = np.full(levels.shape, -1, dtype=np.int64)
+    for k, (running_low, running_high) in enumerate(features.forward_ranges(horizon)):
+        touched = (running_low[:, None] <= levels) & (levels <= running_high[:, None]) & (result < 0)
+        result[touched] = k
+    return result
+
+
+def study_bars(bars: np.ndarray, digits: int, pip_size: float, horizon: int = 5, modes=PREDICTION_MODES,
+               model: ModelSpec = DEFAULT_MODEL, features: BarFeatures = None) -> dict:
+    """
+    Tỉ lệ giá chạm nghiệm của từng chế độ trên toàn bộ lịch sử bars (BAR_DTYPE, tăng dần theo thời gian).
+    Chỉ tính các nến có đủ nến trước đó và đủ horizon nến phía sau. Số nến tới khi chạm tính từ 1
+    (1 = chạm ngay trong nến được dự đoán). features: dùng lại đại lượng trung gian giữa nhiều mô hình.
+    Trả về {chế độ: thống kê}.
+    """
+    features = features if features is not None else BarFeatures(bars)
+    warmup = model.max_lookback
+    usable = np.zeros(len(bars), dtype=bool)
+    usable[warmup:len(bars) - horizon + 1] = True
+    opens = np.asarray(bars['open'], dtype=np.float64)
+
+    stats = {}
+    for mode, levels in historical_levels(bars, digits, modes, model, features).items():
+        offsets = bars_to_hit(bars, levels, horizon, features)
+        valid = usable[:, None] & np.isfinite(levels)
+        offsets = offsets[valid]
+        distances = (np.abs(levels - opens[:, None]) / pip_size)[valid]
+        hit = offsets >= 0
+        row = {
+            'bars': int(usable.sum()),
+            'levels': int(valid.sum()),
+            'hit_next_bar': _rate(offsets == 0),
+            'hit_within_horizon': _rate(hit),
+            'mean_bars_to_hit': round(float(offsets[hit].mean()) + 1, 3) if hit.any() else None,
+            'median_bars_to_hit': float(np.median(offsets[hit])) + 1 if hit.any() else None,
+            'median_distance_pips': round(float(np.median(distances)), 1) if len(distances) else None,
+        }
+        for low, high in DISTANCE_BUCKETS:
+            bucket = (distances >= low) & (distances < high)
+            row[f"hit_next_bar_{low:g}_{high:g}pip"] = _rate(offsets[bucket] == 0)
+        stats[mode] = row
+    return stats
+
+
+def infer_digits(bars: np.ndarray, max_digits: int = 8) -> int:
+    """Số chữ số thập phân của giá, suy ra từ dữ liệu nến (số nhỏ nhất làm tròn mà không đổi giá)."""
+    prices = np.asarray(bars['close'][-1000:], dtype=np.float64)
+    for digits in range(max_digits + 1):
+        if np.allclose(np.round(prices, digits), prices, rtol=0, atol=10.0 ** -(max_digits + 2)):
+            return digits
+    return max_digits
+
+
+def _rate(flags: np.ndarray):
+    return round(float(flags.mean()), 4) if len(flags) else None
+
+
+# --- Dữ liệu nến ---
+def load_study_bars(store: BarStore, symbol: str, tf_str: str) -> np.ndarray:
+    """
+    Nến đã lưu của symbol/khung thời gian trong kho nến; nếu chưa có thì dựng từ khung nhỏ hơn đã lưu
+    (khung lớn nhất dựng được, ví dụ W1/MN1 từ D1). Trả về mảng rỗng nếu không có dữ liệu.
+    """
+    bars = store.read(symbol, tf_str)
+    if len(bars):
+        return bars
+    finer = sorted((tf for tf in TIMEFRAME_NAMES if can_derive(tf, tf_str)),
+                   key=lambda tf: TIMEFRAME_SECONDS[tf], reverse=True)
+    for base_tf in finer:
+        base_bars = store.read(symbol, base_tf)
+        if len(base_bars):
+            # Nến cuối cùng dựng được có thể chưa đủ nến gốc (nến đang chạy lúc lưu): bỏ đi
+            return resample_bars(base_bars, tf_str)[:-1]
+    return bars
+
+
+def fetch_history(connection: dict, symbols, timeframes, bar_count: int):
+    """Tải (hoặc bổ sung) tối thiểu bar_count nến đã đóng của mỗi symbol/khung thời gian vào kho nến từ MT5."""
+    scanner = connect_scanner(**connection)
+    terminal = scanner.terminal
+    try:
+        for symbol in symbols:
+            terminal.symbol_select(symbol, True)
+            for tf_str in timeframes:
+                rates = terminal.copy_rates_from_pos(symbol, scanner.timeframe(tf_str), 0, 2)
+                if rates is None or len(rates) < 2:
+                    print(f"{symbol} {tf_str}: không lấy được nến từ MT5", file=sys.stderr)
+                    continue
+                try:
+                    scanner.bar_store.sync(symbol, tf_str, scanner.timeframe(tf_str), int(rates[0]['time']), bar_count)
+                except RuntimeError as e: # Lịch sử ngắn hơn bar_count: vẫn dùng phần đã có
+                    print(f"{symbol} {tf_str}: {e}", file=sys.stderr)
+    finally:
+        terminal.shutdown()
+    return scanner.bar_store.root_dir
+
+
+def _study_task(store_dir: str, symbol: str, tf_str: str, digits, horizon: int, model: dict = None) -> list:
+    """
+    Một cặp symbol/khung thời gian; chạy được trong tiến trình con (kho nến mở ở chế độ chỉ đọc).
+    digits None: suy ra từ dữ liệu; giá trị 1 pip là point * 10 giống scanner.
+    model: mô hình dạng dict (ModelSpec.to_dict), None: mô hình gốc.
+    """
+    model = ModelSpec.from_dict(model) if model else DEFAULT_MODEL
+    bars = load_study_bars(BarStore(store_dir), symbol, tf_str)
+    if len(bars) <= model.max_lookback + horizon:
+        return []
+    digits = infer_digits(bars) if digits is None else digits
+    pip_size = 10.0 ** -digits * 10
+    return [dict({'symbol': symbol, 'timeframe': tf_str, 'mode': mode}, **row)
+            for mode, row in study_bars(bars, digits, pip_size, horizon, model=model).items()]
+
+
+def run_study(store_dir: str, symbols, timeframes, digits=None, horizon: int = 5, workers: int = 1,
+              model: ModelSpec = None) -> list:
+    """Chạy nghiên cứu cho mọi symbol x khung thời gian; workers > 1 dùng process pool (spawn)."""
+    model = model.to_dict() if model is not None else None
+    tasks = [(store_dir, symbol, tf_str, digits, horizon, model) for symbol in symbols for tf_str in timeframes]
+    if workers <= 1:
+        return [row for task in tasks for row in _study_task(*task)]
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for future in as_completed([pool.submit(_study_task, *task) for task in tasks]):
+            rows.extend(future.result())
+    order = {(symbol, tf_str): i for i, (_, symbol, tf_str, *_) in enumerate(tasks)}
+    rows.sort(key=lambda row: (order[(row['symbol'], row['timeframe'])], PREDICTION_MODES.index(row['mode'])))
+    return rows
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Đo tỉ lệ và thời gian giá chạm các nghiệm của find_x trên dữ liệu nến lịch sử trong kho nến."""
+    parser = argparse.ArgumentParser(description="Nghiên cứu tỉ lệ chạm nghiệm của find_x trên nến lịch sử")
+    parser.add_argument('symbols', nargs='+', help="Các symbol (tên chính xác trên server)")
+    parser.add_argument('--store-dir', required=True, help="Thư mục kho nến của server (ví dụ bar_store/<server>)")
+    parser.add_argument('--timeframes', default='D1,W1,MN1', help="Các khung thời gian, cách nhau bởi dấu phẩy")
+    parser.add_argument('--horizon', type=int, default=5, help="Số nến tối đa chờ giá chạm nghiệm")
+    parser.add_argument('--digits', type=int, help="Số chữ số thập phân của giá (mặc định: suy ra từ dữ liệu)")
+    parser.add_argument('--workers', type=int, default=1, help="Số tiến trình song song")
+    parser.add_argument('--model', help="File JSON mô hình tính nghiệm (mặc định: mô hình gốc)")
+    parser.add_argument('--out', help="File CSV kết quả")
+    parser.add_argument('--fetch-bars', type=int, default=0,
+                        help="Tải trước tối thiểu N nến đã đóng từ MT5 vào kho nến (tài khoản đang mở trên terminal)")
+    args = parser.parse_args(argv)
+
+    timeframes = [tf.strip().upper() for tf in args.timeframes.split(',') if tf.strip()]
+    if any(tf not in TIMEFRAME_NAMES for tf in timeframes):
+        parser.error(f"Khung thời gian không hợp lệ: {args.timeframes}")
+
+    try:
+        model = ModelSpec.from_file(args.model) if args.model else None
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"Không đọc được mô hình {args.model}: {e}")
+
+    store_dir = args.store_dir
+    if args.fetch_bars > 0:
+        # Kho nến của server được tạo trong thư mục con theo tên server, giống scanner
+        store_dir = fetch_history({'store_dir': store_dir}, args.symbols, timeframes, args.fetch_bars)
+
+    started = time.perf_counter()
+    rows = run_study(store_dir, args.symbols, timeframes, args.digits, args.horizon, args.workers, model)
+    elapsed = time.perf_counter() - started
+
+    if args.out:
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=STAT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    for row in rows:
+        print(f"{row['symbol']:<10} {row['timeframe']:<4} {row['mode']:<8} nến={row['bars']:<7} nghiệm={row['levels']:<7} "
+              f"chạm nến kế={row['hit_next_bar']} chạm trong {args.horizon} nến={row['hit_within_horizon']} "
+              f"TB {row['mean_bars_to_hit']} nến")
+    print(f"Hoàn thành {len(rows)} dòng trong {elapsed:.2f} giây", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import sys
+import csv
+import json
+import argparse
+from collections import namedtuple, deque
+
+from event_journal import read_journal
+
+
+# --- Vết độ trễ từ tick tới lệnh (tick-to-action) ---
+# Mỗi lệnh dời SL breakeven hoặc đặt lệnh chờ của trigger mang một vết (ActionTrace): thời điểm tick trên server
+# (time_msc), lúc engine đọc tick, lúc ra quyết định, lúc bắt đầu/kết thúc order_send và retcode. Các mốc trong
+# engine đo bằng time.perf_counter (chính xác, cùng đồng hồ); riêng tuổi tick so với đồng hồ máy (time.time) lúc đọc.
+#
+# Các đoạn (ms) tính từ một vết:
+#   tick_age_ms      tick trên server -> engine đọc tick (đã trừ chênh múi giờ của server, xem tick_age_ms())
+#   decision_ms      đọc tick -> ra quyết định (tính P/L, breakeven, giao cắt điểm P)
+#   dispatch_ms      ra quyết định -> bắt đầu order_send (dựng request, các lệnh gửi trước trong cùng vòng)
+#   send_ms          thời gian order_send (tới khi terminal trả kết quả)
+#   tick_to_send_ms  tick trên server -> bắt đầu order_send: độ cũ của giá khi bot hành động
+#   tick_to_done_ms  tick trên server -> order_send trả kết quả
+
+ActionTrace = namedtuple('ActionTrace', ['action', 'symbol', 'tick_time_msc', 'read_wall', 'read_at', 'decided_at',
+                                         'send_start', 'send_end', 'retcode'])
+SEGMENTS = ('tick_age_ms', 'decision_ms', 'dispatch_ms', 'send_ms', 'tick_to_send_ms', 'tick_to_done_ms')
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+TRACE_WINDOW = 1000              # Số vết gần nhất mỗi loại lệnh dùng để tính percentile trên GUI/API
+SERVER_OFFSET_STEP_MS = 900000   # Chênh múi giờ của server MT5 là bội số của 15 phút
+CSV_FIELDS = ('t', 'action', 'symbol', 'poll_interval_ms', 'retcode', 'tick_time_msc') + SEGMENTS
+
+
+def tick_age_ms(tick_time_msc, read_wall):
+    """
+    Tuổi của tick (ms) lúc engine đọc. time_msc của MT5 theo giờ server (thường lệch UTC vài giờ), nên chênh lệch
+    được làm tròn tới bội số 15 phút gần nhất và trừ đi; đúng khi tick không cũ quá 7,5 phút. None nếu không có time_msc.
+    """
+    if not tick_time_msc:
+        return None
+    difference = read_wall * 1000 - tick_time_msc
+    return difference - round(difference / SERVER_OFFSET_STEP_MS) * SERVER_OFFSET_STEP_MS
+
+
+def trace_segments(trace: ActionTrace) -> dict:
+    """Các đoạn độ trễ (ms, làm tròn 3 chữ số) của một vết; đoạn tính từ tick là None nếu tick không có time_msc."""
+    tick_age = tick_age_ms(trace.tick_time_msc, trace.read_wall)
+    segments = {
+        'tick_age_ms': tick_age,
+        'decision_ms': (trace.decided_at - trace.read_at) * 1000,
+        'dispatch_ms': (trace.send_start - trace.decided_at) * 1000,
+        'send_ms': (trace.send_end - trace.send_start) * 1000,
+        'tick_to_send_ms': tick_age + (trace.send_start - trace.read_at) * 1000 if tick_age is not None else None,
+        'tick_to_done_ms': tick_age + (trace.send_end - trace.read_at) * 1000 if tick_age is not None else None,
+    }
+    return {key: round(value, 3) if value is not None else None for key, value in segments.items()}
+
+
+def _percentile(sorted_values: list, fraction: float):
+    return sorted_values[int(fraction * (len(sorted_values) - 1))] if sorted_values else None
+
+
+def summarize_segments(rows) -> dict:
+    """p50/p95/p99 của từng đoạn cho một nhóm vết (các dict có khóa SEGMENTS), kèm số vết."""
+    rows = list(rows)
+    summary = {'count': len(rows)}
+    for segment in SEGMENTS:
+        values = sorted(row[segment] for row in rows if row.get(segment) is not None)
+        summary[segment] = {name: _percentile(values, fraction) for name, fraction in PERCENTILES}
+    return summary
+
+
+def format_segment(stats: dict, segment: str = 'tick_to_send_ms') -> str:
+    values = stats[segment]
+    if values['p50'] is None:
+        return "-"
+    return "/".join(f"{values[name]:.1f}" for name, _ in PERCENTILES) + "ms"
+
+
+# --- Thống kê trực tiếp trong engine ---
+class LatencyTracer:
+    """
+    Giữ các đoạn độ trễ của window vết gần nhất cho mỗi loại lệnh (chỉ luồng gateway ghi). summary() được
+    lưu đệm tới khi có vết mới, nên tác vụ GUI/API gọi mỗi chu kỳ không phải sắp xếp lại.
+    """
+    def __init__(self, window=TRACE_WINDOW):
+        self.window = window
+        self._segments = {}   # Key: action, Value: deque các dict đoạn độ trễ
+        self.total = 0
+        self._summary = None
+
+    def add(self, trace: ActionTrace) -> dict:
+        """Thêm một vết; trả về các đoạn độ trễ của nó (để ghi nhật ký)."""
+        segments = trace_segments(trace)
+        self._segments.setdefault(trace.action, deque(maxlen=self.window)).append(segments)
+        self.total += 1
+        self._summary = None
+        return segments
+
+    def reset(self):
+        """Bỏ các vết đã có (ví dụ khi đổi chu kỳ lấy tick, để percentile chỉ phản ánh chu kỳ mới)."""
+        self._segments = {}
+        self._summary = None
+
+    def summary(self) -> dict:
+        """p50/p95/p99 từng đoạn theo loại lệnh: {action: {'count': n, segment: {'p50', 'p95', 'p99'}}}."""
+        if self._summary is None:
+            self._summary = {action: summarize_segments(rows) for action, rows in self._segments.items()}
+        return self._summary
+
+    def summary_line(self) -> str:
+        """Một dòng cho GUI: tick->gửi lệnh và thời gian order_send (p50/p95/p99) theo loại lệnh."""
+        summary = self.summary()
+        if not summary:
+            return "Độ trễ tick->lệnh: chưa có lệnh"
+        return "Độ trễ tick->lệnh (p50/p95/p99): " + " | ".join(
+            f"{action} {format_segment(stats)} (gửi {format_segment(stats, 'send_ms')}, n={stats['count']})"
+            for action, stats in sorted(summary.items()))
+
+
+# --- Đọc vết từ nhật ký sự kiện ---
+def journal_traces(events) -> list:
+    """Các dòng vết (CSV_FIELDS) từ sự kiện 'order' có mang vết (trường tick_to_send_ms) trong nhật ký."""
+    rows = []
+    for event in events:
+        if event.get('ev') == 'order' and 'tick_to_send_ms' in event:
+            rows.append({field: event.get(field) for field in CSV_FIELDS})
+    return rows
+
+
+def group_traces(rows: list) -> dict:
+    """Tóm tắt theo (loại lệnh, chu kỳ lấy tick) để so sánh hiệu quả của việc đổi chu kỳ."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['action'], row['poll_interval_ms']), []).append(row)
+    return {key: summarize_segments(group) for key, group in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1] or 0))}
+
+
+def format_groups(groups: dict) -> str:
+    lines = []
+    for (action, interval), stats in groups.items():
+        lines.append(f"{action} @ chu kỳ {interval if interval is not None else '?'}ms (n={stats['count']}): "
+                     + ", ".join(f"{segment} {format_segment(stats, segment)}" for segment in SEGMENTS))
+    return "\n".join(lines) if lines else "Không có vết độ trễ nào"
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Tóm tắt (p50/p95/p99) và xuất vết độ trễ tick->lệnh từ các file nhật ký sự kiện."""
+    parser = argparse.ArgumentParser(description="Độ trễ tick->lệnh theo loại lệnh và chu kỳ lấy tick, từ nhật ký sự kiện")
+    parser.add_argument('files', nargs='+', help="Các file nhật ký (.jsonl)")
+    parser.add_argument('--action', help="Chỉ lấy loại lệnh này (ví dụ breakeven, trigger_buy_stop)")
+    parser.add_argument('--csv', help="Xuất từng vết ra file CSV")
+    parser.add_argument('--json', action='store_true', help="In tóm tắt dạng JSON")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for path in args.files:
+        try:
+            rows.extend(journal_traces(read_journal(path)))
+        except OSError as e:
+            print(f"Không đọc được {path}: {e}", file=sys.stderr)
+            return 1
+    if args.action:
+        rows = [row for row in rows if row['action'] == args.action]
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    groups = group_traces(rows)
+    if args.json:
+        print(json.dumps([dict(stats, action=action, poll_interval_ms=interval)
+                          for (action, interval), stats in groups.items()], ensure_ascii=False))
+    else:
+        print(format_groups(groups))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
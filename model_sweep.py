@@ -0,0 +1,227 @@
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bar_store import BarStore
+from hit_rate_study import (
+    infer_digits, load_study_bars, study_bars, BarFeatures, STAT_FIELDS,
+)
+from scanner_core import ModelSpec, DEFAULT_MODEL, PREDICTION_MODES, TIMEFRAME_NAMES
+
+
+# Cột của bảng xếp hạng mô hình; tỉ lệ chạm là trung bình có trọng số theo số nghiệm trên mọi symbol/khung thời gian
+RANK_FIELDS = ('rank', 'model', 'levels', 'hit_next_bar', 'hit_within_horizon', 'mean_bars_to_hit') + tuple(
+               f"hit_next_bar_{mode}" for mode in PREDICTION_MODES) + ('spec',)
+RANK_METRICS = ('hit_next_bar', 'hit_within_horizon')
+
+
+# --- Tạo danh sách mô hình ---
+def parse_lookbacks(value: str) -> list:
+    """Số nến ứng viên của một điểm: "2,3,5" hoặc khoảng "2-6" (có thể kết hợp, ví dụ "1,3-5")."""
+    lookbacks = []
+    for part in value.replace(' ', '').split(','):
+        if '-' in part:
+            low, high = (int(bound) for bound in part.split('-', 1))
+            lookbacks.extend(range(low, high + 1))
+        elif part:
+            lookbacks.append(int(part))
+    return sorted(set(lookbacks))
+
+
+def expand_lookback_grid(candidates, base: ModelSpec = DEFAULT_MODEL) -> list:
+    """
+    Mọi mô hình có cùng trường giá của các điểm với base nhưng thay số nến: candidates là 4 danh sách số nến ứng viên
+    cho A, B, C và D/E (D và E luôn cùng số nến). Chỉ giữ các tổ hợp giảm dần A > B > C > D giống mô hình gốc
+    (5, 3, 2, 1), để các điểm không trùng hoành độ. Mô hình base luôn đứng đầu danh sách (làm mốc so sánh).
+    """
+    specs = [base]
+    seen = {base}
+    for a, b, c, d in itertools.product(*candidates):
+        if not a > b > c > d:
+            continue
+        lookbacks = (a, b, c, d, d)
+        points = {mode: [(field, lookback) for (field, _), lookback in zip(base.points[mode], lookbacks)]
+                  for mode in PREDICTION_MODES}
+        spec = ModelSpec(points, name=f"{a}-{b}-{c}-{d}")
+        if spec not in seen:
+            seen.add(spec)
+            specs.append(spec)
+    return specs
+
+
+def load_specs(path: str) -> list:
+    """Đọc danh sách mô hình từ file JSON: một mô hình (định dạng ModelSpec.to_dict) hoặc danh sách mô hình."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return [ModelSpec.from_dict(item) for item in (data if isinstance(data, list) else [data])]
+
+
+# --- Chạy thử mô hình trên lịch sử ---
+def _sweep_task(store_dir: str, symbol: str, tf_str: str, specs: list, digits, horizon: int) -> list:
+    """
+    Một cặp symbol/khung thời gian với một nhóm mô hình (dạng dict); chạy được trong tiến trình con.
+    Nến chỉ đọc một lần và các giá trung bình trượt/biên độ tích lũy (BarFeatures) dùng chung cho mọi mô hình
+    trong nhóm, nên mỗi mô hình thêm vào chỉ tốn phần giải phương trình và thống kê.
+    """
+    bars = load_study_bars(BarStore(store_dir), symbol, tf_str)
+    if not len(bars):
+        return []
+    digits = infer_digits(bars) if digits is None else digits
+    pip_size = 10.0 ** -digits * 10
+    features = BarFeatures(bars)
+    rows = []
+    for spec in (ModelSpec.from_dict(item) for item in specs):
+        if len(bars) <= spec.max_lookback + horizon:
+            continue
+        for mode, row in study_bars(bars, digits, pip_size, horizon, model=spec, features=features).items():
+            rows.append(dict({'model': spec.name, 'symbol': symbol, 'timeframe': tf_str, 'mode': mode}, **row))
+    return rows
+
+
+def run_sweep(store_dir: str, symbols, timeframes, specs: list, digits=None, horizon: int = 5, workers: int = 1,
+              progress=None) -> list:
+    """
+    Chạy mọi mô hình trên mọi symbol x khung thời gian. workers > 1: process pool (spawn); mỗi cặp
+    symbol/khung thời gian được chia thành vài nhóm mô hình để đủ việc cho các tiến trình khi có ít cặp.
+    Trả về các dòng thống kê (STAT_FIELDS kèm cột model).
+    """
+    pairs = [(symbol, tf_str) for symbol in symbols for tf_str in timeframes]
+    spec_dicts = [spec.to_dict() for spec in specs]
+    chunks_per_pair = 1 if workers <= 1 else max(1, min(len(specs), -(-2 * workers // max(1, len(pairs)))))
+    chunk_size = -(-len(spec_dicts) // chunks_per_pair)
+    chunks = [spec_dicts[i:i + chunk_size] for i in range(0, len(spec_dicts), chunk_size)]
+    tasks = [(store_dir, symbol, tf_str, chunk, digits, horizon) for symbol, tf_str in pairs for chunk in chunks]
+
+    rows = []
+    if workers <= 1:
+        for done, task in enumerate(tasks, 1):
+            rows.extend(_sweep_task(*task))
+            if progress:
+                progress(done, len(tasks))
+        return rows
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(_sweep_task, *task) for task in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            rows.extend(future.result())
+            if progress:
+                progress(done, len(tasks))
+    return rows
+
+
+def rank_models(rows: list, specs: list, metric: str = 'hit_next_bar') -> list:
+    """
+    Tổng hợp kết quả theo mô hình: tỉ lệ chạm có trọng số theo số nghiệm của từng dòng (symbol/khung/chế độ),
+    xếp giảm dần theo metric. Mô hình không có nghiệm nào bị bỏ qua.
+    """
+    totals = {}
+    for row in rows:
+        levels = row['levels']
+        if not levels:
+            continue
+        total = totals.setdefault(row['model'], {'levels': 0, 'hit_next_bar': 0.0, 'hit_within_horizon': 0.0,
+                                                 'bars_to_hit': 0.0, 'hits': 0.0, 'modes': {}})
+        total['levels'] += levels
+        total['hit_next_bar'] += row['hit_next_bar'] * levels
+        total['hit_within_horizon'] += row['hit_within_horizon'] * levels
+        if row['mean_bars_to_hit'] is not None:
+            hits = row['hit_within_horizon'] * levels
+            total['bars_to_hit'] += row['mean_bars_to_hit'] * hits
+            total['hits'] += hits
+        mode_total = total['modes'].setdefault(row['mode'], [0, 0.0])
+        mode_total[0] += levels
+        mode_total[1] += row['hit_next_bar'] * levels
+
+    by_name = {spec.name: spec for spec in specs}
+    ranking = []
+    for name, total in totals.items():
+        levels = total['levels']
+        entry = {
+            'model': name,
+            'levels': levels,
+            'hit_next_bar': round(total['hit_next_bar'] / levels, 4),
+            'hit_within_horizon': round(total['hit_within_horizon'] / levels, 4),
+            'mean_bars_to_hit': round(total['bars_to_hit'] / total['hits'], 3) if total['hits'] else None,
+            'spec': by_name[name].describe() if name in by_name else None,
+        }
+        for mode in PREDICTION_MODES:
+            mode_levels, mode_hits = total['modes'].get(mode, (0, 0.0))
+            entry[f"hit_next_bar_{mode}"] = round(mode_hits / mode_levels, 4) if mode_levels else None
+        ranking.append(entry)
+    ranking.sort(key=lambda entry: entry[metric], reverse=True)
+    for rank, entry in enumerate(ranking, 1):
+        entry['rank'] = rank
+    return ranking
+
+
+def write_csv(path: str, fieldnames, rows: list):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Thử nhiều mô hình tính nghiệm trên nến lịch sử trong kho nến và xếp hạng theo tỉ lệ chạm nghiệm."""
+    parser = argparse.ArgumentParser(description="Quét nhiều mô hình tính nghiệm, xếp hạng theo tỉ lệ chạm lịch sử")
+    parser.add_argument('symbols', nargs='+', help="Các symbol (tên chính xác trên server)")
+    parser.add_argument('--store-dir', required=True, help="Thư mục kho nến của server (ví dụ bar_store/<server>)")
+    parser.add_argument('--timeframes', default='D1,W1,MN1', help="Các khung thời gian, cách nhau bởi dấu phẩy")
+    parser.add_argument('--specs', help="File JSON danh sách mô hình (thay cho lưới số nến)")
+    parser.add_argument('--lookbacks', nargs=4, metavar=('A', 'B', 'C', 'DE'), default=('4-8', '2-5', '2-3', '1-2'),
+                        help="Số nến ứng viên của các điểm A, B, C và D/E, ví dụ 4-8 2-5 2,3 1")
+    parser.add_argument('--horizon', type=int, default=5, help="Số nến tối đa chờ giá chạm nghiệm")
+    parser.add_argument('--digits', type=int, help="Số chữ số thập phân của giá (mặc định: suy ra từ dữ liệu)")
+    parser.add_argument('--metric', choices=RANK_METRICS, default='hit_next_bar', help="Chỉ số dùng để xếp hạng")
+    parser.add_argument('--workers', type=int, default=1, help="Số tiến trình song song")
+    parser.add_argument('--top', type=int, default=10, help="Số mô hình in ra (mặc định 10)")
+    parser.add_argument('--out', help="File CSV bảng xếp hạng mô hình")
+    parser.add_argument('--details', help="File CSV thống kê chi tiết theo mô hình/symbol/khung thời gian/chế độ")
+    parser.add_argument('--save-best', help="Ghi mô hình đứng đầu ra file JSON (dùng cho scan_cli --model/model_spec.json)")
+    args = parser.parse_args(argv)
+
+    timeframes = [tf.strip().upper() for tf in args.timeframes.split(',') if tf.strip()]
+    if any(tf not in TIMEFRAME_NAMES for tf in timeframes):
+        parser.error(f"Khung thời gian không hợp lệ: {args.timeframes}")
+    try:
+        specs = load_specs(args.specs) if args.specs else expand_lookback_grid(
+            [parse_lookbacks(value) for value in args.lookbacks])
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"Không tạo được danh sách mô hình: {e}")
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        parser.error("Tên mô hình bị trùng")
+
+    def progress(done, total):
+        if done == total or done % max(1, total // 10) == 0:
+            print(f"Đã chạy {done}/{total} nhóm", file=sys.stderr)
+
+    started = time.perf_counter()
+    rows = run_sweep(args.store_dir, args.symbols, timeframes, specs, args.digits, args.horizon, args.workers, progress)
+    ranking = rank_models(rows, specs, args.metric)
+    elapsed = time.perf_counter() - started
+
+    if args.details:
+        write_csv(args.details, ('model',) + STAT_FIELDS, rows)
+    if args.out:
+        write_csv(args.out, RANK_FIELDS, ranking)
+    if args.save_best and ranking:
+        best = next(spec for spec in specs if spec.name == ranking[0]['model'])
+        with open(args.save_best, 'w', encoding='utf-8') as f:
+            json.dump(best.to_dict(), f, ensure_ascii=False, indent=2)
+    for entry in ranking[:args.top]:
+        print(f"{entry['rank']:>3}. {entry['model']:<12} nghiệm={entry['levels']:<8} chạm nến kế={entry['hit_next_bar']} "
+              f"chạm trong {args.horizon} nến={entry['hit_within_horizon']} TB {entry['mean_bars_to_hit']} nến")
+    print(f"Hoàn thành {len(specs)} mô hình x {len(args.symbols) * len(timeframes)} cặp symbol/khung thời gian "
+          f"trong {elapsed:.2f} giây", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from backtester import ReplayBacktester, load_ticks, trigger_prices
+
+
+# Các tham số được phép quét: tham số chung của engine và tham số áp cho mọi trigger của kịch bản
+ENGINE_PARAM_KEYS = ('break_even_pips', 'break_even_offset')
+TRIGGER_PARAM_KEYS = ('buy_stop_offset_pips', 'sell_stop_offset_pips',
+                      'triggered_orders_tp_pips', 'triggered_orders_sl_pips')
+TICK_COLUMNS = ('time_msc', 'bid', 'ask', 'trigger_price')
+
+
+# --- Chuẩn bị dữ liệu dùng chung ---
+def prepare_tick_cache(symbol, ticks_path, cache_dir, poll_interval=0.0):
+    """
+    Chuyển file tick của một symbol sang các file .npy theo từng cột (time_msc, bid, ask, trigger_price)
+    trong cache_dir/<symbol>. Các tiến trình con mở chúng ở chế độ memory-mapped chỉ đọc,
+    nên dữ liệu tick chỉ nằm một lần trong page cache của hệ điều hành thay vì bị pickle cho từng tác vụ.
+    Bỏ qua bước chuyển đổi nếu cache đã mới hơn file tick gốc.
+    """
+    symbol_dir = os.path.join(cache_dir, symbol)
+    marker = os.path.join(symbol_dir, 'source.json')
+    source_info = {'ticks': os.path.abspath(ticks_path), 'mtime': os.path.getmtime(ticks_path),
+                   'poll_interval': poll_interval}
+    if os.path.exists(marker):
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f) == source_info:
+                return symbol_dir
+
+    os.makedirs(symbol_dir, exist_ok=True)
+    time_msc, bid, ask, last = load_ticks(ticks_path, poll_interval)
+    columns = {'time_msc': time_msc, 'bid': bid, 'ask': ask, 'trigger_price': trigger_prices(bid, ask, last)}
+    for name, values in columns.items():
+        np.save(os.path.join(symbol_dir, f"{name}.npy"), np.ascontiguousarray(values))
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(source_info, f)
+    return symbol_dir
+
+
+# --- Tiến trình con ---
+_worker_ticks = {}      # Key: symbol, Value: dict cột -> mảng memory-mapped
+_worker_scenarios = {}  # Key: symbol, Value: cấu hình kịch bản (symbol spec, triggers, positions, ...)
+
+
+def _init_worker(symbol_dirs, scenarios):
+    """Khởi tạo một lần cho mỗi tiến trình con: mở các mảng tick ở chế độ memory-mapped chỉ đọc."""
+    for symbol, symbol_dir in symbol_dirs.items():
+        _worker_ticks[symbol] = {name: np.load(os.path.join(symbol_dir, f"{name}.npy"), mmap_mode='r')
+                                 for name in TICK_COLUMNS}
+    _worker_scenarios.update(scenarios)
+
+
+def _run_combination(symbol, combination):
+    """Chạy một tổ hợp tham số trên dữ liệu tick của symbol. Trả về một dòng kết quả."""
+    ticks = _worker_ticks[symbol]
+    scenario = _worker_scenarios[symbol]
+
+    params = dict(scenario.get('params', {}))
+    trigger_overrides = {}
+    for key, value in combination.items():
+        if key in ENGINE_PARAM_KEYS:
+            params[key] = value
+        else:
+            trigger_overrides[key] = value
+    triggers = [dict(trigger, **trigger_overrides) for trigger in scenario.get('triggers', [])]
+
+    backtester = ReplayBacktester(
+        ticks['time_msc'], ticks['bid'], ticks['ask'], None, scenario.get('symbol', {}), params,
+        breakeven_on=scenario.get('breakeven_on', True), triggers=triggers,
+        positions=scenario.get('positions', []), trigger_price=ticks['trigger_price']
+    )
+    _, stats = backtester.run()
+    return dict({'symbol': symbol}, **combination, **stats)
+
+
+# --- Lưới tham số ---
+def expand_grid(grid):
+    """Sinh tất cả tổ hợp từ dict {tên tham số: danh sách giá trị}."""
+    unknown = set(grid) - set(ENGINE_PARAM_KEYS) - set(TRIGGER_PARAM_KEYS)
+    if unknown:
+        raise ValueError(f"Tham số không hỗ trợ trong lưới: {', '.join(sorted(unknown))}")
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def run_sweep(scenarios, grid, cache_dir, workers=None, poll_interval=0.0, progress=None):
+    """
+    Quét toàn bộ lưới tham số cho mọi symbol bằng một process pool.
+    scenarios: {symbol: cấu hình kịch bản có khóa 'ticks' là đường dẫn file tick}.
+    Trả về danh sách dòng kết quả (mỗi dòng: symbol, giá trị tham số và thống kê backtest).
+    """
+    symbol_dirs = {symbol: prepare_tick_cache(symbol, scenario['ticks'], cache_dir, poll_interval)
+                   for symbol, scenario in scenarios.items()}
+    combinations = expand_grid(grid)
+    tasks = [(symbol, combination) for symbol in scenarios for combination in combinations]
+
+    results = []
+    # spawn giống môi trường Windows của MT5; tiến trình con chỉ nhận đường dẫn, không nhận dữ liệu tick
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(symbol_dirs, scenarios)) as pool:
+        futures = [pool.submit(_run_combination, symbol, combination) for symbol, combination in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            results.append(future.result())
+            if progress:
+                progress(done, len(tasks))
+    return results
+
+
+def write_results_csv(results, path, sort_key, descending=True):
+    """Ghi bảng kết quả ra CSV, sắp xếp theo sort_key."""
+    if not results:
+        return
+    results = sorted(results, key=lambda row: row.get(sort_key, 0), reverse=descending)
+    fields = list(results[0])
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def best_per_symbol(results, sort_key, top=3, descending=True):
+    """Các tổ hợp tốt nhất của từng symbol theo sort_key."""
+    best = {}
+    for row in sorted(results, key=lambda row: row.get(sort_key, 0), reverse=descending):
+        rows = best.setdefault(row['symbol'], [])
+        if len(rows) < top:
+            rows.append(row)
+    return best
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """
+    Quét tham số từ dòng lệnh. File cấu hình JSON gồm:
+    scenarios: {symbol: {ticks, symbol, params, breakeven_on, triggers, positions}} (giống backtester)
+    và grid: {tên tham số: [các giá trị]}.
+    """
+    parser = argparse.ArgumentParser(description="Quét song song tham số breakeven/trigger trên dữ liệu tick")
+    parser.add_argument('--config', required=True, help="File cấu hình JSON (scenarios, grid)")
+    parser.add_argument('--out', default='sweep_results.csv', help="File CSV kết quả")
+    parser.add_argument('--cache-dir', default='tick_cache', help="Thư mục cache tick dạng .npy")
+    parser.add_argument('--workers', type=int, default=None, help="Số tiến trình (mặc định: số CPU)")
+    parser.add_argument('--poll-interval', type=float, default=0.0, help="Mô phỏng chu kỳ lấy tick (giây)")
+    parser.add_argument('--sort', default='net_profit', help="Cột dùng để xếp hạng")
+    parser.add_argument('--ascending', action='store_true', help="Xếp tăng dần (ví dụ cho max_drawdown)")
+    parser.add_argument('--top', type=int, default=3, help="Số tổ hợp tốt nhất in ra cho mỗi symbol")
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+
+    def progress(done, total):
+        if done == total or done % max(1, total // 20) == 0:
+            print(f"Đã chạy {done}/{total} tổ hợp", file=sys.stderr)
+
+    started = time.perf_counter()
+    results = run_sweep(config['scenarios'], config['grid'], args.cache_dir,
+                        workers=args.workers, poll_interval=args.poll_interval, progress=progress)
+    elapsed = time.perf_counter() - started
+
+    write_results_csv(results, args.out, args.sort, descending=not args.ascending)
+    print(f"Hoàn thành {len(results)} lần backtest trong {elapsed:.2f} giây. Kết quả: {args.out}")
+    grid_keys = list(config['grid'])
+    for symbol, rows in best_per_symbol(results, args.sort, args.top, descending=not args.ascending).items():
+        print(f"--- {symbol} ---")
+        for row in rows:
+            settings = ", ".join(f"{key}={row[key]}" for key in grid_keys)
+            print(f"{args.sort}={row[args.sort]} | {settings} | trades={row['trades']} win_rate={row['win_rate']}")
+
+
+if __name__ == "__main__":
+    main()
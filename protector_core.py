@@ -0,0 +1,113 @@
+# --- Logic quyết định thuần (không phụ thuộc MT5/GUI) ---
+# Dùng chung cho BreakevenProtector (chạy thật) và backtester (chạy lại dữ liệu tick lịch sử),
+# để hai nơi luôn đưa ra cùng một quyết định với cùng một chuỗi giá.
+
+# Kết quả của detect_price_cross
+CROSS_NONE = 0
+CROSS_UP = 1
+CROSS_DOWN = -1
+
+
+def pip_step_for(digits, point):
+    """
+    Tính giá trị 1 pip theo số chữ số thập phân của symbol.
+    Trả về 0.0 nếu không xác định được (point = 0).
+    """
+    if digits == 5: return 0.0001
+    elif digits == 3: return 0.001
+    elif digits == 2: return 0.1
+    return 10 * point
+
+
+def breakeven_target_sl(is_buy, price_open, break_even_offset, pip_step):
+    """SL hòa vốn mục tiêu: giá mở lệnh cộng offset (pips) về phía có lời, không bao giờ tệ hơn giá mở lệnh."""
+    if is_buy:
+        return max(price_open + break_even_offset * pip_step, price_open)
+    return min(price_open - break_even_offset * pip_step, price_open)
+
+
+def evaluate_breakeven(is_buy, price_open, current_sl, current_price, pip_step,
+                       break_even_pips, break_even_offset, stop_level, freeze_level, digits):
+    """
+    Quyết định có dời SL về hòa vốn hay không.
+    - current_price: ask với lệnh Buy, bid với lệnh Sell (giống vòng lặp chính).
+    - stop_level, freeze_level: khoảng cách tối thiểu theo đơn vị giá (stops_level * point).
+    Trả về SL mới (đã làm tròn theo digits) nếu cần dời, ngược lại trả về None.
+    """
+    current_profit_pips = abs((current_price - price_open) / pip_step)
+    # Làm tròn trước khi so sánh với SL hiện tại (SL trên terminal đã được làm tròn theo digits),
+    # tránh gửi lại cùng một SL mỗi vòng do sai số dấu phẩy động
+    new_sl = round(breakeven_target_sl(is_buy, price_open, break_even_offset, pip_step), digits)
+
+    enough_profit = current_profit_pips >= break_even_pips
+    sl_far_enough = True
+    in_freeze = False
+
+    if is_buy:
+        # Chỉ kiểm tra nếu stops_level > 0
+        if stop_level > 0 and new_sl >= current_price - stop_level:
+            sl_far_enough = False
+        # Nếu SL hiện tại của lệnh đã tốt hơn SL mới được tính, không cần dời
+        if current_sl != 0.0 and current_sl >= new_sl:
+            sl_far_enough = False
+    else:
+        if stop_level > 0 and new_sl <= current_price + stop_level:
+            sl_far_enough = False
+        if current_sl != 0.0 and current_sl <= new_sl:
+            sl_far_enough = False
+
+    if freeze_level > 0 and abs(current_price - price_open) < freeze_level:
+        in_freeze = True
+
+    # Chỉ được modify nếu đủ profit VÀ SL đủ xa khỏi giá hiện tại/freeze level VÀ SL hiện tại chưa được đặt hoặc tệ hơn SL mới
+    if enough_profit and sl_far_enough and not in_freeze:
+        if current_sl == 0.0 or (is_buy and current_sl < new_sl) or (not is_buy and current_sl > new_sl):
+            return new_sl
+    return None
+
+
+def detect_price_cross(previous_price, current_price, price_P):
+    """Phát hiện giá đi qua điểm P giữa hai lần quan sát: CROSS_UP, CROSS_DOWN hoặc CROSS_NONE."""
+    if previous_price < price_P and current_price >= price_P:
+        return CROSS_UP
+    if previous_price > price_P and current_price <= price_P:
+        return CROSS_DOWN
+    return CROSS_NONE
+
+
+def trigger_order_sides(order_type):
+    """Các phía lệnh chờ cần đặt cho một loại trigger: ('buy',), ('sell',) hoặc cả hai."""
+    sides = []
+    if order_type in ["Double Stop", "Buy Stop"]:
+        sides.append('buy')
+    if order_type in ["Double Stop", "Sell Stop"]:
+        sides.append('sell')
+    return tuple(sides)
+
+
+def stop_order_levels(price_P, is_buy, offset_pips, tp_pips, sl_pips, pip_step, digits):
+    """
+    Tính giá đặt, SL và TP (đã làm tròn) cho lệnh Buy Stop/Sell Stop tạo bởi trigger.
+    SL/TP bằng 0 nghĩa là không đặt.
+    """
+    if is_buy:
+        price = price_P + offset_pips * pip_step
+        tp = price + tp_pips * pip_step if tp_pips > 0 else 0.0
+        sl = price - sl_pips * pip_step if sl_pips > 0 else 0.0
+    else:
+        price = price_P - offset_pips * pip_step
+        tp = price - tp_pips * pip_step if tp_pips > 0 else 0.0
+        sl = price + sl_pips * pip_step if sl_pips > 0 else 0.0
+    return round(price, digits), round(sl, digits), round(tp, digits)
+
+
+def trigger_should_activate(order_type, placed_buy, placed_sell):
+    """Trigger được đánh dấu đã kích hoạt khi ít nhất một lệnh cần thiết được đặt thành công."""
+    if order_type == "Double Stop":
+        return placed_buy or placed_sell
+    if order_type == "Buy Stop":
+        return placed_buy
+    if order_type == "Sell Stop":
+        return placed_sell
+    return False
+
@@ -0,0 +1,196 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+from scanner_core import (
+    connect_scanner, format_evaluation, iter_scan, nearest_solution, select_universe, ModelSpec,
+    DEFAULT_TRADE_MODES, TIMEFRAME_NAMES, TRADE_MODE_NAMES, PREDICTION_MODES, NOT_NEAR_WARNINGS,
+)
+
+
+# Cột của file kết quả (CSV) / khóa của mỗi dòng JSON
+RESULT_FIELDS = ('symbol', 'timeframe', 'mode', 'solutions', 'check', 'warning', 'near', 'distance_pips',
+                 'live_price', 'high', 'low', 'error')
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bar_store")
+
+
+# --- Đầu vào ---
+def parse_list(value: str) -> list:
+    """Tách danh sách cách nhau bởi dấu phẩy/khoảng trắng, bỏ phần tử rỗng và trùng lặp (giữ thứ tự)."""
+    items = [item.strip() for item in value.replace(',', ' ').split()]
+    return list(dict.fromkeys(item for item in items if item))
+
+
+def read_symbols_file(path: str) -> list:
+    """Đọc danh sách symbol từ file: mỗi dòng một hoặc nhiều symbol (cách nhau bởi dấu phẩy), '#' là chú thích."""
+    symbols = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            symbols.extend(parse_list(line.split('#', 1)[0]))
+    return list(dict.fromkeys(symbols))
+
+
+# --- Tiến trình quét ---
+def error_row(symbol: str, tf_str: str, error: Exception) -> dict:
+    """Dòng kết quả cho cặp symbol/khung thời gian không tính được."""
+    return dict({field: None for field in RESULT_FIELDS}, symbol=symbol, timeframe=tf_str, error=str(error))
+
+
+def evaluation_rows(evaluation: dict, modes: list) -> list:
+    """Các dòng kết quả (một dòng mỗi chế độ) kèm phân loại Check/Warning giống bảng của TradingApp."""
+    rows = []
+    digits = evaluation["Digits"]
+    for mode in modes:
+        formatted = format_evaluation(evaluation, mode)
+        nearest = nearest_solution(evaluation, (mode,))
+        rows.append({
+            'symbol': evaluation["Symbol"],
+            'timeframe': evaluation["Timeframe"],
+            'mode': mode,
+            'solutions': [round(float(sol), digits) for sol in evaluation["Solutions"][mode]],
+            'check': formatted["Check"],
+            'warning': formatted["Warning"],
+            'near': formatted["Warning"] not in NOT_NEAR_WARNINGS,
+            'distance_pips': round(nearest[0], 1) if nearest is not None else None,
+            'live_price': round(float(evaluation["Live Price"]), digits),
+            'high': round(float(evaluation["High"]), digits),
+            'low': round(float(evaluation["Low"]), digits),
+            'error': None,
+        })
+    return rows
+
+
+def run_scan(symbols, timeframes, modes, workers=1, login=None, password=None, server=None,
+             store_dir=DEFAULT_STORE_DIR, universe=None, min_history=0, progress=None, model=None):
+    """
+    Quét toàn bộ symbol x khung thời gian. universe: None để quét danh sách symbols (tên gốc, tự tìm tên trên server),
+    hoặc dict tham số của select_universe (group, trade_modes) để quét mọi symbol của server thỏa bộ lọc.
+    workers > 1: chia symbol cho một process pool, mỗi tiến trình giữ một kết nối MT5 riêng tới terminal.
+    model: mô hình tính nghiệm (ModelSpec), None: mô hình gốc.
+    Trả về (các dòng kết quả theo thứ tự symbol, thời gian từng symbol).
+    """
+    connection = {'login': login, 'password': password, 'server': server,
+                  'store_dir': store_dir, 'min_history': min_history,
+                  'model': model.to_dict() if model is not None else None}
+    scanner = connect_scanner(**connection)
+    try:
+        resolve = universe is None
+        if not resolve:
+            symbols = select_universe(scanner.terminal, **universe)
+        symbol_rows, timings = {}, {}
+        for done, (symbol, name, evaluations, elapsed) in enumerate(
+                iter_scan(symbols, timeframes, workers, scanner, connection, resolve), 1):
+            rows = []
+            for tf_str in timeframes:
+                evaluation = evaluations[tf_str]
+                if isinstance(evaluation, Exception):
+                    rows.append(error_row(name, tf_str, evaluation))
+                else:
+                    rows.extend(evaluation_rows(evaluation, modes))
+            symbol_rows[symbol], timings[symbol] = rows, elapsed
+            if progress:
+                progress(done, len(symbols))
+    finally:
+        scanner.terminal.shutdown()
+    # Giữ thứ tự symbol như đầu vào, không phụ thuộc thứ tự hoàn thành
+    return [row for symbol in symbols for row in symbol_rows[symbol]], timings
+
+
+# --- Đầu ra ---
+def write_rows(rows: list, out, output_format: str):
+    """Ghi kết quả ra file/stdout dạng JSON Lines hoặc CSV (nghiệm nối bằng dấu phẩy)."""
+    if output_format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            solutions = row['solutions']
+            writer.writerow(dict(row, solutions=", ".join(str(sol) for sol in solutions) if solutions else ""))
+    else:
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Quét nghiệm không cần giao diện, ghi kết quả dạng JSON Lines hoặc CSV."""
+    parser = argparse.ArgumentParser(description="Quét nghiệm theo lô (không giao diện) cho nhiều symbol/khung thời gian")
+    parser.add_argument('--symbols', default='', help="Danh sách symbol, cách nhau bởi dấu phẩy")
+    parser.add_argument('--symbols-file', help="File danh sách symbol (mỗi dòng một hoặc nhiều symbol)")
+    parser.add_argument('--universe', action='store_true', help="Quét mọi symbol của server (thay cho --symbols)")
+    parser.add_argument('--group', help="Bộ lọc nhóm/đường dẫn symbol khi quét toàn bộ, cú pháp symbols_get (ví dụ \"*USD*,!*BTC*\")")
+    parser.add_argument('--trade-modes', default=','.join(DEFAULT_TRADE_MODES),
+                        help=f"Chế độ giao dịch được quét khi quét toàn bộ ({', '.join(TRADE_MODE_NAMES)})")
+    parser.add_argument('--min-history', type=int, default=0, help="Số nến tối thiểu của khung gốc; symbol ít hơn bị bỏ qua")
+    parser.add_argument('--timeframes', default='D1,W1,MN1', help="Các khung thời gian, cách nhau bởi dấu phẩy")
+    parser.add_argument('--modes', default='all', help="Các chế độ dự đoán (close, highest, lowest) hoặc 'all'")
+    parser.add_argument('--model', help="File JSON mô hình tính nghiệm (mặc định: mô hình gốc)")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl', help="Định dạng đầu ra")
+    parser.add_argument('--out', help="File kết quả (mặc định: stdout)")
+    parser.add_argument('--near-only', action='store_true', help="Chỉ ghi các dòng có nghiệm gần giá live (<= 50 pip)")
+    parser.add_argument('--rank', action='store_true', help="Xếp kết quả theo khoảng cách tới nghiệm gần nhất (pip)")
+    parser.add_argument('--top', type=int, default=0, help="Chỉ ghi N dòng đầu (dùng cùng --rank), 0: ghi tất cả")
+    parser.add_argument('--workers', type=int, default=1, help="Số tiến trình quét song song (mặc định 1)")
+    parser.add_argument('--login', type=int, help="Login tài khoản (mặc định: tài khoản đang mở trên terminal)")
+    parser.add_argument('--password', help="Mật khẩu tài khoản")
+    parser.add_argument('--server', help="Server của tài khoản")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR, help="Thư mục kho nến cục bộ")
+    args = parser.parse_args(argv)
+
+    symbols = parse_list(args.symbols)
+    if args.symbols_file:
+        symbols = list(dict.fromkeys(symbols + read_symbols_file(args.symbols_file)))
+    timeframes = [tf.upper() for tf in parse_list(args.timeframes)]
+    modes = list(PREDICTION_MODES) if args.modes.strip().lower() == 'all' else parse_list(args.modes.lower())
+    if not symbols and not args.universe:
+        parser.error("Cần ít nhất một symbol (--symbols, --symbols-file hoặc --universe)")
+    trade_modes = parse_list(args.trade_modes.lower())
+    if any(mode not in TRADE_MODE_NAMES for mode in trade_modes):
+        parser.error(f"Chế độ giao dịch không hợp lệ: {args.trade_modes}")
+    universe = {'group': args.group, 'trade_modes': trade_modes} if args.universe else None
+    invalid = [tf for tf in timeframes if tf not in TIMEFRAME_NAMES] + [m for m in modes if m not in PREDICTION_MODES]
+    if invalid or not timeframes or not modes:
+        parser.error(f"Khung thời gian/chế độ không hợp lệ: {', '.join(invalid) or '(rỗng)'}")
+    try:
+        model = ModelSpec.from_file(args.model) if args.model else None
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"Không đọc được mô hình {args.model}: {e}")
+
+    def progress(done, total):
+        if done == total or done % max(1, total // 20) == 0:
+            print(f"Đã quét {done}/{total} symbol", file=sys.stderr)
+
+    started = time.perf_counter()
+    try:
+        rows, timings = run_scan(symbols, timeframes, modes, workers=args.workers, login=args.login,
+                                 password=args.password, server=args.server, store_dir=args.store_dir,
+                                 universe=universe, min_history=args.min_history, progress=progress, model=model)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    if args.near_only:
+        rows = [row for row in rows if row['near']]
+    if args.rank:
+        rows = sorted((row for row in rows if row['distance_pips'] is not None), key=lambda row: row['distance_pips'])
+    if args.top > 0:
+        rows = rows[:args.top]
+    if args.out:
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            write_rows(rows, f, args.format)
+    else:
+        write_rows(rows, sys.stdout, args.format)
+
+    errors = sum(1 for row in rows if row['error'])
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:3]
+    print(f"Hoàn thành {len(timings)} symbol x {len(timeframes)} khung thời gian trong {elapsed:.2f} giây "
+          f"({len(rows)} dòng, {errors} lỗi). Chậm nhất: "
+          + ", ".join(f"{symbol} {seconds:.2f}s" for symbol, seconds in slowest), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
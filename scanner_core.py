@@ -0,0 +1,620 @@
+import os
+import math
+import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from bar_resample import base_bars_needed, plan_timeframes, resample_bars
+from bar_store import BarStore, to_bar_array
+
+
+# --- Pipeline tính nghiệm dùng chung (không phụ thuộc GUI) ---
+# Dùng cho TradingApp (tkinter) và scan_cli (chạy không giao diện), để hai nơi cho cùng một kết quả.
+
+TIMEFRAME_NAMES = ('M1', 'M5', 'M15', 'M30', 'H1', 'H4', 'D1', 'W1', 'MN1')
+# Tên chế độ giao dịch của symbol -> tên hằng số SYMBOL_TRADE_MODE_* của MetaTrader 5
+TRADE_MODE_NAMES = {
+    'disabled': 'SYMBOL_TRADE_MODE_DISABLED', 'longonly': 'SYMBOL_TRADE_MODE_LONGONLY',
+    'shortonly': 'SYMBOL_TRADE_MODE_SHORTONLY', 'closeonly': 'SYMBOL_TRADE_MODE_CLOSEONLY',
+    'full': 'SYMBOL_TRADE_MODE_FULL',
+}
+DEFAULT_TRADE_MODES = ('full', 'longonly', 'shortonly')
+
+
+def find_symbol_name(base_symbol: str, symbol_names) -> str:
+    """
+    Tìm tên symbol chính xác trong danh sách tên symbol của server.
+    Ưu tiên symbol chính xác (ví dụ: "EURUSD") hơn symbol có hậu tố 'M' (ví dụ: "EURUSDM").
+    Nếu không tìm thấy symbol chính xác, sẽ tìm symbol có hậu tố 'M' hoặc ứng cử viên đầu tiên.
+    """
+    symbol_names = list(symbol_names)
+    base_symbol_upper = base_symbol.upper()
+
+    # Bước 1: Tìm kiếm symbol chính xác (không có hậu tố)
+    for name in symbol_names:
+        if name.upper() == base_symbol_upper:
+            return name
+
+    # Bước 2: Tìm kiếm symbol có hậu tố 'M' (phổ biến với Exness)
+    for name in symbol_names:
+        if name.upper() == base_symbol_upper + "M":
+            return name
+
+    # Bước 3: Tìm bất kỳ symbol nào bắt đầu bằng base_symbol (nếu 2 bước trên không tìm thấy)
+    candidates = [name for name in symbol_names if name.upper().startswith(base_symbol_upper)]
+    if candidates:
+        return candidates[0] # Trả về ứng cử viên đầu tiên
+
+    # Nếu không tìm thấy symbol nào khớp
+    raise RuntimeError(f"Không tìm thấy symbol nào khớp '{base_symbol}' trên server.")
+
+
+def get_average_prices(bars: np.ndarray, counts: dict) -> dict:
+    """
+    Tính giá trung bình cho các mức high, low, close từ các nến đã đóng (bars, tăng dần theo thời gian,
+    thường là view memmap từ BarStore) với số nến cuối được chỉ định trong 'counts'.
+    """
+    averages = {}
+    for key, bar_count in counts.items():
+        if len(bars) < bar_count:
+            # Nếu không đủ dữ liệu, báo lỗi Runtime Error
+            raise RuntimeError(f"Không đủ dữ liệu cho {key}: chỉ có {len(bars)}/{bar_count} nến.")
+
+        # Tính giá trị trung bình dựa trên key (high, low, close) trên 'bar_count' nến đã đóng gần nhất
+        if key.startswith("high"):
+            value = bars["high"][-bar_count:].mean()
+        elif key.startswith("low"):
+            value = bars["low"][-bar_count:].mean()
+        elif key.startswith("close"):
+            value = bars["close"][-bar_count:].mean()
+        else:
+            raise ValueError(f"Key không hợp lệ để tính giá trung bình: {key}. Phải là 'high', 'low' hoặc 'close'.")
+
+        # Làm tròn giá trị trung bình đến 8 chữ số thập phân trước khi giải
+        averages[key] = round(float(value), 8)
+    return averages
+
+
+# Các điểm A, B, C, D, E của từng chế độ dự đoán (khóa giá trung bình) trong mô hình gốc. Hoành độ lần lượt là 5, 3, 2, 1, 1.
+PREDICTION_POINTS = {
+    'close': ('low_5', 'high_3', 'close_2', 'low_1', 'high_1'),     # Dự đoán giá ĐÓNG CỬA
+    'highest': ('low_5', 'close_3', 'high_2', 'low_1', 'close_1'),  # Dự đoán giá CAO NHẤT
+    'lowest': ('close_5', 'high_3', 'low_2', 'close_1', 'high_1'),  # Dự đoán giá THẤP NHẤT
+}
+PREDICTION_MODES = ('close', 'highest', 'lowest')
+PRICE_FIELDS = ('high', 'low', 'close')
+POINT_NAMES = ('A', 'B', 'C', 'D', 'E')
+
+
+class ModelSpec:
+    """
+    Mô hình tính nghiệm: với mỗi chế độ dự đoán, năm điểm A, B, C, D, E là (trường giá, số nến trung bình).
+    Tung độ của điểm là giá trung bình của trường giá trên số nến đó, hoành độ chính là số nến đó
+    (mô hình gốc: 5, 3, 2, 1, 1). D và E phải cùng số nến để phương trình giải được dạng đóng (xem solve_level_arrays).
+    points: {chế độ: 5 cặp (trường giá, số nến)} hoặc {chế độ: 5 khóa dạng "low_5"}.
+    """
+    def __init__(self, points: dict, name: str = None):
+        self.points = {}
+        for mode, mode_points in points.items():
+            if mode not in PREDICTION_MODES:
+                raise ValueError(f"Chế độ dự đoán không hợp lệ: {mode}")
+            parsed = tuple(self._parse_point(point) for point in mode_points)
+            if len(parsed) != len(POINT_NAMES):
+                raise ValueError(f"Chế độ {mode} cần đúng {len(POINT_NAMES)} điểm, nhận {len(parsed)}.")
+            if parsed[3][1] != parsed[4][1]:
+                raise ValueError(f"Chế độ {mode}: D và E phải cùng số nến ({parsed[3][1]} != {parsed[4][1]}).")
+            self.points[mode] = parsed
+        missing = [mode for mode in PREDICTION_MODES if mode not in self.points]
+        if missing:
+            raise ValueError(f"Mô hình thiếu chế độ: {', '.join(missing)}")
+        self.name = name or self.describe()
+
+    @staticmethod
+    def _parse_point(point) -> tuple:
+        field, bar_count = point.rsplit('_', 1) if isinstance(point, str) else point
+        if field not in PRICE_FIELDS:
+            raise ValueError(f"Trường giá không hợp lệ: {field}. Phải là 'high', 'low' hoặc 'close'.")
+        if int(bar_count) < 1:
+            raise ValueError(f"Số nến trung bình phải >= 1, nhận {bar_count}.")
+        return field, int(bar_count)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ModelSpec':
+        """Tạo mô hình từ dict dạng {"name": ..., "points": {chế độ: ["low_5", "high_3", ...]}}."""
+        return cls(data['points'], data.get('name'))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ModelSpec':
+        """Đọc mô hình từ file JSON (định dạng của to_dict)."""
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'points': {mode: list(self.point_keys(mode)) for mode in PREDICTION_MODES}}
+
+    def point_keys(self, mode: str) -> tuple:
+        """Khóa giá trung bình (ví dụ "low_5") của các điểm A..E của chế độ mode."""
+        return tuple(f"{field}_{bar_count}" for field, bar_count in self.points[mode])
+
+    def abscissae(self, mode: str) -> tuple:
+        """Hoành độ của các điểm A..E của chế độ mode."""
+        return tuple(bar_count for _, bar_count in self.points[mode])
+
+    def average_counts(self) -> dict:
+        """Số nến cần lấy cho mỗi giá trung bình mà mô hình dùng (dạng AVERAGE_COUNTS, cho get_average_prices)."""
+        return {f"{field}_{bar_count}": bar_count
+                for mode in PREDICTION_MODES for field, bar_count in self.points[mode]}
+
+    @property
+    def max_lookback(self) -> int:
+        """Số nến đã đóng tối thiểu để tính được mọi giá trung bình."""
+        return max(bar_count for mode in PREDICTION_MODES for _, bar_count in self.points[mode])
+
+    def describe(self) -> str:
+        """Mô tả ngắn, ví dụ "close=L5,H3,C2,L1,H1 highest=..."."""
+        return " ".join(f"{mode}=" + ",".join(f"{field[0].upper()}{bar_count}" for field, bar_count in self.points[mode])
+                        for mode in PREDICTION_MODES)
+
+    def __eq__(self, other):
+        return isinstance(other, ModelSpec) and self.points == other.points
+
+    def __hash__(self):
+        return hash(tuple(self.points[mode] for mode in PREDICTION_MODES))
+
+    def __repr__(self):
+        return f"ModelSpec({self.name!r})"
+
+
+# Mô hình gốc, cho kết quả giống hệt công thức cố định trước đây
+DEFAULT_MODEL = ModelSpec(PREDICTION_POINTS, name='default')
+
+
+def solve_level_arrays(points: np.ndarray, abscissae: tuple = (5, 3, 2, 1, 1)) -> tuple:
+    """
+    Giải phương trình BC/EF = AC/DF cho nhiều bộ điểm cùng lúc (mỗi dòng của points là tung độ A, B, C, D, E).
+    A=(xa,a), B=(xb,b), C=(xc,c), D=(xd,d), E=(xd,e), F=(0,x); abscissae là (xa, xb, xc, xd, xe) với xe = xd
+    (mô hình gốc: 5, 3, 2, 1, 1).
+
+    Vì D và E cùng hoành độ xd > 0 nên DF, EF luôn > 0 và bình phương hai vế không sinh nghiệm ngoại lai:
+        BC²·(xd² + (d-x)²) = AC²·(xd² + (e-x)²)
+    Đặt x = d + t, u = e - d (giữ các hệ số nhỏ để tránh mất độ chính xác):
+        (BC² - AC²)·t² + 2·AC²·u·t + (BC²·xd² - AC²·(xd² + u²)) = 0
+    Trả về hai mảng nghiệm (x1, x2) chưa làm tròn, NaN ở vị trí không có nghiệm (phương trình bậc nhất chỉ có x1).
+    """
+    # Nhân 100000 để làm việc với giá trị lớn hơn, giống công thức gốc
+    ys = np.asarray(points, dtype=np.float64) * 100000
+    a, b, c, d, e = ys[:, 0], ys[:, 1], ys[:, 2], ys[:, 3], ys[:, 4]
+    xa, xb, xc, xd = abscissae[:4]
+
+    bc2 = (xb - xc) ** 2 + (b - c) ** 2
+    ac2 = (xa - xc) ** 2 + (a - c) ** 2
+    u = e - d
+
+    qa = bc2 - ac2
+    qb = 2 * ac2 * u
+    qc = bc2 * xd * xd - ac2 * (xd * xd + u * u)
+    disc = qb * qb - 4 * qa * qc
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        sqrt_disc = np.sqrt(np.where(disc >= 0, disc, np.nan))
+        # Công thức nghiệm ổn định số học: tránh trừ hai số gần bằng nhau
+        s = -0.5 * (qb + np.copysign(sqrt_disc, qb))
+        quadratic = (qa != 0) & (disc >= 0)
+        # Phương trình bậc nhất khi BC = AC
+        linear = (qa == 0) & (qb != 0)
+        t1 = np.where(quadratic, s / qa, np.where(linear, -qc / qb, np.nan))
+        t2 = np.where(quadratic, qc / s, np.nan)
+        # Chia lại cho 100000 để đưa về giá trị giá ban đầu; giá trị không hữu hạn coi như không có nghiệm
+        x1 = (d + t1) / 100000
+        x2 = (d + t2) / 100000
+    x1[~np.isfinite(x1)] = np.nan
+    x2[~np.isfinite(x2)] = np.nan
+    return x1, x2
+
+
+def solve_levels(points: np.ndarray, decimal_places: int = 5, abscissae: tuple = (5, 3, 2, 1, 1)) -> list:
+    """
+    Giải cho nhiều bộ điểm cùng lúc (xem solve_level_arrays). Cho kết quả giống sympy.solve trước đây.
+    Trả về danh sách (mỗi bộ điểm một danh sách nghiệm đã làm tròn, sắp xếp, không trùng lặp).
+    """
+    x1, x2 = solve_level_arrays(points, abscissae)
+    results = []
+    for first, second in zip(x1.tolist(), x2.tolist()):
+        cleaned_sols = {round(value, decimal_places) for value in (first, second) if math.isfinite(value)}
+        results.append(sorted(cleaned_sols))
+    return results
+
+
+def find_x_all_modes(average_prices: dict, decimal_places: int = 5, modes=PREDICTION_MODES,
+                     model: ModelSpec = DEFAULT_MODEL) -> dict:
+    """
+    Tính nghiệm của tất cả các chế độ dự đoán từ cùng một bộ giá trung bình (khóa theo model.average_counts()).
+    Các chế độ cùng hoành độ (luôn đúng với mô hình gốc) được giải trong một lần.
+    Trả về dict {chế độ: danh sách nghiệm}.
+    """
+    groups = {}
+    for mode in modes:
+        groups.setdefault(model.abscissae(mode), []).append(mode)
+    solutions = {}
+    for abscissae, group in groups.items():
+        points = [[average_prices[key] for key in model.point_keys(mode)] for mode in group]
+        solutions.update(zip(group, solve_levels(points, decimal_places, abscissae)))
+    return {mode: solutions[mode] for mode in modes}
+
+
+def find_x(average_prices: dict, prediction_mode: str, decimal_places: int = 5, model: ModelSpec = DEFAULT_MODEL) -> list:
+    """
+    Giải phương trình toán học để tìm các giá trị 'x' dựa trên các điểm giá trung bình.
+    
+    prediction_mode: Chế độ dự đoán ('close', 'highest', 'lowest') để điều chỉnh công thức.
+    decimal_places: Số chữ số thập phân để làm tròn các nghiệm cuối cùng. Mặc định là 5.
+    model: mô hình chọn giá trung bình cho các điểm A..E (mặc định: mô hình gốc).
+    """
+    mode = prediction_mode if prediction_mode in PREDICTION_POINTS else 'close' # Mặc định là 'close'
+    return find_x_all_modes(average_prices, decimal_places, (mode,), model)[mode]
+
+
+# Số nến cần lấy để tính giá trung bình cho tất cả các chế độ dự đoán của mô hình gốc
+AVERAGE_COUNTS = {
+    'high_5': 5, 'low_5': 5, 'close_5': 5,
+    'high_3': 3, 'low_3': 3, 'close_3': 3,
+    'high_2': 2, 'low_2': 2, 'close_2': 2,
+    'high_1': 1, 'low_1': 1, 'close_1': 1
+}
+
+
+def build_check_text(sols: list, current_low, current_high, decimal_places: int) -> str:
+    """Nội dung cột "Check": TẤT CẢ các nghiệm đã nằm trong biên độ nến hiện tại."""
+    passed_solutions = []
+    if current_high is not None and current_low is not None:
+        for i, sol in enumerate(sols, 1):
+            if math.isfinite(sol) and current_low <= sol <= current_high:
+                passed_solutions.append(f"Nghiệm {i}: {sol:.{decimal_places}f}")
+
+    if passed_solutions:
+        return "Đã đi qua: " + ", ".join(passed_solutions)
+    return "Chưa đi qua"
+
+
+def build_warning_text(sols: list, live_price, pip_size: float, decimal_places: int) -> str:
+    """Nội dung cột "Warning": TẤT CẢ các nghiệm gần giá live (<= 10 pip: rất gần, <= 50 pip: gần)."""
+    if live_price is None:
+        return "Không có giá Live" # Trường hợp không lấy được giá live
+
+    close_solutions_info = []
+    for i, sol in enumerate(sols, 1):
+        if math.isfinite(sol):
+            diff = abs(live_price - sol)
+            if diff <= 10 * pip_size:
+                close_solutions_info.append(f"Rất gần Nghiệm {i}: {sol:.{decimal_places}f} ({diff / pip_size:.0f} pip)")
+            elif diff <= 50 * pip_size:
+                close_solutions_info.append(f"Gần Nghiệm {i}: {sol:.{decimal_places}f} ({diff / pip_size:.0f} pip)")
+
+    if close_solutions_info:
+        return "; ".join(close_solutions_info)
+    elif sols: # Nếu có nghiệm nhưng không có nghiệm nào gần
+        return "Không có nghiệm nào gần ( > 50 pip)"
+    return "Không tìm thấy nghiệm hợp lệ" # Nếu không tìm thấy nghiệm nào (sols rỗng)
+
+
+class SolutionCache:
+    """
+    Bộ nhớ đệm nghiệm của find_x, khóa theo (symbol, khung thời gian, thời gian mở nến đã đóng gần nhất).
+    Mỗi mục chứa nghiệm của cả ba chế độ dự đoán, nên đổi chế độ không cần tính lại.
+    Nghiệm chỉ phụ thuộc vào các nến đã đóng, nên chỉ cần tính lại khi có nến mới đóng (với D1/W1/MN1
+    là một lần mỗi ngày hoặc ít hơn). Dùng chung giữa luồng GUI và luồng tìm kiếm nhanh.
+    """
+    def __init__(self):
+        self._entries = {}  # Key: (symbol, tf_str), Value: (thời gian nến đã đóng, {chế độ: danh sách nghiệm})
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol: str, tf_str: str, closed_bar_time: int):
+        """Trả về nghiệm đã lưu của mọi chế độ nếu nến đã đóng gần nhất chưa thay đổi, ngược lại None."""
+        with self._lock:
+            entry = self._entries.get((symbol, tf_str))
+            if entry is not None and entry[0] == closed_bar_time:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def store(self, symbol: str, tf_str: str, closed_bar_time: int, solutions: dict):
+        """Lưu nghiệm mới, thay thế nghiệm của nến cũ cùng symbol/khung thời gian."""
+        with self._lock:
+            self._entries[(symbol, tf_str)] = (closed_bar_time, solutions)
+
+    def clear(self):
+        """Xóa toàn bộ bộ nhớ đệm (ví dụ khi đổi tài khoản/server)."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def summary(self) -> str:
+        """Chuỗi thống kê ngắn để hiển thị trên nhãn trạng thái."""
+        return f"Bộ nhớ đệm: {self.hits} dùng lại, {self.misses} tính mới"
+
+
+PREDICTION_MODE_LABELS = {'close': "Đóng cửa", 'highest': "Cao nhất", 'lowest': "Thấp nhất"}
+# Cảnh báo không có nghiệm nào gần giá live: Tìm Kiếm Nhanh bỏ qua các dòng này
+NOT_NEAR_WARNINGS = ["Không có nghiệm nào gần ( > 50 pip)", "Không tìm thấy nghiệm hợp lệ", "Không có giá Live"]
+
+
+def format_evaluation(evaluation: dict, mode: str) -> dict:
+    """Tạo một dòng kết quả (Result/Check/Warning) cho một chế độ dự đoán từ kết quả tính toán của mọi chế độ."""
+    sols = evaluation["Solutions"][mode]
+    decimal_places = evaluation["Digits"]
+    # Định dạng tất cả các nghiệm đã tìm được
+    formatted_sols = [f"{s:.{decimal_places}f}" for s in sols if math.isfinite(s)] 
+    return {
+        "Symbol": evaluation["Symbol"],
+        "Timeframe": evaluation["Timeframe"],
+        "Mode": PREDICTION_MODE_LABELS[mode],
+        "Result": ", ".join(formatted_sols), 
+        "Check": build_check_text(sols, evaluation["Low"], evaluation["High"], decimal_places), 
+        "Warning": build_warning_text(sols, evaluation["Live Price"], evaluation["Pip Size"], decimal_places),
+        "Live Price": round(evaluation["Live Price"], decimal_places),
+        "Distance": format_distance(nearest_solution(evaluation, (mode,))),
+    }
+
+
+def nearest_solution(evaluation: dict, modes=PREDICTION_MODES):
+    """
+    Nghiệm gần giá live nhất trong các chế độ modes: (khoảng cách tính bằng pip, chế độ, nghiệm),
+    hoặc None nếu không có nghiệm hợp lệ/giá live.
+    """
+    live_price = evaluation["Live Price"]
+    if live_price is None:
+        return None
+    best = None
+    for mode in modes:
+        for sol in evaluation["Solutions"][mode]:
+            if math.isfinite(sol):
+                distance = abs(live_price - sol) / evaluation["Pip Size"]
+                if best is None or distance < best[0]:
+                    best = (float(distance), mode, sol)
+    return best
+
+
+def format_distance(nearest) -> str:
+    """Nội dung cột khoảng cách (pip) tới nghiệm gần nhất; rỗng nếu không có nghiệm."""
+    return f"{nearest[0]:.1f}" if nearest is not None else ""
+
+
+def rank_evaluations(evaluations, modes=PREDICTION_MODES) -> list:
+    """
+    Xếp hạng các kết quả tính toán theo khoảng cách từ giá live tới nghiệm gần nhất (tăng dần).
+    Trả về danh sách (khoảng cách pip, kết quả tính toán, chế độ, nghiệm); bỏ các kết quả không có nghiệm.
+    """
+    ranked = []
+    for evaluation in evaluations:
+        nearest = nearest_solution(evaluation, modes)
+        if nearest is not None:
+            ranked.append((nearest[0], evaluation, nearest[1], nearest[2]))
+    ranked.sort(key=lambda item: item[0])
+    return ranked
+
+
+class Scanner:
+    """
+    Lấy dữ liệu, tính giá trung bình và giải nghiệm cho các cặp symbol/khung thời gian.
+    terminal: module MetaTrader5 đã kết nối; bar_store: kho nến cục bộ (BarStore) của server đang kết nối;
+    solution_cache: bộ nhớ đệm nghiệm (SolutionCache), tạo mới nếu không truyền vào;
+    model: mô hình tính nghiệm (ModelSpec), mặc định mô hình gốc. Bộ nhớ đệm không phân biệt mô hình,
+    nên mỗi SolutionCache chỉ nên dùng cho một mô hình.
+    """
+    def __init__(self, terminal, bar_store, solution_cache=None, min_history: int = 0, model: ModelSpec = None):
+        self.terminal = terminal
+        self.bar_store = bar_store
+        self.solution_cache = solution_cache if solution_cache is not None else SolutionCache()
+        # Số nến tối thiểu của khung gốc mà symbol phải có (lọc symbol mới niêm yết/ít dữ liệu), 0: không lọc
+        self.min_history = min_history
+        self.model = model if model is not None else DEFAULT_MODEL
+
+    def timeframe(self, tf_str: str):
+        """Hằng số khung thời gian của MetaTrader 5 cho chuỗi tf_str (ví dụ "H4"), hoặc None nếu không hợp lệ."""
+        tf_str = tf_str.upper()
+        return getattr(self.terminal, f"TIMEFRAME_{tf_str}", None) if tf_str in TIMEFRAME_NAMES else None
+
+    def find_symbol(self, base_symbol: str) -> str:
+        """Tên symbol trên server khớp với base_symbol (xem find_symbol_name)."""
+        return find_symbol_name(base_symbol, (s.name for s in self.terminal.symbols_get() or ()))
+
+    def summary(self) -> str:
+        """Chuỗi thống kê ngắn để hiển thị trên nhãn trạng thái."""
+        return f"{self.solution_cache.summary()}. {self.bar_store.summary()}"
+
+    def evaluate_symbol_timeframe(self, symbol: str, tf_str: str, symbol_info) -> dict:
+        """
+        Tính nghiệm của cả ba chế độ dự đoán cho một cặp tiền tệ và khung thời gian (xem evaluate_symbol).
+        Ném RuntimeError nếu không đủ dữ liệu nến.
+        """
+        result = self.evaluate_symbol(symbol, [tf_str], symbol_info)[tf_str]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def evaluate_symbol(self, symbol: str, tf_strs: list, symbol_info) -> dict:
+        """
+        Tính nghiệm cho nhiều khung thời gian của một cặp tiền tệ. Các khung được chia nhóm theo khung gốc
+        (plan_timeframes): mỗi nhóm chỉ lấy nến của khung gốc từ MT5/kho nến cục bộ, các khung lớn hơn
+        (ví dụ W1, MN1 từ D1) được dựng lại cục bộ theo ranh giới tuần/tháng giờ server.
+        Trả về {khung thời gian: kết quả tính toán hoặc Exception nếu không tính được}.
+        """
+        results = {}
+        plan = plan_timeframes([tf for tf in tf_strs if self.timeframe(tf) is not None], self.model.max_lookback)
+        for base_tf, targets in plan.items():
+            try:
+                self._evaluate_group(symbol, base_tf, targets, symbol_info, results)
+            except Exception as e:
+                if targets == [base_tf]:
+                    results[base_tf] = e
+                    continue
+                # Không đủ lịch sử khung gốc để dựng các khung lớn: tính riêng từng khung với nến của chính nó
+                for tf_str in targets:
+                    try:
+                        self._evaluate_group(symbol, tf_str, [tf_str], symbol_info, results)
+                    except Exception as error:
+                        results[tf_str] = error
+        for tf_str in tf_strs:
+            results.setdefault(tf_str, RuntimeError(f"Khung thời gian không hợp lệ: {tf_str}"))
+        return results
+
+    def _evaluate_group(self, symbol: str, base_tf: str, targets: list, symbol_info, results: dict):
+        """
+        Tính một nhóm khung thời gian từ nến của khung gốc base_tf, ghi kết quả vào results.
+        Nghiệm được lấy từ bộ nhớ đệm nếu chưa có nến mới đóng; nến đã đóng đọc từ kho nến cục bộ (BarStore),
+        chỉ tải phần còn thiếu từ MT5. Ném RuntimeError nếu không đủ dữ liệu nến của khung gốc.
+        """
+        tf = self.timeframe(base_tf)
+
+        # Một lần gọi lấy cả nến đã đóng gần nhất (rates[0]) và nến hiện tại (rates[1])
+        rates = self.terminal.copy_rates_from_pos(symbol, tf, 0, 2)
+        if rates is None or len(rates) < 2:
+            raise RuntimeError(f"Không lấy được nến hiện tại cho {symbol} {base_tf}.")
+        closed_bar_time = int(rates[0]['time'])
+        bar_count = self.model.max_lookback
+        history = max(bar_count, self.min_history)
+
+        if targets == [base_tf]:
+            # Chỉ khung gốc: không cần đọc kho nến nếu nghiệm đã có trong bộ nhớ đệm
+            solutions = self.solution_cache.get(symbol, base_tf, closed_bar_time)
+            if solutions is None:
+                bars = self.bar_store.sync(symbol, base_tf, tf, closed_bar_time, history)
+                solutions = self.solve_closed_bars(symbol, base_tf, bars, symbol_info, closed_bar_time)
+            results[base_tf] = self.build_evaluation(symbol, base_tf, solutions, rates[1], symbol_info)
+            return
+
+        needed = max(base_bars_needed(base_tf, tf_str, bar_count) for tf_str in targets)
+        closed_bars = self.bar_store.sync(symbol, base_tf, tf, closed_bar_time, max(needed, history))
+        # Nến gốc gần nhất cùng nến đang chạy, đủ để dựng mọi khung trong nhóm
+        bars = np.concatenate([closed_bars[-needed:], to_bar_array(rates[1:2])])
+        for tf_str in targets:
+            try:
+                if tf_str == base_tf:
+                    closed, forming = closed_bars, rates[1]
+                else:
+                    derived = resample_bars(bars, tf_str)
+                    closed, forming = derived[:-1], derived[-1]
+                if len(closed) == 0:
+                    raise RuntimeError(f"Không đủ dữ liệu cho {symbol} {tf_str}.")
+                closed_time = int(closed['time'][-1])
+                solutions = self.solution_cache.get(symbol, tf_str, closed_time)
+                if solutions is None:
+                    solutions = self.solve_closed_bars(symbol, tf_str, closed, symbol_info, closed_time)
+                results[tf_str] = self.build_evaluation(symbol, tf_str, solutions, forming, symbol_info)
+            except Exception as e:
+                results[tf_str] = e
+
+    def solve_closed_bars(self, symbol: str, tf_str: str, bars: np.ndarray, symbol_info, closed_bar_time: int) -> dict:
+        """Giải mọi chế độ dự đoán từ các nến đã đóng và lưu vào bộ nhớ đệm."""
+        avgs = get_average_prices(bars, self.model.average_counts())
+        solutions = find_x_all_modes(avgs, symbol_info.digits, model=self.model)
+        self.solution_cache.store(symbol, tf_str, closed_bar_time, solutions)
+        return solutions
+
+    def build_evaluation(self, symbol: str, tf_str: str, solutions: dict, forming_bar, symbol_info) -> dict:
+        """Kết quả tính toán của một cặp tiền tệ/khung thời gian: nghiệm mọi chế độ cùng giá của nến đang chạy."""
+        return {
+            "Symbol": symbol,
+            "Timeframe": tf_str,
+            "Solutions": solutions,
+            "Live Price": forming_bar['close'],
+            "High": forming_bar['high'],
+            "Low": forming_bar['low'],
+            "Pip Size": symbol_info.point * 10,
+            "Digits": symbol_info.digits,
+        }
+
+
+# --- Quét theo lô / toàn bộ symbol ---
+def select_universe(terminal, group: str = None, trade_modes=DEFAULT_TRADE_MODES) -> list:
+    """
+    Danh sách tên symbol của server cần quét: lọc theo nhóm/đường dẫn (cú pháp group của symbols_get,
+    ví dụ "*USD*,!*BTC*" hoặc "Forex*") và chế độ giao dịch (xem TRADE_MODE_NAMES).
+    """
+    symbols = terminal.symbols_get(group=group) if group else terminal.symbols_get()
+    allowed = {getattr(terminal, TRADE_MODE_NAMES[mode]) for mode in trade_modes}
+    return [s.name for s in symbols or () if s.trade_mode in allowed]
+
+
+def connect_scanner(login=None, password=None, server=None, store_dir=None, min_history: int = 0,
+                    model: dict = None) -> Scanner:
+    """
+    Kết nối MT5 và tạo Scanner với kho nến của server. Không truyền login thì dùng tài khoản đang mở trên terminal.
+    model: mô hình tính nghiệm dạng dict (ModelSpec.to_dict, để truyền được sang tiến trình con), None: mô hình gốc.
+    Ném RuntimeError nếu không kết nối được.
+    """
+    import MetaTrader5 as mt5 # Chỉ import khi cần kết nối, để phần tính toán dùng được không cần MT5
+    credentials = {'login': login, 'password': password, 'server': server} if login else {}
+    if not mt5.initialize(**credentials):
+        raise RuntimeError(f"Không thể kết nối MT5: {mt5.last_error()}")
+    account = mt5.account_info()
+    server_name = server or getattr(account, 'server', None) or "default"
+    store_dir = store_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "bar_store")
+    return Scanner(mt5, BarStore(os.path.join(store_dir, server_name), mt5), min_history=min_history,
+                   model=ModelSpec.from_dict(model) if model else None)
+
+
+def scan_symbol(scanner: Scanner, symbol: str, timeframes: list, resolve: bool = True) -> tuple:
+    """
+    Tính mọi khung thời gian của một symbol. resolve: symbol là tên gốc cần tìm trên server (ví dụ "EURUSD"),
+    False khi đã là tên chính xác (quét toàn bộ). Trả về (tên symbol trên server hoặc tên gốc,
+    {khung thời gian: kết quả tính toán hoặc Exception}, thời gian xử lý tính bằng giây).
+    """
+    started = time.perf_counter()
+    terminal = scanner.terminal
+    try:
+        name = scanner.find_symbol(symbol) if resolve else symbol
+        if not terminal.symbol_select(name, True):
+            raise RuntimeError(f"Không bật được symbol {name} trên MT5.")
+        symbol_info = terminal.symbol_info(name)
+        if symbol_info is None:
+            raise RuntimeError(f"Không lấy được thông tin symbol {name}.")
+    except RuntimeError as e:
+        return symbol, {tf_str: e for tf_str in timeframes}, time.perf_counter() - started
+    return name, scanner.evaluate_symbol(name, timeframes, symbol_info), time.perf_counter() - started
+
+
+_worker_scanner = None  # Scanner của tiến trình con (mỗi tiến trình một kết nối MT5)
+
+
+def _init_scan_worker(connection: dict):
+    global _worker_scanner
+    _worker_scanner = connect_scanner(**connection)
+
+
+def _scan_symbol_task(symbol: str, timeframes: list, resolve: bool) -> tuple:
+    return scan_symbol(_worker_scanner, symbol, timeframes, resolve)
+
+
+def iter_scan(symbols, timeframes, workers: int = 1, scanner: Scanner = None, connection: dict = None,
+              resolve: bool = True):
+    """
+    Quét các symbol, trả về dần (generator) (symbol đầu vào, tên trên server, kết quả, thời gian) theo thứ tự hoàn thành.
+    - workers <= 1: chạy tuần tự với scanner đã kết nối.
+    - workers > 1: chia symbol cho một process pool (spawn); mỗi tiến trình con kết nối MT5 riêng bằng connection
+      (login, password, server, store_dir, min_history, model). Mỗi symbol chỉ do một tiến trình xử lý,
+      nên các file kho nến không bị ghi đồng thời.
+    """
+    if workers <= 1:
+        for symbol in symbols:
+            yield (symbol,) + scan_symbol(scanner, symbol, timeframes, resolve)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_scan_worker,
+                               initargs=(connection or {},))
+    try:
+        futures = {pool.submit(_scan_symbol_task, symbol, timeframes, resolve): symbol for symbol in symbols}
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
+    finally:
+        # Dừng giữa chừng (generator bị đóng): hủy các symbol chưa bắt đầu thay vì chờ quét hết
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,520 @@
+import sys
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import argparse
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+
+
+# --- API trạng thái chỉ-đọc của engine (HTTP + WebSocket, chỉ thư viện chuẩn) ---
+# Engine (BreakevenProtector) gọi StateServer.publish() mỗi chu kỳ GUI với trạng thái đã tính sẵn; publish chỉ
+# gửi tham chiếu sang luồng server (asyncio) rồi trả về ngay, không serialize, không chờ client nào.
+# Luồng server so sánh với trạng thái trước, tăng version khi có thay đổi và phát delta cho các client WebSocket.
+#
+# Trạng thái là dict các mục (section), mỗi mục là dict một tầng: positions (theo ticket), triggers (theo id),
+# account, cycle_stats, scheduler. Delta của một mục: {'set': {khóa: giá trị mới}, 'del': [khóa đã mất]}.
+# Mỗi client WebSocket có hàng đợi giới hạn riêng; client chậm làm đầy hàng đợi thì hàng đợi bị bỏ và client
+# nhận lại snapshot đầy đủ khi kịp đọc (resync), nên client chậm không làm chậm engine hay client khác.
+
+STATE_API_HOST = "127.0.0.1"
+STATE_API_PORT = 8765
+DELTA_HISTORY = 256         # Số delta gần nhất giữ lại cho client nối lại (?since=<version>)
+CLIENT_QUEUE_SIZE = 64      # Số gói tối đa chờ gửi cho một client trước khi chuyển sang resync
+HEARTBEAT_INTERVAL = 5.0    # Không có thay đổi lâu hơn (giây) thì gửi heartbeat để client biết engine còn chạy
+SEND_TIMEOUT = 30.0         # Client không nhận dữ liệu lâu hơn (giây) thì bị ngắt
+REQUEST_TIMEOUT = 10.0      # Thời gian tối đa chờ client gửi xong request HTTP
+MAX_HEADER_SIZE = 16384
+MAX_CLIENT_FRAME = 65536    # Client chỉ gửi ping/close, khung lớn hơn bị coi là lỗi
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+HTTP_REASONS = {101: 'Switching Protocols', 200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed'}
+_MISSING = object()
+
+
+# --- Trạng thái và delta ---
+def _plain(value):
+    """Giá trị JSON được: namedtuple (PositionRow...) thành dict, dict/list giữ nguyên cấu trúc."""
+    if hasattr(value, '_asdict'):
+        return {key: _plain(item) for key, item in value._asdict().items()}
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def normalize_state(state: dict) -> dict:
+    """Trạng thái engine gửi sang thành dict các mục, khóa dạng chuỗi (khóa JSON), giá trị JSON được."""
+    return {section: {str(key): _plain(value) for key, value in (values or {}).items()}
+            for section, values in state.items()}
+
+
+def diff_state(old: dict, new: dict) -> dict:
+    """Delta từ old sang new theo từng mục; mục không đổi không xuất hiện. Trả về {} nếu không có thay đổi."""
+    changes = {}
+    for section, values in new.items():
+        previous = old.get(section, {})
+        updated = {key: value for key, value in values.items() if previous.get(key, _MISSING) != value}
+        removed = [key for key in previous if key not in values]
+        if updated or removed:
+            changes[section] = {'set': updated, 'del': removed}
+    for section, values in old.items():
+        if section not in new and values:
+            changes[section] = {'set': {}, 'del': list(values)}
+    return changes
+
+
+def apply_delta(state: dict, changes: dict) -> dict:
+    """Áp dụng delta (diff_state) lên bản trạng thái phía client (sửa tại chỗ) và trả về chính nó."""
+    for section, change in changes.items():
+        values = state.setdefault(section, {})
+        values.update(change['set'])
+        for key in change['del']:
+            values.pop(key, None)
+    return state
+
+
+# --- Khung WebSocket (RFC 6455) ---
+def ws_accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def ws_frame(payload: bytes, opcode: int = OP_TEXT) -> bytes:
+    """Khung không chia mảnh, không mặt nạ (khung từ server gửi tới client)."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_ws_frame(reader, max_size: int = MAX_CLIENT_FRAME) -> tuple:
+    """Đọc một khung, bỏ mặt nạ nếu có. Trả về (opcode, payload); ValueError nếu khung quá lớn."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > max_size:
+        raise ValueError(f"Khung WebSocket quá lớn ({length} byte)")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class _StreamClient:
+    """Một client WebSocket: hàng đợi khung chờ gửi có giới hạn, cờ resync khi hàng đợi bị tràn."""
+    __slots__ = ('peer', 'frames', 'wakeup', 'resync', 'since', 'sent', 'resyncs', 'connected_at')
+
+    def __init__(self, peer, since=None):
+        self.peer = peer
+        self.frames = deque()
+        self.wakeup = asyncio.Event()
+        self.resync = True      # Gói đầu tiên luôn là snapshot (hoặc các delta còn thiếu nếu có since)
+        self.since = since
+        self.sent = 0
+        self.resyncs = 0
+        self.connected_at = time.time()
+
+
+# --- Server ---
+class StateServer:
+    """
+    Server HTTP + WebSocket chỉ-đọc chạy trên luồng riêng (asyncio), phát trạng thái engine cho dashboard/cảnh báo
+    mà không cần kết nối MT5 riêng. Các đường dẫn (GET):
+      /state            snapshot đầy đủ {type, version, time, state}
+      /state/<mục>      một mục của snapshot
+      /delta?since=N    các delta sau version N (hoặc snapshot nếu N quá cũ)
+      /health           thống kê server (số client, độ trễ publish, số lần resync...)
+      /ws[?since=N]     WebSocket: snapshot (hoặc các delta còn thiếu) rồi delta mỗi khi trạng thái đổi
+    """
+    def __init__(self, host=STATE_API_HOST, port=STATE_API_PORT, logger=None, history=DELTA_HISTORY,
+                 client_queue=CLIENT_QUEUE_SIZE, heartbeat=HEARTBEAT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self.client_queue = client_queue
+        self.heartbeat = heartbeat
+
+        # Chỉ luồng server đọc/ghi các thuộc tính dưới đây; state được thay nguyên khối, không sửa tại chỗ
+        self.version = 0
+        self.state = {}
+        self.published_at = None
+        self._history = deque(maxlen=history)   # Các gói delta gần nhất (dict), version tăng dần
+        self._clients = set()
+        self._last_broadcast = 0.0
+        self._snapshot_cache = None              # (version, khung WebSocket của snapshot)
+
+        # Bàn giao từ engine: chỉ giữ trạng thái mới nhất, các lần publish dồn lại trước khi server kịp xử lý
+        self._pending = None
+        self._wake_scheduled = False
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self.counters = {'published': 0, 'coalesced': 0, 'deltas': 0, 'heartbeats': 0, 'frames_sent': 0,
+                         'resyncs': 0, 'http_requests': 0, 'ws_clients_total': 0, 'ws_dropped': 0}
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.log(message)
+
+    # --- Vòng đời ---
+    def start(self, timeout=5.0) -> bool:
+        """Mở cổng và chạy vòng lặp asyncio trên luồng nền. Trả về False (và ghi log) nếu không mở được cổng."""
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                self._server = loop.run_until_complete(
+                    asyncio.start_server(self._handle_connection, self.host, self.port, limit=MAX_HEADER_SIZE))
+            except OSError as e:
+                errors.append(e)
+                loop.close()
+                ready.set()
+                return
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._loop = loop
+            ready.set()
+            try:
+                loop.run_forever()
+            finally:
+                self._loop = None
+                self._server.close()
+                tasks = asyncio.all_tasks(loop)
+                for task in tasks:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                loop.run_until_complete(self._server.wait_closed())
+                loop.close()
+
+        self._thread = threading.Thread(target=run, name="state-api", daemon=True)
+        self._thread.start()
+        ready.wait(timeout)
+        if errors or self._loop is None:
+            self._log(f"Không mở được API trạng thái tại {self.host}:{self.port}: "
+                      f"{errors[0] if errors else 'quá thời gian chờ'}")
+            return False
+        self._log(f"API trạng thái chỉ-đọc: http://{self.host}:{self.port}/state, ws://{self.host}:{self.port}/ws")
+        return True
+
+    def stop(self, timeout=5.0):
+        """Đóng mọi kết nối và dừng luồng server."""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    # --- Phía engine ---
+    def publish(self, state: dict):
+        """
+        Gọi từ luồng engine: đưa trạng thái mới nhất (dict các mục) sang luồng server và trả về ngay.
+        Các mục/dòng đã gửi không được sửa tại chỗ sau đó (engine luôn tạo dict/tuple mới cho mỗi chu kỳ).
+        """
+        loop = self._loop
+        if loop is None:
+            return
+        self.counters['published'] += 1
+        self._pending = state
+        if self._wake_scheduled:
+            self.counters['coalesced'] += 1
+            return
+        self._wake_scheduled = True
+        try:
+            loop.call_soon_threadsafe(self._apply_pending)
+        except RuntimeError:
+            pass # Vòng lặp vừa dừng
+
+    # --- Phía server (luồng asyncio) ---
+    def _apply_pending(self):
+        self._wake_scheduled = False
+        state, self._pending = self._pending, None
+        if state is None:
+            return
+        now = time.time()
+        new_state = normalize_state(state)
+        changes = diff_state(self.state, new_state)
+        self.state = new_state
+        self.published_at = now
+        if changes:
+            self.version += 1
+            message = {'type': 'delta', 'version': self.version, 'time': now, 'changes': changes}
+            self._history.append(message)
+            self.counters['deltas'] += 1
+            self._broadcast(message)
+        elif now - self._last_broadcast >= self.heartbeat:
+            self.counters['heartbeats'] += 1
+            self._broadcast({'type': 'heartbeat', 'version': self.version, 'time': now})
+
+    def _broadcast(self, message: dict):
+        """Đưa một gói (serialize một lần) vào hàng đợi của mọi client; hàng đợi đầy thì client chuyển sang resync."""
+        self._last_broadcast = message['time']
+        if not self._clients:
+            return
+        frame = ws_frame(_encode(message))
+        for client in self._clients:
+            if client.resync:
+                continue # Snapshot gửi sau sẽ bao gồm thay đổi này
+            if len(client.frames) >= self.client_queue:
+                client.frames.clear()
+                client.resync = True
+                client.resyncs += 1
+                self.counters['resyncs'] += 1
+            else:
+                client.frames.append(frame)
+            client.wakeup.set()
+
+    def snapshot(self) -> dict:
+        return {'type': 'snapshot', 'version': self.version, 'time': self.published_at, 'state': self.state}
+
+    def _snapshot_frame(self) -> bytes:
+        if self._snapshot_cache is None or self._snapshot_cache[0] != self.version:
+            self._snapshot_cache = (self.version, ws_frame(_encode(self.snapshot())))
+        return self._snapshot_cache[1]
+
+    def deltas_since(self, since):
+        """Các gói delta sau version since, hoặc None nếu lịch sử không còn đủ (client phải lấy snapshot)."""
+        if since is None or since > self.version:
+            return None
+        if since == self.version:
+            return []
+        if not self._history or self._history[0]['version'] > since + 1:
+            return None
+        return [message for message in self._history if message['version'] > since]
+
+    def health(self) -> dict:
+        now = time.time()
+        return dict(self.counters, version=self.version, clients=len(self._clients),
+                    publish_age=round(now - self.published_at, 3) if self.published_at else None,
+                    history=len(self._history),
+                    client_backlog=max((len(client.frames) for client in self._clients), default=0))
+
+    # --- HTTP ---
+    async def _handle_connection(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+            if request is None:
+                return
+            method, target, headers = request
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            since = _int_or_none(query.get('since', [None])[0])
+            if headers.get('upgrade', '').lower() == 'websocket':
+                await self._serve_websocket(reader, writer, headers, since)
+                return
+            self.counters['http_requests'] += 1
+            if method not in ('GET', 'HEAD'):
+                status, body = 405, {'error': "API chỉ-đọc, chỉ hỗ trợ GET"}
+            else:
+                status, body = self._route(url.path.rstrip('/') or '/', since)
+            await self._send_http(writer, status, _encode(body), head_only=method == 'HEAD')
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass # Server đang dừng; tác vụ kết nối là tác vụ gốc, không ai chờ kết quả của nó
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            raw = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            return None
+        lines = raw.decode('latin-1').split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        return parts[0].upper(), parts[1], headers
+
+    def _route(self, path, since):
+        if path in ('/', '/state'):
+            return 200, self.snapshot()
+        if path.startswith('/state/'):
+            section = path[len('/state/'):]
+            if section not in self.state:
+                return 404, {'error': f"Không có mục '{section}'", 'sections': sorted(self.state)}
+            return 200, {'version': self.version, 'time': self.published_at, section: self.state[section]}
+        if path == '/delta':
+            deltas = self.deltas_since(since)
+            if deltas is None:
+                return 200, self.snapshot()
+            return 200, {'type': 'deltas', 'version': self.version, 'deltas': deltas}
+        if path == '/health':
+            return 200, self.health()
+        return 404, {'error': "Không tìm thấy", 'paths': ['/state', '/state/<mục>', '/delta?since=N', '/health', '/ws']}
+
+    async def _send_http(self, writer, status, body, head_only=False):
+        writer.write((f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                      f"Content-Type: application/json; charset=utf-8\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Cache-Control: no-store\r\n"
+                      f"Access-Control-Allow-Origin: *\r\n"
+                      f"Connection: close\r\n\r\n").encode('latin-1'))
+        if not head_only:
+            writer.write(body)
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+    # --- WebSocket ---
+    async def _serve_websocket(self, reader, writer, headers, since):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            await self._send_http(writer, 400, _encode({'error': "Thiếu Sec-WebSocket-Key"}))
+            return
+        writer.write((f"HTTP/1.1 101 {HTTP_REASONS[101]}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {ws_accept_key(key)}\r\n\r\n").encode('latin-1'))
+        client = _StreamClient(writer.get_extra_info('peername'), since)
+        client.wakeup.set()
+        self._clients.add(client)
+        self.counters['ws_clients_total'] += 1
+        sender = asyncio.ensure_future(self._ws_sender(client, writer))
+        receiver = asyncio.ensure_future(self._ws_receiver(reader, writer))
+        try:
+            done, _ = await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+            if sender in done and sender.exception() is not None:
+                self.counters['ws_dropped'] += 1
+        finally:
+            self._clients.discard(client)
+            sender.cancel()
+            receiver.cancel()
+            await asyncio.gather(sender, receiver, return_exceptions=True)
+
+    async def _ws_sender(self, client, writer):
+        """Gửi hàng đợi của client; chỉ tác vụ này chờ khi client đọc chậm."""
+        while True:
+            await client.wakeup.wait()
+            client.wakeup.clear()
+            if client.resync:
+                client.resync = False
+                client.frames.clear()
+                deltas = self.deltas_since(client.since)
+                client.since = None
+                frames = [ws_frame(_encode(message)) for message in deltas] if deltas is not None \
+                    else [self._snapshot_frame()]
+            else:
+                frames = list(client.frames)
+                client.frames.clear()
+            if not frames:
+                continue
+            writer.writelines(frames)
+            client.sent += len(frames)
+            self.counters['frames_sent'] += len(frames)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+    async def _ws_receiver(self, reader, writer):
+        """Client chỉ được gửi ping/close; mọi dữ liệu khác bị bỏ qua (API chỉ-đọc)."""
+        while True:
+            opcode, payload = await read_ws_frame(reader)
+            if opcode == OP_CLOSE:
+                writer.write(ws_frame(payload[:2], OP_CLOSE))
+                return
+            if opcode == OP_PING:
+                writer.write(ws_frame(payload, OP_PONG))
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# --- Client theo dõi (dòng lệnh) ---
+async def watch_state(host: str, port: int, on_message, since=None):
+    """Kết nối WebSocket tới StateServer và gọi on_message(gói, trạng thái đã áp dụng) cho mỗi gói nhận được."""
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(struct.pack('!QQ', time.time_ns(), id(writer))).decode()
+    path = "/ws" if since is None else f"/ws?since={since}"
+    writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode('latin-1'))
+    response = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    if ' 101 ' not in response.split('\r\n', 1)[0] or ws_accept_key(key) not in response:
+        writer.close()
+        raise ConnectionError(f"Server không chấp nhận WebSocket: {response.splitlines()[0]}")
+    state = {}
+    try:
+        while True:
+            opcode, payload = await read_ws_frame(reader, max_size=1 << 30)
+            if opcode == OP_CLOSE:
+                return
+            if opcode != OP_TEXT:
+                continue
+            message = json.loads(payload)
+            if message['type'] == 'snapshot':
+                state = message['state']
+            elif message['type'] == 'delta':
+                apply_delta(state, message['changes'])
+            on_message(message, state)
+    finally:
+        writer.close()
+
+
+def format_state_line(message: dict, state: dict) -> str:
+    """Một dòng tóm tắt trạng thái cho người theo dõi."""
+    account = state.get('account', {})
+    pnl = ", ".join(f"{label} {account[key]:.2f}" if account.get(key) is not None else f"{label} -"
+                    for key, label in (('floating_pnl', "P/L nổi"), ('daily_pnl', "P/L ngày")))
+    stamp = time.strftime('%H:%M:%S', time.localtime(message.get('time') or time.time()))
+    return (f"[{stamp}] v{message['version']} {message['type']}: lệnh mở {len(state.get('positions', {}))}, "
+            f"trigger {len(state.get('triggers', {}))}, {pnl}")
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Theo dõi trạng thái engine qua API chỉ-đọc (không cần kết nối MT5)."""
+    parser = argparse.ArgumentParser(description="Theo dõi trạng thái Breakeven Protector qua API chỉ-đọc")
+    parser.add_argument('--host', default=STATE_API_HOST, help="Địa chỉ API trạng thái")
+    parser.add_argument('--port', type=int, default=STATE_API_PORT, help="Cổng API trạng thái")
+    parser.add_argument('--since', type=int, help="Chỉ nhận các delta sau version này (nếu server còn giữ)")
+    parser.add_argument('--json', action='store_true', help="In nguyên gói JSON thay cho dòng tóm tắt")
+    args = parser.parse_args(argv)
+
+    def on_message(message, state):
+        if args.json:
+            print(json.dumps(message, ensure_ascii=False), flush=True)
+        elif message['type'] != 'heartbeat':
+            print(format_state_line(message, state), flush=True)
+
+    try:
+        asyncio.run(watch_state(args.host, args.port, on_message, args.since))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+        print(f"Mất kết nối tới API trạng thái {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,479 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import namedtuple, deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# --- Bộ đệm tick dùng chung giữa các tiến trình (shared memory) ---
+# Một tiến trình dịch vụ (TickCachePublisher) hỏi terminal MT5 một lần cho mỗi chu kỳ và ghi tick/thông số
+# mới nhất của từng symbol vào vùng nhớ dùng chung; bot (Bot manage MT5 V1.py) và scanner (calculated) chỉ đọc
+# vùng nhớ này (TickCacheReader) thay vì tự hỏi terminal, nên tải IPC lên terminal không nhân theo số công cụ.
+#
+# Bố cục: header + mảng slot cố định, mỗi symbol một slot. Mỗi slot chứa:
+# - vòng tick: RING_DEPTH bản ghi kích thước cố định và bộ đếm tick_seq (số bản ghi đã ghi). Bên ghi ghi bản ghi
+#   vào vị trí tick_seq % RING_DEPTH rồi mới tăng tick_seq; bên đọc đọc bản ghi mới nhất rồi kiểm tra lại tick_seq
+#   để biết bản ghi có bị ghi đè trong lúc đọc không (không cần khóa, bên ghi không bao giờ phải chờ bên đọc).
+# - thông số symbol (digits, point, stops_level...): seqlock spec_seq, lẻ trong lúc ghi, chẵn khi đã ghi xong.
+# Chỉ có một bên ghi (dịch vụ), slot không bao giờ được dùng lại cho symbol khác trong một thế hệ (generation).
+
+TICK_CACHE_NAME = "mt5_tick_cache"
+TICK_CACHE_MAGIC = 0x4D54354B43414348  # "MT5KCACH"
+TICK_CACHE_VERSION = 1
+DEFAULT_CAPACITY = 2048  # Số symbol tối đa
+RING_DEPTH = 8           # Số tick gần nhất giữ lại cho mỗi symbol
+SYMBOL_NAME_SIZE = 32
+
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u8'), ('version', '<u4'), ('capacity', '<u4'), ('depth', '<u4'), ('symbol_count', '<u4'),
+    ('generation', '<i8'),      # Thời điểm (ns) dịch vụ khởi tạo vùng nhớ; đổi khi dịch vụ chạy lại
+    ('publisher_pid', '<i8'),
+    ('heartbeat_ns', '<i8'),    # Thời điểm (time.time_ns) chu kỳ hỏi terminal gần nhất kết thúc
+    ('cycles', '<u8'),
+    ('last_cycle_ns', '<i8'),   # Thời gian chạy của chu kỳ gần nhất
+], align=True)
+TICK_RECORD_DTYPE = np.dtype([
+    ('time_msc', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'), ('flags', '<u4'),
+    ('published_ns', '<i8'),    # Thời điểm dịch vụ ghi bản ghi này (khi tick thay đổi)
+], align=True)
+SLOT_DTYPE = np.dtype([
+    ('symbol', f'S{SYMBOL_NAME_SIZE}'),
+    ('tick_seq', '<u8'),
+    ('checked_ns', '<i8'),      # Thời điểm dịch vụ hỏi tick của symbol lần gần nhất (kể cả khi tick không đổi)
+    ('spec_seq', '<u8'),
+    ('digits', '<i4'), ('point', '<f8'), ('stops_level', '<i4'), ('freeze_level', '<i4'),
+    ('trade_mode', '<i4'), ('visible', '<u1'), ('filling_mode', '<i4'),
+    ('volume_min', '<f8'), ('volume_max', '<f8'), ('volume_step', '<f8'), ('trade_contract_size', '<f8'),
+    ('ticks', TICK_RECORD_DTYPE, (RING_DEPTH,)),
+], align=True)
+SPEC_FIELDS = ('digits', 'point', 'stops_level', 'freeze_level', 'trade_mode', 'visible', 'filling_mode',
+               'volume_min', 'volume_max', 'volume_step', 'trade_contract_size')
+
+# Cùng tên thuộc tính với Tick/SymbolInfo của MetaTrader5, để code dùng chung được hai nguồn dữ liệu
+CachedTick = namedtuple('CachedTick', ['time', 'time_msc', 'bid', 'ask', 'last', 'volume', 'flags'])
+CachedSymbolInfo = namedtuple('CachedSymbolInfo', ('name',) + SPEC_FIELDS)
+
+
+def cache_size(capacity: int) -> int:
+    return HEADER_DTYPE.itemsize + capacity * SLOT_DTYPE.itemsize
+
+
+def _views(buffer, capacity: int) -> tuple:
+    """Header và mảng slot dạng numpy trên vùng nhớ dùng chung (không sao chép)."""
+    header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=buffer)
+    slots = np.ndarray((capacity,), dtype=SLOT_DTYPE, buffer=buffer, offset=HEADER_DTYPE.itemsize)
+    return header, slots
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Mở vùng nhớ đã có mà không đăng ký với resource_tracker: trên POSIX, Python < 3.13 đăng ký cả vùng nhớ
+    chỉ được mở (không tạo) và xóa nó khi tiến trình đọc thoát. Chỉ dịch vụ quản lý vòng đời vùng nhớ.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+# --- Bên ghi (dịch vụ) ---
+class TickCachePublisher:
+    """
+    Dịch vụ dữ liệu thị trường: hỏi terminal tick của các symbol cần theo dõi mỗi chu kỳ và thông số symbol
+    (symbol_info) thưa hơn, rồi ghi vào vùng nhớ dùng chung. Chỉ ghi bản ghi tick mới khi tick thay đổi.
+    terminal: module MetaTrader5 đã kết nối.
+    """
+    def __init__(self, terminal, name: str = TICK_CACHE_NAME, capacity: int = DEFAULT_CAPACITY):
+        self.terminal = terminal
+        self.name = name
+        self.capacity = capacity
+        self._owner = True
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=cache_size(capacity))
+        except FileExistsError:
+            # Vùng nhớ còn lại từ lần chạy trước (bên đọc còn giữ trên Windows, hoặc tiến trình cũ bị tắt ngang):
+            # dùng lại nếu cùng kích thước, thế hệ mới báo cho bên đọc xây lại chỉ mục symbol
+            self._shm = _attach(name)
+            self._owner = False
+            if self._shm.size < cache_size(capacity):
+                self._shm.close()
+                raise RuntimeError(f"Vùng nhớ '{name}' đã tồn tại với kích thước khác; hãy dừng tiến trình đang dùng nó.")
+        self._header, self._slots = _views(self._shm.buf, capacity)
+        # Đổi thế hệ và xóa danh sách symbol trước, rồi mới xóa nội dung slot
+        header = self._header[0]
+        header['symbol_count'] = 0
+        header['heartbeat_ns'] = 0
+        header['generation'] = time.time_ns()
+        header['magic'] = TICK_CACHE_MAGIC
+        header['version'] = TICK_CACHE_VERSION
+        header['capacity'] = capacity
+        header['depth'] = RING_DEPTH
+        header['publisher_pid'] = 0
+        header['cycles'] = 0
+        self._slots['tick_seq'] = 0
+        self._slots['spec_seq'] = 0
+        self._slots['symbol'] = b''
+
+        self._index = {}       # Key: symbol, Value: chỉ số slot
+        self._last_ticks = {}  # Key: symbol, Value: (time_msc, bid, ask, last) đã ghi
+        self.ticks_published = 0
+        self.spec_updates = 0
+        self.dropped_symbols = set() # Symbol không ghi được vì hết slot
+
+    def close(self):
+        """Đóng vùng nhớ; dịch vụ tạo vùng nhớ thì xóa luôn (bên đọc đang mở vẫn dùng được đến khi đóng)."""
+        self._header = self._slots = None
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _slot_for(self, symbol: str):
+        index = self._index.get(symbol)
+        if index is not None:
+            return index
+        count = int(self._header['symbol_count'][0])
+        encoded = symbol.encode('utf-8')
+        if count >= self.capacity or len(encoded) > SYMBOL_NAME_SIZE:
+            self.dropped_symbols.add(symbol)
+            return None
+        self._slots['symbol'][count] = encoded
+        self._index[symbol] = count
+        return count
+
+    def publish_spec(self, symbol: str, info) -> bool:
+        """Ghi thông số symbol (seqlock). Slot mới chỉ được công bố cho bên đọc sau khi có thông số."""
+        index = self._slot_for(symbol)
+        if index is None:
+            return False
+        slots = self._slots
+        slots['spec_seq'][index] += 1 # Lẻ: đang ghi
+        for field in SPEC_FIELDS:
+            slots[field][index] = getattr(info, field, 0) or 0
+        slots['spec_seq'][index] += 1 # Chẵn: ghi xong
+        self.spec_updates += 1
+        if index == int(self._header['symbol_count'][0]):
+            self._header['symbol_count'][0] = index + 1
+        return True
+
+    def publish_tick(self, symbol: str, tick, now_ns: int) -> bool:
+        """Ghi tick vào vòng tick của symbol nếu đã thay đổi. Trả về True nếu có bản ghi mới."""
+        index = self._index.get(symbol)
+        if index is None:
+            return False # Chưa có thông số symbol
+        slots = self._slots
+        slots['checked_ns'][index] = now_ns
+        key = (tick.time_msc, tick.bid, tick.ask, tick.last)
+        if self._last_ticks.get(symbol) == key:
+            return False
+        self._last_ticks[symbol] = key
+        seq = int(slots['tick_seq'][index])
+        record = slots['ticks'][index, seq % RING_DEPTH]
+        record['time_msc'] = tick.time_msc
+        record['bid'] = tick.bid
+        record['ask'] = tick.ask
+        record['last'] = tick.last
+        record['volume'] = getattr(tick, 'volume', 0)
+        record['flags'] = getattr(tick, 'flags', 0)
+        record['published_ns'] = now_ns
+        slots['tick_seq'][index] = seq + 1 # Công bố bản ghi sau khi đã ghi đầy đủ
+        self.ticks_published += 1
+        return True
+
+    def watched_symbols(self, symbols=(), market_watch: bool = True) -> list:
+        """Symbol cần theo dõi: danh sách chỉ định cộng các symbol đang hiển thị trong Market Watch của terminal."""
+        names = list(symbols)
+        if market_watch:
+            names.extend(s.name for s in self.terminal.symbols_get() or () if s.visible)
+        return list(dict.fromkeys(names))
+
+    def run(self, stop_event: threading.Event, interval: float = 0.1, spec_interval: float = 5.0,
+            symbols=(), market_watch: bool = True, symbols_interval: float = 2.0):
+        """
+        Vòng lặp dịch vụ: mỗi interval giây hỏi tick của mọi symbol đang theo dõi; danh sách symbol (Market Watch)
+        được làm mới mỗi symbols_interval giây, thông số symbol mỗi spec_interval giây.
+        Bot/scanner thêm symbol vào Market Watch (symbol_select) thì dịch vụ tự theo dõi symbol đó.
+        """
+        self._header['publisher_pid'][0] = os.getpid()
+        watched, next_symbols, next_specs = [], 0.0, 0.0
+        while not stop_event.is_set():
+            started = time.perf_counter()
+            if started >= next_symbols:
+                watched = self.watched_symbols(symbols, market_watch)
+                next_symbols = started + symbols_interval
+            if started >= next_specs:
+                for symbol in watched:
+                    info = self.terminal.symbol_info(symbol)
+                    if info is not None:
+                        self.publish_spec(symbol, info)
+                next_specs = started + spec_interval
+            now_ns = time.time_ns()
+            for symbol in watched:
+                if symbol not in self._index:
+                    info = self.terminal.symbol_info(symbol) # Symbol mới thêm vào Market Watch
+                    if info is None or not self.publish_spec(symbol, info):
+                        continue
+                tick = self.terminal.symbol_info_tick(symbol)
+                if tick is not None:
+                    self.publish_tick(symbol, tick, now_ns)
+            header = self._header[0]
+            header['last_cycle_ns'] = int((time.perf_counter() - started) * 1e9)
+            header['cycles'] += 1
+            header['heartbeat_ns'] = time.time_ns()
+            stop_event.wait(max(0.0, interval - (time.perf_counter() - started)))
+
+    def summary(self) -> str:
+        header = self._header[0]
+        return (f"{int(header['symbol_count'])} symbol, {int(header['cycles'])} chu kỳ "
+                f"({int(header['last_cycle_ns']) / 1e6:.1f}ms), {self.ticks_published} tick, "
+                f"{self.spec_updates} lần cập nhật thông số")
+
+
+# --- Bên đọc ---
+class TickCacheReader:
+    """
+    Đọc tick/thông số symbol từ vùng nhớ dùng chung mà không khóa và không gọi terminal.
+    Nếu dịch vụ chưa chạy, tự thử mở lại vùng nhớ tối đa mỗi retry_interval giây; available() cho biết có dùng
+    được không (dịch vụ còn sống: heartbeat mới hơn max_age giây). Khi không dùng được, hoặc khi dịch vụ không
+    còn hỏi symbol đó (checked_ns của slot cũ hơn max_age giây, ví dụ symbol bị bỏ khỏi Market Watch), các hàm
+    đọc trả về None để bên gọi tự lấy từ terminal.
+    Thống kê của từng bên đọc: số lần đọc/trúng/trượt/đọc lại, độ cũ dữ liệu (thời gian từ lần dịch vụ hỏi tick
+    tới lúc đọc) và tần suất tick mới của mỗi symbol.
+    """
+    def __init__(self, name: str = TICK_CACHE_NAME, max_age: float = 2.0, retry_interval: float = 5.0):
+        self.name = name
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        self._shm = None
+        self._header = self._slots = None
+        self._generation = None
+        self._index = {}          # Key: symbol, Value: chỉ số slot
+        self._indexed_count = 0
+        self._next_attach = 0.0
+        # Thống kê
+        self.reads = 0
+        self.hits = 0
+        self.misses = 0
+        self.retries = 0
+        self.staleness = deque(maxlen=1024)  # Độ cũ (giây) của các lần đọc gần đây
+        self.staleness_max = 0.0
+        self._rate_origin = {}    # Key: symbol, Value: (tick_seq, time.monotonic()) lần đọc đầu tiên
+        self._rate_latest = {}    # Key: symbol, Value: (tick_seq, time.monotonic()) lần đọc gần nhất
+
+    # --- Kết nối vùng nhớ ---
+    def _try_attach(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_attach:
+            return False
+        self._next_attach = now + self.retry_interval
+        try:
+            shm = _attach(self.name)
+        except (FileNotFoundError, OSError, ValueError):
+            return False
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)[0]
+        if int(header['magic']) != TICK_CACHE_MAGIC or int(header['version']) != TICK_CACHE_VERSION \
+           or int(header['depth']) != RING_DEPTH or shm.size < cache_size(int(header['capacity'])):
+            del header
+            shm.close()
+            return False
+        self._shm = shm
+        self._header, self._slots = _views(shm.buf, int(header['capacity']))
+        return True
+
+    def close(self):
+        self._header = self._slots = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def reattach(self):
+        """Đóng vùng nhớ đang mở và cho phép mở lại ngay (ví dụ sau khi kết nối lại, dịch vụ có thể đã chạy lại)."""
+        self.close()
+        self._next_attach = 0.0
+
+    def available(self) -> bool:
+        """Vùng nhớ đã mở và dịch vụ còn cập nhật (heartbeat không cũ hơn max_age giây)."""
+        if self._header is None and not self._try_attach():
+            return False
+        age = (time.time_ns() - int(self._header['heartbeat_ns'][0])) / 1e9
+        return age <= self.max_age
+
+    def publisher_age(self):
+        """Số giây từ chu kỳ gần nhất của dịch vụ, None nếu chưa mở được vùng nhớ."""
+        if self._header is None:
+            return None
+        return (time.time_ns() - int(self._header['heartbeat_ns'][0])) / 1e9
+
+    def _slot_index(self, symbol: str):
+        header = self._header[0]
+        generation = int(header['generation'])
+        if generation != self._generation:
+            # Dịch vụ chạy lại: chỉ mục cũ không còn đúng
+            self._generation = generation
+            self._index.clear()
+            self._indexed_count = 0
+            self._rate_origin.clear()
+            self._rate_latest.clear()
+        index = self._index.get(symbol)
+        if index is None:
+            count = int(header['symbol_count'])
+            if count > self._indexed_count:
+                names = self._slots['symbol'][self._indexed_count:count]
+                for offset, name in enumerate(names.tolist()):
+                    self._index[name.decode('utf-8')] = self._indexed_count + offset
+                self._indexed_count = count
+                index = self._index.get(symbol)
+        return index
+
+    # --- Đọc dữ liệu ---
+    def _slot_fresh(self, index: int) -> bool:
+        """Dịch vụ còn hỏi symbol của slot (checked_ns không cũ hơn max_age giây)."""
+        return (time.time_ns() - int(self._slots['checked_ns'][index])) / 1e9 <= self.max_age
+
+    def tick(self, symbol: str, max_retries: int = 8):
+        """Tick mới nhất của symbol (CachedTick), None nếu không có trong bộ đệm hoặc dịch vụ không chạy."""
+        self.reads += 1
+        if not self.available():
+            self.misses += 1
+            return None
+        index = self._slot_index(symbol)
+        if index is None:
+            self.misses += 1
+            return None
+        slots = self._slots
+        for _ in range(max_retries):
+            seq = int(slots['tick_seq'][index])
+            if seq == 0:
+                break
+            record = slots['ticks'][index, (seq - 1) % RING_DEPTH].copy()
+            checked_ns = int(slots['checked_ns'][index])
+            if (time.time_ns() - checked_ns) / 1e9 > self.max_age:
+                # Dịch vụ không còn hỏi symbol này: tick đã đóng băng, để bên gọi hỏi terminal
+                break
+            # Bản ghi (seq-1) chỉ bị ghi đè khi bên ghi đã ghi thêm RING_DEPTH-1 bản ghi trong lúc đọc
+            if int(slots['tick_seq'][index]) - seq < RING_DEPTH - 1:
+                self._record_read(symbol, seq, checked_ns)
+                time_msc = int(record['time_msc'])
+                return CachedTick(time_msc // 1000, time_msc, float(record['bid']), float(record['ask']),
+                                  float(record['last']), int(record['volume']), int(record['flags']))
+            self.retries += 1
+        self.misses += 1
+        return None
+
+    def symbol_info(self, symbol: str, max_retries: int = 8):
+        """Thông số symbol (CachedSymbolInfo), None nếu không có trong bộ đệm hoặc dịch vụ không chạy."""
+        if not self.available():
+            return None
+        index = self._slot_index(symbol)
+        if index is None or not self._slot_fresh(index):
+            return None
+        slots = self._slots
+        for _ in range(max_retries):
+            seq = int(slots['spec_seq'][index])
+            if seq % 2 == 0:
+                values = [slots[field][index].item() for field in SPEC_FIELDS]
+                if int(slots['spec_seq'][index]) == seq:
+                    return CachedSymbolInfo(symbol, *values)
+            self.retries += 1
+        return None
+
+    def _record_read(self, symbol: str, seq: int, checked_ns: int):
+        self.hits += 1
+        staleness = max(0.0, (time.time_ns() - checked_ns) / 1e9)
+        self.staleness.append(staleness)
+        self.staleness_max = max(self.staleness_max, staleness)
+        now = time.monotonic()
+        self._rate_origin.setdefault(symbol, (seq, now))
+        self._rate_latest[symbol] = (seq, now)
+
+    # --- Thống kê ---
+    def update_rates(self) -> dict:
+        """Số tick mới mỗi giây của từng symbol, tính từ lần đọc đầu tiên tới lần đọc gần nhất của bên đọc này."""
+        rates = {}
+        for symbol, (first_seq, first_time) in self._rate_origin.items():
+            last_seq, last_time = self._rate_latest[symbol]
+            if last_time > first_time:
+                rates[symbol] = (last_seq - first_seq) / (last_time - first_time)
+        return rates
+
+    def stats(self) -> dict:
+        recent = sorted(self.staleness)
+        rates = self.update_rates()
+        return {
+            'reads': self.reads,
+            'hits': self.hits,
+            'misses': self.misses,
+            'retries': self.retries,
+            'staleness_avg': sum(recent) / len(recent) if recent else 0.0,
+            'staleness_p95': recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+            'staleness_max': self.staleness_max,
+            'publisher_age': self.publisher_age(),
+            'symbols': len(rates),
+            'update_rate': sum(rates.values()),
+        }
+
+    def summary(self) -> str:
+        """Chuỗi thống kê ngắn để hiển thị trên nhãn trạng thái."""
+        if self._header is None:
+            return "Bộ đệm tick: chưa kết nối dịch vụ"
+        stats = self.stats()
+        return (f"Bộ đệm tick: {stats['hits']}/{stats['reads']} lần đọc trúng, đọc lại {stats['retries']}, "
+                f"độ cũ TB/p95/max {stats['staleness_avg'] * 1000:.0f}/{stats['staleness_p95'] * 1000:.0f}/"
+                f"{stats['staleness_max'] * 1000:.0f}ms, {stats['update_rate']:.1f} tick/giây ({stats['symbols']} symbol)")
+
+
+# --- Điểm vào dòng lệnh ---
+def main(argv=None):
+    """Chạy dịch vụ dữ liệu thị trường: hỏi terminal một lần, chia sẻ tick/thông số symbol qua shared memory."""
+    parser = argparse.ArgumentParser(description="Dịch vụ bộ đệm tick dùng chung cho bot và scanner")
+    parser.add_argument('--name', default=TICK_CACHE_NAME, help="Tên vùng nhớ dùng chung")
+    parser.add_argument('--symbols', default='', help="Symbol luôn theo dõi, cách nhau bởi dấu phẩy")
+    parser.add_argument('--no-market-watch', action='store_true', help="Không tự theo dõi các symbol trong Market Watch")
+    parser.add_argument('--interval', type=float, default=0.1, help="Chu kỳ hỏi tick (giây)")
+    parser.add_argument('--spec-interval', type=float, default=5.0, help="Chu kỳ làm mới thông số symbol (giây)")
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help="Số symbol tối đa")
+    parser.add_argument('--login', type=int, help="Login tài khoản (mặc định: tài khoản đang mở trên terminal)")
+    parser.add_argument('--password', help="Mật khẩu tài khoản")
+    parser.add_argument('--server', help="Server của tài khoản")
+    args = parser.parse_args(argv)
+
+    import MetaTrader5 as mt5 # Chỉ dịch vụ cần kết nối terminal
+    credentials = {'login': args.login, 'password': args.password, 'server': args.server} if args.login else {}
+    if not mt5.initialize(**credentials):
+        print(f"Không thể kết nối MT5: {mt5.last_error()}", file=sys.stderr)
+        return 1
+
+    symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    publisher = TickCachePublisher(mt5, args.name, args.capacity)
+    stop_event = threading.Event()
+    worker = threading.Thread(target=publisher.run, args=(stop_event, args.interval, args.spec_interval, symbols,
+                                                          not args.no_market_watch), daemon=True)
+    worker.start()
+    print(f"Dịch vụ bộ đệm tick '{args.name}' đang chạy (Ctrl+C để dừng)", file=sys.stderr)
+    try:
+        while worker.is_alive():
+            worker.join(10)
+            print(publisher.summary(), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        worker.join(5)
+        publisher.close()
+        mt5.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())